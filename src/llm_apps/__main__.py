@@ -0,0 +1,9 @@
+"""Run the `llm-apps` command as `python -m llm_apps`; see cli.py.
+"""
+
+import sys
+
+from .cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
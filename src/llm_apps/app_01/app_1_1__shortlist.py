@@ -2,21 +2,277 @@
 See app_01/README.md
 """
 
+from ..common_lib import dedup as cdd
+from ..common_lib import inbox as cib
 from ..common_lib import llms as cll
+from ..common_lib import metrics as cme
 from ..common_lib import misc_utils as clm
+from ..common_lib import parse_pool as cpp
+from ..common_lib import paths as cpa
+from ..common_lib import response_cache as crc
+from ..common_lib import result_store as crs
+from ..common_lib import structured_output as cso
 
 # Specify input and output directories
-DIR_INPUT_DOCX = "../data/app_01__job_search_assistant/1.1.1__to_review/"
-DIR_OUTPUT = "../data/app_01__job_search_assistant/1.1.9__output_summary/"
+DIR_INPUT_DOCX = cpa.DIR_DATA + "app_01__job_search_assistant/1.1.1__to_review/"
+DIR_OUTPUT = cpa.DIR_DATA + "app_01__job_search_assistant/1.1.9__output_summary/"
+DIR_REVIEWED_DOCX = cpa.DIR_DATA + "app_01__job_search_assistant/1.1.2__reviewed/"
 
-# Specify output filename (json and txt)
+# Specify output filename (jsonl, sqlite and txt)
 FNAME_OUTPUT = "1.1.9__shortlist"
 
-# Import API key as environment variable
-clm.load_dotenv_all()
+# The questions asked of each job description: the column for the answer, its type and the question
+QUESTIONS = [
+    ("role_title", "string", "What is the role title?"),
+    ("recruitment_consultancy", "string", "What is the recruitment consultancy?"),
+    ("company_name", "string", "What is the company name?"),
+    ("industry", "string", "In what industry does the company operate?"),
+    ("company_size", "string", "How many employees does the company have?"),
+    ("startup_or_established", "string", "Is it a startup environment or an established business?"),
+    ("remote_hybrid_onsite", "string", "Is the role remote, hybrid or onsite?"),
+    ("days_onsite", "string", "How many days onsite are expected?"),
+    ("location", "string", "What is the location?"),
+    ("salary_range", "string", "What is the available salary range?"),
+    ("line_management", "string", "Does the role involve line management, if so how many people?"),
+    ("project_funnel", "string", "Does the role involve maintaining a funnel of projects including prioritisation?"),
+    ("deep_learning", "string", "Does the role require a specialism in deep learning?"),
+    ("computer_vision", "string", "Does the role require a specialism in computer vision?"),
+    ("mlops", "string", "Does the role require a specialism in MLOps?"),
+    ("years_experience", "string", "How many years experience are required?"),
+    ("qualifications", "string", "What qualifications are required?"),
+    ("analytics_or_engineering", "string",
+     "Is the role focused more on analytics (e.g. requirements, feature engineering, model training) or engineering "
+     "(MLOps, model deployment and maintenance, cloud platforms)?"),
+    ("worrying_points", "string", "Are there any worrying points that would give you pause for thought?"),
+    ("spelling_mistakes", "string", "Are there any spelling mistakes in the job description?"),
+    ("tools_summary", "string", "Give a brief summary of the main data and analytical tools used."),
+    ("cloud_platforms", "string", "Which cloud platforms are used?"),
+    ("ai_professionals", "string", "How many AI professionals already work there?"),
+    ("greenfield", "string", "Is it greenfield, building their AI capability from scratch?"),
+    ("data_maturity", "string", "Speculate: what is their level of maturity for data ingestion and processing."),
+    ("too_much_for_one", "string", "Speculate: are the role responsibilities expecting too much for one person?"),
+    ("unicorn", "string",
+     "Speculate: with the required skills and experience, do you think they are looking for a (metaphorical) "
+     "unicorn?"),
+    ("sentiment", "integer", "What is the sentiment on a scale of -3 to +3?", {"minimum": -3, "maximum": 3}),
+    ("inspiration", "integer", "How much does it inspire you on a scale of 1 to 10?", {"minimum": 1, "maximum": 10}),
+    ("best_thing", "string", "What is the best thing about this job?"),
+    ("would_work_there", "string", "Would you want to work there?"),
+    ("positive_difference", "string", "Would this role make a positive difference?")]
 
+# Columns of the output, in the order they are written to the txt file: the document details, one per question, then
+# the id of the document whose answers were used, which differs from 'job_id' for a near-duplicate
+OUTPUT_COLUMNS = ["job_id", "job_filename", "job_link"] + [question[0] for question in QUESTIONS] + ["cluster_id"]
 
-if __name__ == "__main__":
+# Questions asked in separate calls at the same time, keyed on shard name: facts about the role and company, facts
+# about the requirements, and judgements; each call generates about a third of the answers, so each document's
+# answers arrive sooner. Questions not listed form a last shard; set to None to ask every question in one call
+QUESTION_SHARDS = {
+    "role": ["role_title", "recruitment_consultancy", "company_name", "industry", "company_size",
+             "startup_or_established", "remote_hybrid_onsite", "days_onsite", "location", "salary_range"],
+    "requirements": ["line_management", "project_funnel", "deep_learning", "computer_vision", "mlops",
+                     "years_experience", "qualifications", "tools_summary", "cloud_platforms", "ai_professionals",
+                     "greenfield"]}
+
+# The model tier ('small' or 'large', see cll.MODEL_TIERS) each shard is sent to: the facts stated in the advert go to
+# the smaller, faster model, which also lists the answers it is unsure of so that they, and any it cannot give, are
+# asked again of the larger model. The speculative and generative judgements, in the last shard, and every question in
+# batch mode, go to the larger model; set to None to send everything to the larger model
+SHARD_TIERS = {"role": "small", "requirements": "small"}
+
+# The system context and temperature of every call
+SYSTEM_CONTEXT = cll.llm_contexts()["Film noir"]
+TEMPERATURE = 1
+
+# Maximum number of calls to the LLM at the same time; each document takes one call per shard
+MAX_CONCURRENCY = 4
+
+# Re-use saved LLM responses for identical prompts; off because temperature=1 is meant to vary between runs
+USE_CACHE = False
+
+# Skip documents already processed in a previous run, unless they have changed; set to False to process them again
+SKIP_PROCESSED = True
+
+# Submit all prompts as one Message Batch instead of interactive calls: half the price, but may take hours
+BATCH_MODE = False
+
+# Send one document from each group of near-duplicates, e.g. the same advert reposted by several agencies, and copy
+# its answers to the others; near-duplicates share at least this estimated share of 5-word phrases (0 to 1), or set
+# to None to send every document
+DEDUP_THRESHOLD = 0.8
+
+# Stream each interactive response and ask again as soon as it stops being the json object asked for, or is cut off at
+# max_tokens, rather than waiting for the whole of a response that cannot be used
+STREAM_JSON = True
+
+
+def group_near_duplicates(dict_texts: dict):
+    """Group the documents into near-duplicates, keeping the first of each group to send to the LLM.
+
+    Args:
+        dict_texts (dict): The text of each document, keyed on document id.
+
+    Returns:
+        dict: The ids of the other documents in each group, keyed on the id of the document kept from it, in the
+            order of `dict_texts`.
+    """
+
+    list_ids = list(dict_texts)
+    list_reps = list(range(len(list_ids)))
+    if DEDUP_THRESHOLD is not None and len(list_ids) > 1:
+        list_reps = cdd.near_duplicate_clusters(list(dict_texts.values()), threshold=DEDUP_THRESHOLD)
+    dict_duplicates = {list_ids[i]: [] for i, rep in enumerate(list_reps) if rep == i}
+    for i, rep in enumerate(list_reps):
+        if rep != i:
+            dict_duplicates[list_ids[rep]].append(list_ids[i])
+    print(f"{len(list_ids)} documents in {len(dict_duplicates)} groups of near-duplicates")
+    return dict_duplicates
+
+
+def shard_options(batch_mode: bool):
+    """Split the questions into shards, and set the options each shard is sent with.
+
+    Each shard has its own tool and a max_tokens sized from its expected answers, and goes to the model of its tier;
+    the smaller model also says which answers it is unsure of. A batch returns every answer at once anyway, so it asks
+    them all in one call.
+
+    Args:
+        batch_mode (bool): Whether the prompts are submitted as one Message Batch.
+
+    Returns:
+        list: The shards, each a list of questions from `QUESTIONS`.
+        list: The `cll.CallOptions` of each shard.
+    """
+
+    dict_shards = None if batch_mode else QUESTION_SHARDS
+    list_shards = cso.shard_questions(QUESTIONS, dict_shards)
+    list_shard_options = []
+    for shard in list_shards:
+        list_names = [name for name, columns in (dict_shards or {}).items() if shard[0][0] in columns]
+        small = bool(list_names) and (SHARD_TIERS or {}).get(list_names[0]) == "small"
+        list_shard_options.append(cll.CallOptions(
+            temperature=TEMPERATURE, max_tokens=cso.answer_max_tokens(shard, confidence=small),
+            model=cll.MODEL_TIERS["small" if small else "large"], use_cache=USE_CACHE,
+            tool=cso.tool_definition(shard, confidence=small), stream_json=STREAM_JSON))
+    return list_shards, list_shard_options
+
+
+def build_prompt(job_text: str, shard: list):
+    """Build the prompt asking one shard of the questions about a job description."""
+
+    return f"""
+        Given the job description below, extract summary information for the following pieces of
+        information.
+        Use British spelling instead of American spelling.
+        Record your answers with the {cso.TOOL_NAME} tool.
+        {cso.numbered_questions(QUESTIONS, columns=[question[0] for question in shard])}
+
+        Feel free to read between the lines and speculate based on what you've seen, but
+        return "Unknown" for a particular piece of information if it is not given.
+
+        Job description:
+        {job_text}
+        """
+
+
+def process_documents(dict_docs_to_review: dict, store, batch_mode=BATCH_MODE):
+    """Send the new or changed documents to the LLM, appending each result to the store as soon as it arrives.
+
+    Args:
+        dict_docs_to_review (dict): The filename of each document in `DIR_INPUT_DOCX`, keyed on document id.
+        store (crs.ResultStore): The app's result store.
+        batch_mode (bool): Submit the prompts as one Message Batch instead of interactive calls.
+    """
+
+    # Only send documents that are new or changed, and not already in the store from an interrupted run
+    dict_docs_to_review, dict_doc_hashes = crs.filter_processed(
+        dict_docs_to_review, DIR_INPUT_DOCX, store, skip_processed=SKIP_PROCESSED)
+
+    # Load the documents, parsing them in worker processes, one per core, then keep one from each group of
+    # near-duplicates; the rest get its answers
+    dict_loaded = cpp.parse_many(
+        clm.load_docx_to_str,
+        {job_id: (DIR_INPUT_DOCX + job_filename,) for job_id, job_filename in dict_docs_to_review.items()})
+    dict_duplicates = group_near_duplicates({job_id: job_text for job_id, (_, job_text) in dict_loaded.items()})
+    list_job_ids = list(dict_duplicates)
+
+    # Split the questions into shards, each sent to its own model with its own tool and max_tokens
+    list_shards, list_shard_options = shard_options(batch_mode)
+
+    # One prompt per document and shard, with the shards of each document next to each other
+    list_prompts = [build_prompt(dict_loaded[job_id][1], shard) for job_id in list_job_ids for shard in list_shards]
+    dict_links = {job_id: job_link for job_id, (job_link, _) in dict_loaded.items()}
+    del dict_loaded
+
+    # The answers to each document's shards so far, keyed on the document's position in list_job_ids
+    dict_partial = {}
+
+    def store_answers(i: int, dict_shard_answers: dict):
+        """Add one shard's complete answers to its document's, and append the document's answers to the store as
+        soon as all of its shards are complete."""
+        i_doc = i // len(list_shards)
+        job_id = list_job_ids[i_doc]
+        dict_answers = dict_partial.setdefault(i_doc, {})
+        dict_answers.update(dict_shard_answers)
+        if len(dict_answers) < len(QUESTIONS):
+            return
+        del dict_partial[i_doc]
+        response_dict = {column: dict_answers[column] for column, *_ in QUESTIONS}
+        print("")
+        print(f"Key: {job_id}, Value: {dict_docs_to_review[job_id]}")
+
+        # Store the output, then a copy for each near-duplicate, all recording which document was sent
+        for dup_id in [job_id] + dict_duplicates[job_id]:
+            tmp_dict = {
+                "job_id": dup_id,
+                "job_filename": dict_docs_to_review[dup_id],
+                "job_link": dict_links[dup_id],
+                "llm_response": response_dict,
+                "cluster_id": job_id}
+            store.append(tmp_dict, dict_doc_hashes[dup_id])
+
+    # Check each response against its shard's questions as it arrives, asking the larger model again for any answers
+    # the smaller one was unsure of
+    checker = cso.AnswerChecker(
+        SYSTEM_CONTEXT, on_complete=store_answers, max_concurrency=MAX_CONCURRENCY, escalate_to=cll.LLM_MODEL)
+
+    def check_response(i: int, response_str: str):
+        """Check one shard's response against its questions as soon as it arrives."""
+        i_shard = i % len(list_shards)
+        checker.check(i, response_str, list_prompts[i], list_shards[i_shard], list_shard_options[i_shard])
+
+    # Send the prompts to the LLM and choose which context to use; each response is checked as it arrives
+    try:
+        if batch_mode:
+            # Map each response back to its document by id
+            cll.llm_response_batch(
+                prompts=dict(zip(list_job_ids, list_prompts)),
+                system_context=SYSTEM_CONTEXT,
+                options=list_shard_options[0],
+                on_result=check_response,
+                path_state=DIR_OUTPUT + FNAME_OUTPUT + "__batch.json")
+        else:
+            # Send the prompts concurrently, each shard with its own tool, max_tokens and model
+            cll.llm_response_many(
+                prompts=list_prompts,
+                system_context=SYSTEM_CONTEXT,
+                options=list_shard_options * len(list_job_ids),
+                max_concurrency=MAX_CONCURRENCY,
+                on_result=check_response)
+    finally:
+        # Ask again for every answer that is missing, invalid or unsure, all at once rather than one response at a
+        # time, even if some calls failed, so that every response that did come back is stored
+        checker.ask_again()
+
+
+def main():
+    """Summarise each new or changed job description in the input folder."""
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every LLM call in this run
+    cme.start_run("app_1_1")
 
     # Get list of filenames in input directory
     list_docs_to_review = clm.list_docx_in_directory(DIR_INPUT_DOCX)
@@ -28,84 +284,58 @@ if __name__ == "__main__":
     if len(dict_docs_to_review) == 0:
         print(f"No docx files in input directory: '{DIR_INPUT_DOCX}'")
     else:
-        output_list_of_dicts = []
-        for job_id, job_filename in dict_docs_to_review.items():
-            print("")
-            print(f"Key: {job_id}, Value: {job_filename}")
-
-            job_link, job_text = clm.load_docx_to_str(DIR_INPUT_DOCX + job_filename)
-
-            # Set the prompt
-            prompt = f"""
-                Given the job description below, extract summary information for the following pieces of information.
-                Use British spelling instead of American spelling.
-                Provide output as a Python dictionary with the number as the key and your response as the value.
-                Use double quotes and start and end with curly braces.
-                It is very important that you do not add introductory remarks.
-                If you add introductory remarks I will fire you, kid.
-                Do NOT add introductory remarks in any circumstances.
-                    1. What is the role title?
-                    2. What is the recruitment consultancy?
-                    3. What is the company name?
-                    4. In what industry does the company operate?
-                    5. How many employees does the company have?
-                    6. Is it a startup environment or an established business?
-                    7. Is the role remote, hybrid or onsite?
-                    8. How many days onsite are expected?
-                    9. What is the location?
-                    10. What is the available salary range?
-                    11. Does the role involve line management, if so how many people?
-                    12. Does the role involve maintaining a funnel of projects including prioritisation?
-                    13. Does the role require a specialism in deep learning?
-                    14. Does the role require a specialism in computer vision?
-                    15. Does the role require a specialism in MLOps?
-                    16. How many years experience are required?
-                    17. What qualifications are required?
-                    18. Is the role focused more on analytics (e.g. requirements, feature engineering, model
-                        training) or engineering (MLOps, model deployment and maintenance, cloud platforms)?
-                    19. Are there any worrying points that would give you pause for thought?
-                    20. Are there any spelling mistakes in the job description?
-                    21. Give a brief summary of the main data and analytical tools used.
-                    22. Which cloud platforms are used?
-                    23. How many AI professionals already work there?
-                    24. Is it greenfield, building their AI capability from scratch?
-                    25. Speculate: what is their level of maturity for data ingestion and processing.
-                    26. Speculate: are the role responsibilities expecting too much for one person?
-                    27. Speculate: with the required skills and experience, do you think they are looking
-                        for a (metaphorical) unicorn?
-                    28. What is the sentiment on a scale of -3 to +3?
-                    29. How much does it inspire you on a scale of 1 to 10?
-                    30. What is the best thing about this job?
-                    31. Would you want to work there?
-                    32. Would this role make a positive difference?
-
-                Feel free to read between the lines and speculate based on what you've seen, but
-                return "Unknown" for a particular piece of information if it is not given.
-
-                Job description:
-                {job_text}
-                """
-
-            # Send the prompt to the LLM and choose which context to use
-            response_str = cll.llm_response(
-                prompt=prompt,
-                system_context=cll.llm_contexts()["Film noir"],
-                temperature=1)
-
-            # Convert response to dict
-            response_dict = cll.convert_llm_response_to_dict(response_str)
-            del response_str
-
-            # Append to output
-            tmp_dict = {
-                "job_id": job_id,
-                "job_filename": job_filename,
-                "job_link": job_link,
-                "llm_response": response_dict}
-            output_list_of_dicts.append(tmp_dict)
+        # Each result is appended to the store as soon as it arrives
+        store = crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, OUTPUT_COLUMNS, id_field="job_id")
+
+        process_documents(dict_docs_to_review, store)
 
-        # Overwrite json file
-        cll.export_this_run_to_json(output_list_of_dicts, DIR_OUTPUT + FNAME_OUTPUT)
+        # Incrementally add every stored result not yet exported, including any from an interrupted run, to
+        # the pipe-delimited txt file
+        n_exported = store.export_txt()
+        store.close()
 
-        # Incrementally add output to pipe-delimited txt file
-        cll.insert_into_txt_from_json(DIR_OUTPUT + FNAME_OUTPUT)
+        if USE_CACHE:
+            print(f"LLM cache: {crc.cache_stats()}")
+
+        # Report latency, throughput and cost
+        print(cme.report(n_documents=n_exported))
+
+
+def watch():
+    """Summarise job descriptions as they arrive in the input folder, moving each to the reviewed folder once stored."""
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every LLM call while watching
+    cme.start_run("app_1_1")
+
+    # The store stays open between batches, and each batch is exported as soon as it is stored
+    store = crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, OUTPUT_COLUMNS, id_field="job_id")
+
+    def process_batch(list_filenames: list):
+        """Send one batch of new documents interactively, returning the files that are done."""
+        dict_docs = {filename[:7]: filename for filename in list_filenames}
+
+        # Time each batch from when it starts, rather than from the end of the last one
+        cme.clear_events()
+        process_documents(dict_docs, store, batch_mode=False)
+
+        # Report the batch's latency, throughput and cost, then forget its events so memory stays flat while watching
+        print(cme.report(n_documents=store.export_txt()))
+        cme.clear_events()
+        return list(dict_docs.values())
+
+    try:
+        cib.watch(DIR_INPUT_DOCX, DIR_REVIEWED_DOCX, process_batch)
+    finally:
+        n_exported = store.export_txt()
+        store.close()
+
+        # Report the latency, throughput and cost of any batch interrupted with Ctrl+C
+        if cme.events():
+            print(cme.report(n_documents=n_exported))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,25 +3,203 @@ See app_01/README.md
 """
 
 from ..common_lib import llms as cll
+from ..common_lib import metrics as cme
 from ..common_lib import misc_utils as clm
+from ..common_lib import paths as cpa
+from ..common_lib import relevance as clr
+from ..common_lib import response_cache as crc
+from ..common_lib import result_store as crs
+from ..common_lib import structured_output as cso
 
 # Specify input and output directories
-DIR_INPUT_DOCX_JOB = "../data/app_01__job_search_assistant/1.2.1__to_review/"
-DIR_INPUT_DOCX_CV = "../data/app_01__job_search_assistant/1.2.3__cv_to_compare/"
-DIR_OUTPUT = "../data/app_01__job_search_assistant/1.2.9__output_comparison/"
+DIR_INPUT_DOCX_JOB = cpa.DIR_DATA + "app_01__job_search_assistant/1.2.1__to_review/"
+DIR_INPUT_DOCX_CV = cpa.DIR_DATA + "app_01__job_search_assistant/1.2.3__cv_to_compare/"
+DIR_OUTPUT = cpa.DIR_DATA + "app_01__job_search_assistant/1.2.9__output_comparison/"
 
-# Specify output filename (json and txt)
+# Specify output filename (jsonl, sqlite and txt)
 FNAME_OUTPUT = "1.2.9__compare_cv_vs_job"
 
-# Import API key as environment variable
-clm.load_dotenv_all()
-
-
-if __name__ == "__main__":
-
-    # Load the CV
-    cv_filename = clm.list_docx_in_directory(DIR_INPUT_DOCX_CV)[0]
-    cv_text = clm.load_docx_to_str(DIR_INPUT_DOCX_CV + cv_filename)[1]
+# The questions asked of each CV and job description: the column for the answer, its type and the question
+QUESTIONS = [
+    ("has_required_skills", "string", "Do I have all the required skills?"),
+    ("has_required_qualifications", "string", "Do I have all the required qualifactions?"),
+    ("good_fit", "string", "Is this job a good fit for me based on my CV?"),
+    ("over_qualified", "string", "Am I over-qualified for this?"),
+    ("requirements_score", "integer",
+     "Give me just an integer on a scale of 1 to 10 for how well my CV meets the requirements.",
+     {"minimum": 1, "maximum": 10}),
+    ("success_score", "integer",
+     "Give me just an integer on a scale of 1 to 10 for how likely it is that I would be succesful.",
+     {"minimum": 1, "maximum": 10}),
+    ("chance_of_getting_it", "string", "Speculate: what's my chance of getting the gig if I apply with this CV, kid?"),
+    ("should_apply", "string", "Do you think I should I even apply?"),
+    ("cv_changes", "string", "What (if anything) should be modified or added in the CV?"),
+    ("top_selling_points", "string", "What are my top three selling points that are relevant to the role?"),
+    ("cover_letter", "string", "Write a brief draft cover letter."),
+    ("cover_email", "string", "Write a very brief cover email for an online application.")]
+
+# Columns of the output, in the order they are written to the txt file: the document details, then one per question
+OUTPUT_COLUMNS = ["job_id", "job_filename", "job_link", "cv_filename"] + [question[0] for question in QUESTIONS]
+
+# The system context and temperature of every call
+SYSTEM_CONTEXT = cll.llm_contexts()["Film noir"]
+TEMPERATURE = 0.4
+
+# Maximum number of documents sent to the LLM at the same time
+MAX_CONCURRENCY = 4
+
+# Re-use saved LLM responses for identical prompts; off because temperature=0.4 is meant to vary between runs
+USE_CACHE = False
+
+# Skip documents already processed in a previous run, unless they have changed; set to False to process them again
+SKIP_PROCESSED = True
+
+# Submit all prompts as one Message Batch instead of interactive calls: half the price, but may take hours
+BATCH_MODE = False
+
+# Stream each interactive response and ask again as soon as it stops being the json object asked for, or is cut off at
+# max_tokens, rather than waiting for the whole of a response that cannot be used
+STREAM_JSON = True
+
+# Compare every CV in the CV folder, not just the first: each job is scored locally against every CV, and only its
+# TOP_K_CVS_PER_JOB most relevant CVs are sent to the LLM, provided they score more than MIN_RELEVANCE_SCORE (0 to 1)
+MATRIX_MODE = False
+TOP_K_CVS_PER_JOB = 2
+MIN_RELEVANCE_SCORE = 0.0
+
+
+def build_job_prompts(dict_jobs: dict, dict_job_texts=None):
+    """Load each job description and set the part of the prompt that changes for it.
+
+    Args:
+        dict_jobs (dict): The filename of each job description in `DIR_INPUT_DOCX_JOB`, keyed on job id.
+        dict_job_texts (dict): Optional (job_link, job_text) of job descriptions already loaded, keyed on job id; any
+            others are loaded from their files.
+
+    Returns:
+        list: (job_id, job_filename, job_link) for each job description.
+        list: The prompt for each job description, in the same order.
+    """
+
+    list_docs = []
+    list_prompts = []
+    for job_id, job_filename in dict_jobs.items():
+        if dict_job_texts is not None and job_id in dict_job_texts:
+            job_link, job_text = dict_job_texts[job_id]
+        else:
+            job_link, job_text = clm.load_docx_to_str(DIR_INPUT_DOCX_JOB + job_filename)
+        prompt = f"""
+        JOB DESCRIPTION:
+        {job_text}
+
+        """
+        list_docs.append((job_id, job_filename, job_link))
+        list_prompts.append(prompt)
+    return list_docs, list_prompts
+
+
+def compare_cv_with_jobs(cv_filename: str, dict_jobs: dict, store, cv_text=None, dict_job_texts=None):
+    """Ask the LLM to compare one CV against several job descriptions, appending each result to the store.
+
+    Args:
+        cv_filename (str): The filename of the CV in `DIR_INPUT_DOCX_CV`.
+        dict_jobs (dict): The filename of each job description to compare against, keyed on job id.
+        store (crs.ResultStore): The app's result store.
+        cv_text (str): Optional text of the CV, if already loaded.
+        dict_job_texts (dict): Optional (job_link, job_text) of job descriptions already loaded, keyed on job id.
+    """
+
+    if cv_text is None:
+        cv_text = clm.load_docx_to_str(DIR_INPUT_DOCX_CV + cv_filename)[1]
+
+    # Every comparison depends on the CV as well as the job description, so a changed CV means reprocessing them all
+    cv_sha256 = crs.file_sha256(DIR_INPUT_DOCX_CV + cv_filename)
+
+    # Only send documents that are new or changed, and not already in the store from an interrupted run
+    dict_jobs, dict_doc_hashes = crs.filter_processed(
+        dict_jobs, DIR_INPUT_DOCX_JOB, store, skip_processed=SKIP_PROCESSED, salt=cv_sha256)
+    if len(dict_jobs) == 0:
+        return
+
+    # Set the stable part of the prompt: the instructions, questions and CV are the same for every job description,
+    # so they are sent first as a cacheable prefix and only the job description changes between calls
+    prompt_prefix = f"""
+            Given the job description below, compare the CV against it and consider the following questions.
+            Use British spelling instead of American spelling.
+            Record your answers with the {cso.TOOL_NAME} tool.
+            {cso.numbered_questions(QUESTIONS)}
+
+        CV:
+        {cv_text}
+        """
+
+    list_docs, list_prompts = build_job_prompts(dict_jobs, dict_job_texts)
+    options = cll.CallOptions(
+        temperature=TEMPERATURE, use_cache=USE_CACHE, prompt_prefix=prompt_prefix,
+        tool=cso.tool_definition(QUESTIONS), stream_json=STREAM_JSON)
+
+    def store_answers(i: int, response_dict: dict):
+        """Append one response's answers to the store as soon as they are complete."""
+        job_id, job_filename, job_link = list_docs[i]
+        print("")
+        print(f"Key: {job_id}, Value: {job_filename}, CV: {cv_filename}")
+
+        # Store the output
+        tmp_dict = {
+            "job_id": job_id,
+            "job_filename": job_filename,
+            "job_link": job_link,
+            "cv_filename": cv_filename,
+            "llm_response": response_dict}
+        store.append(tmp_dict, dict_doc_hashes[job_id])
+
+    # Check each response against the questions as it arrives
+    checker = cso.AnswerChecker(SYSTEM_CONTEXT, on_complete=store_answers, max_concurrency=MAX_CONCURRENCY)
+
+    def check_response(i: int, response_str: str):
+        """Check one response against the questions as soon as it arrives."""
+        checker.check(i, response_str, list_prompts[i], QUESTIONS, options)
+
+    # Send the prompts to the LLM and choose which context to use; each response is checked as it arrives
+    try:
+        if BATCH_MODE:
+            # In matrix mode each CV needs its own batch state, as CVs compared with the same jobs send the same ids
+            path_state_suffix = f"__batch_{cv_sha256[:12]}.json" if MATRIX_MODE else "__batch.json"
+
+            # Map each response back to its document by id
+            cll.llm_response_batch(
+                prompts={doc[0]: prompt for doc, prompt in zip(list_docs, list_prompts)},
+                system_context=SYSTEM_CONTEXT,
+                options=options,
+                on_result=check_response,
+                path_state=DIR_OUTPUT + FNAME_OUTPUT + path_state_suffix)
+        else:
+            # Send the prompts concurrently
+            cll.llm_response_many(
+                prompts=list_prompts,
+                system_context=SYSTEM_CONTEXT,
+                options=options,
+                max_concurrency=MAX_CONCURRENCY,
+                on_result=check_response)
+    finally:
+        # Ask again for every answer that is missing or invalid, all at once rather than one response at a time, even
+        # if some calls failed, so that every response that did come back is stored
+        checker.ask_again()
+
+
+def main():
+    """Compare each CV in the input folder against the job descriptions."""
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every LLM call in this run
+    cme.start_run("app_1_2")
+
+    # List the CVs: every CV in matrix mode, otherwise just the first
+    list_cv_filenames = clm.list_docx_in_directory(DIR_INPUT_DOCX_CV)
+    if not MATRIX_MODE:
+        list_cv_filenames = list_cv_filenames[:1]
 
     # Get list of filenames in input directory
     list_docs_to_review = clm.list_docx_in_directory(DIR_INPUT_DOCX_JOB)
@@ -33,64 +211,45 @@ if __name__ == "__main__":
     if len(dict_docs_to_review) == 0:
         print(f"No docx files in input directory: '{DIR_INPUT_DOCX_JOB}'")
     else:
-        output_list_of_dicts = []
-        for job_id, job_filename in dict_docs_to_review.items():
-            print("")
-            print(f"Key: {job_id}, Value: {job_filename}")
+        # Each result is appended to the store as soon as it arrives
+        store = crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, OUTPUT_COLUMNS, id_field="job_id")
+
+        if MATRIX_MODE:
+            # Load every CV and job description once, for both the local scores and the prompts
+            list_cv_texts = [clm.load_docx_to_str(DIR_INPUT_DOCX_CV + cv_filename)[1]
+                             for cv_filename in list_cv_filenames]
+            dict_job_texts = {job_id: clm.load_docx_to_str(DIR_INPUT_DOCX_JOB + job_filename)
+                              for job_id, job_filename in dict_docs_to_review.items()}
+
+            # Score every CV against every job locally, and keep each job's most relevant CVs
+            list_job_ids = list(dict_docs_to_review)
+            scores = clr.score_matrix(list_cv_texts, [dict_job_texts[job_id][1] for job_id in list_job_ids])
+            ranking = clr.top_k_per_column(scores, TOP_K_CVS_PER_JOB, MIN_RELEVANCE_SCORE)
+            clr.export_ranked_matrix(
+                DIR_OUTPUT + FNAME_OUTPUT + "__matrix.txt", scores, ranking, ("cv_filename", list_cv_filenames),
+                ("job_id", list_job_ids))
+            print(f"Sending {ranking.selected.sum()} of {ranking.selected.size} CV/job pairs to the LLM")
+
+            # Compare each CV with the jobs it was selected for, so its prompt prefix is cached across those calls
+            for i, cv_filename in enumerate(list_cv_filenames):
+                dict_jobs = {job_id: dict_docs_to_review[job_id]
+                             for j, job_id in enumerate(list_job_ids) if ranking.selected[i, j]}
+                compare_cv_with_jobs(cv_filename, dict_jobs, store, list_cv_texts[i], dict_job_texts)
+        else:
+            compare_cv_with_jobs(list_cv_filenames[0], dict_docs_to_review, store)
+
+        # Incrementally add every stored result not yet exported, including any from an interrupted run, to
+        # the pipe-delimited txt file
+        n_exported = store.export_txt()
+        store.close()
+
+        if USE_CACHE:
+            print(f"LLM cache: {crc.cache_stats()}")
+
+        # Report latency, throughput and cost, and cached vs. uncached input tokens to confirm the savings from prompt
+        # caching
+        print(cme.report(n_documents=n_exported))
 
-            job_link, job_text = clm.load_docx_to_str(DIR_INPUT_DOCX_JOB + job_filename)
 
-            # Set the prompt
-            prompt = f"""
-                Given the job description below, compare the CV against it and consider the following questions.
-                Use British spelling instead of American spelling.
-                Provide output as a Python dictionary with the number as the key and your response as the value.
-                Use double quotes and start and end with curly braces.
-                It is very important that you do not add introductory remarks.
-                If you add introductory remarks I will fire you, kid.
-                Do NOT add introductory remarks in any circumstances.
-                1. Do I have all the required skills?
-                2. Do I have all the required qualifactions?
-                3. Is this job a good fit for me based on my CV?
-                4. Am I over-qualified for this?
-                5. Give me just an integer on a scale of 1 to 10 for how well my CV meets the requirements.
-                6. Give me just an integer on a scale of 1 to 10 for how likely it is that I would be succesful.
-                7. Speculate: what's my chance of getting the gig if I apply with this CV, kid?
-                8. Do you think I should I even apply?
-                9. What (if anything) should be modified or added in the CV?
-                10. What are my top three selling points that are relevant to the role?
-                11. Write a brief draft cover letter.
-                12. Write a very brief cover email for an online application.
-
-            CV:
-            {cv_text}
-
-            JOB DESCRIPTION:
-            {job_text}
-
-            """
-
-            # Send the prompt to the LLM and choose which context to use
-            response_str = cll.llm_response(
-                prompt=prompt,
-                system_context=cll.llm_contexts()["Film noir"],
-                temperature=0.4)
-
-            # Convert response to dict
-            response_dict = cll.convert_llm_response_to_dict(response_str)
-            del response_str
-
-            # Append to output
-            tmp_dict = {
-                "job_id": job_id,
-                "job_filename": job_filename,
-                "job_link": job_link,
-                "cv_filename": cv_filename,
-                "llm_response": response_dict}
-            output_list_of_dicts.append(tmp_dict)
-
-        # Overwrite json file
-        cll.export_this_run_to_json(output_list_of_dicts, DIR_OUTPUT + FNAME_OUTPUT)
-
-        # Incrementally add output to pipe-delimited txt file
-        cll.insert_into_txt_from_json(DIR_OUTPUT + FNAME_OUTPUT)
+if __name__ == "__main__":
+    main()
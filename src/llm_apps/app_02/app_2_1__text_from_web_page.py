@@ -3,112 +3,126 @@ See app_02/README.md
 """
 
 from datetime import datetime
-import requests
 
-import pandas as pd
-from bs4 import BeautifulSoup
-from docx import Document
+from ..common_lib import html_extract as che
+from ..common_lib import metrics as cme
+from ..common_lib import parse_pool as cpp
+from ..common_lib import paths as cpa
+from ..common_lib import web_fetch as cwf
 
 # Specify input and output directories and filenames
-DIR_INPUT = "../data/app_02__skills_toolbox/2.1.1__input_sources/"
+DIR_INPUT = cpa.DIR_DATA + "app_02__skills_toolbox/2.1.1__input_sources/"
 FNAME_INPUT = "2.1.1__input_sources.csv"
-DIR_OUTPUT = "../data/app_02__skills_toolbox/2.1.9__output_downloaded/"
+DIR_OUTPUT = cpa.DIR_DATA + "app_02__skills_toolbox/2.1.9__output_downloaded/"
 
+# Maximum number of pages downloaded at the same time, in total and from any one website
+MAX_WORKERS = 8
+MAX_PER_HOST = 2
 
-if __name__ == "__main__":
+# Save pages that have an 'ETag' or 'Last-Modified' header, so that reruns only download pages that have changed
+USE_HTTP_CACHE = True
+
+# Worker processes that extract the text of downloaded pages while the rest download: one per core
+PARSE_WORKERS = cpp.MAX_WORKERS
+
+
+def save_page(tb_id: str, result: dict, blocks=None):
+    """Copy the text of one fetched page to a Word document in `DIR_OUTPUT`.
+
+    Args:
+        tb_id (str): The id of the page, e.g. 'tb_0001'.
+        result (dict): The result of `cwf.fetch_url()` for the page.
+        blocks (list): The blocks already extracted from the page by `che.extract_blocks()`; None to extract them.
+
+    Returns:
+        str: The filename of the Word document.
+    """
+
+    from docx import Document  # pylint: disable=import-outside-toplevel
+
+    tb_url = result["url"]
+    print("")
+    print(f"Key: {tb_id}, Value: {tb_url}")
+
+    # Create a new Word document
+    doc = Document()
+
+    # Add the hyperlink
+    doc.add_paragraph(tb_url)
+
+    if result["status_code"] is None:
+        print(f"An error occurred: {result['error']}")
+        doc.add_paragraph("Error: issue with source url, no response")
+
+    response_status_code = result["status_code"] or 88888
+    print(f"Response: {response_status_code}" + (" (not modified, from cache)" if result["from_cache"] else ""))
+
+    # Extract 'main' text for successful responses, i.e. status == 200
+    if response_status_code == 200:
+
+        # Extract the title, headings and paragraphs in one pass, in page order, and convert them to Word format
+        # title and h1, h2, h3: Headings are added with doc.add_heading() at different levels.
+        # p: Paragraphs are added as plain text using doc.add_paragraph().
+        if blocks is None:
+            blocks = che.extract_blocks(result["text"])
+        che.add_blocks_to_docx(doc, blocks)
+
+    # Save
+    filename = tb_id + "_auto_" + datetime.now().strftime("%Y-%m-%d") + ".docx"
+    doc.save(DIR_OUTPUT + filename)
+    return filename
+
+
+def main():
+    """Download the web pages listed in the input csv and save each one to a Word document."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    # Record the time of every fetch in this run
+    cme.start_run("app_2_1")
 
     # Import csv, filter and create dictionary
     df = pd.read_csv(DIR_INPUT + FNAME_INPUT)
     df_fil = df[(df["to_get"] == 1) & df["tb_url"].notna()]
     dict_urls_to_get = dict(zip(df_fil["tb_id"], df_fil["tb_url"]))
 
-    # Loop over all ids in the dict
+    # Download all urls in the dict
     if len(dict_urls_to_get) == 0:
         print("No urls to download")
     else:
-        list_status_code = []
-        for tb_id, tb_url in dict_urls_to_get.items():
-            print("")
-            print(f"Key: {tb_id}, Value: {tb_url}")
-
-            # Create a new Word document
-            doc = Document()
-
-            # Add the hyperlink
-            doc.add_paragraph(tb_url)
-
-            # When using requests, some websites block requests that do not resemble typical browser requests.
-            # To mimic a browser we add a 'User-Agent' header, which should convert some 403 status codes to 200.
-            headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 \
-                                        (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36"}
-
-            # Get data from the website
-            try:
-                response = requests.get(tb_url, headers=headers, timeout=30)
-                response_status_code = response.status_code
-
-            except Exception as e:
-                print(f"An error occurred: {e}")
-                response = 'N/A'
-                response_status_code = 88888
-                doc.add_paragraph("Error: issue with source url, no response")
-
-            # Capture response status codes as a list of dicts
-            print("Response:", response_status_code)
-            dict_status_code = {
-                'tb_id': tb_id,
-                'status_code': response_status_code}
-            list_status_code.append(dict_status_code)
-
-            # Extract 'main' text for successful responses, i.e. status == 200
-            if response_status_code == 200:
-
-                # Extract title and paragraph elements from the webpage
-                soup = BeautifulSoup(response.text, "html.parser")
-
-                # Find the desired tags (p, title, etc.)
-                all_text = soup.find_all(["p", "title", "h1", "h2", "h3"])
-
-                # Iterate through tags and convert them to Word format
-                # p: Paragraphs are added as plain text using doc.add_paragraph().
-                # title and h1, h2, h3: Headings are added with doc.add_heading() at different levels.
-                for tag in all_text:
-                    if tag.name == 'p':  # For paragraphs
-                        try:
-                            doc.add_paragraph(tag.get_text())
-                        except Exception as e:
-                            print(f"An error occurred: {e}")
-
-                    elif tag.name == 'title':  # For titles use Heading Level 1
-                        try:
-                            doc.add_heading(tag.get_text(), level=1)
-                        except Exception as e:
-                            print(f"An error occurred: {e}")
-
-                    elif tag.name == 'h1':  # For h1 headings
-                        try:
-                            doc.add_heading(tag.get_text(), level=1)
-                        except Exception as e:
-                            print(f"An error occurred: {e}")
-
-                    elif tag.name == 'h2':  # For h2 headings
-                        try:
-                            doc.add_heading(tag.get_text(), level=2)
-                        except Exception as e:
-                            print(f"An error occurred: {e}")
-
-                    elif tag.name == 'h3':  # For h3 headings
-                        try:
-                            doc.add_heading(tag.get_text(), level=3)
-                        except Exception as e:
-                            print(f"An error occurred: {e}")
-
-            # Save
-            doc.save(DIR_OUTPUT + tb_id + "_auto_" + datetime.now().strftime("%Y-%m-%d") + ".docx")
-
-            del response
-            del response_status_code
+        # Get data from the websites concurrently, passing each page to the worker processes to extract its text as
+        # soon as it arrives, and saving it once extracted
+        dict_fetched = {}
+        with cpp.ParsePool(
+                che.extract_blocks,
+                on_result=lambda tb_id, blocks: save_page(tb_id, dict_fetched.pop(tb_id), blocks),
+                max_workers=PARSE_WORKERS) as pool:
+
+            def extract_page(tb_id: str, result: dict):
+                """Queue a downloaded page for extraction, or save a failed one straight away."""
+                if result["status_code"] != 200:
+                    save_page(tb_id, result)
+                    return
+                dict_fetched[tb_id] = result
+                pool.submit(tb_id, result["content"], "auto", result["encoding"])
+
+            dict_results = cwf.fetch_urls(
+                dict_urls_to_get,
+                max_workers=MAX_WORKERS,
+                max_per_host=MAX_PER_HOST,
+                use_cache=USE_HTTP_CACHE,
+                on_result=extract_page)
+
+        # Capture response status codes as a list of dicts
+        list_status_code = [
+            {'tb_id': tb_id, 'status_code': result["status_code"] or 88888} for tb_id, result in dict_results.items()]
 
         # save status_codes to logs
         df_status_code = pd.DataFrame(list_status_code)
-        df_status_code.to_csv("../logs/log_2_1__status_codes.txt", mode="a", header=False, index=False)
+        df_status_code.to_csv(cpa.DIR_LOGS + "log_2_1__status_codes.txt", mode="a", header=False, index=False)
+
+        # Report fetch latency and throughput
+        print(cme.report(n_documents=len(dict_results)))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,229 @@
 See app_02/README.md
 """
 
+from ..common_lib import chunking as clc
+from ..common_lib import inbox as cib
 from ..common_lib import llms as cll
+from ..common_lib import metrics as cme
 from ..common_lib import misc_utils as clm
+from ..common_lib import parse_pool as cpp
+from ..common_lib import paths as cpa
+from ..common_lib import response_cache as crc
+from ..common_lib import result_store as crs
+from ..common_lib import structured_output as cso
 
 # Specify input and output directories
-DIR_INPUT_DOCX = "../data/app_02__skills_toolbox/2.2.1__to_review/"
-DIR_OUTPUT = "../data/app_02__skills_toolbox/2.2.9__output_summary/"
+DIR_INPUT_DOCX = cpa.DIR_DATA + "app_02__skills_toolbox/2.2.1__to_review/"
+DIR_OUTPUT = cpa.DIR_DATA + "app_02__skills_toolbox/2.2.9__output_summary/"
+DIR_REVIEWED_DOCX = cpa.DIR_DATA + "app_02__skills_toolbox/2.2.2__reviewed/"
 
-# Specify output filename (json and txt)
+# Specify output filename (jsonl, sqlite and txt)
 FNAME_OUTPUT = "2.2.9__toolbox_summary"
 
-# Import API key as environment variable
-clm.load_dotenv_all()
+# The questions asked of each article: the column for the answer, its type and the question
+QUESTIONS = [
+    ("title", "string", "What is the title of the article?"),
+    ("author", "string", "Who is the author?"),
+    ("organisation", "string", "Which company or organisation is the author from?"),
+    ("date", "string", "What is the date of the article?"),
+    ("has_code_examples", "boolean", "Are there any code examples (Yes or No)?"),
+    ("summary_one_sentence", "string", "Summarise the article in one sentence."),
+    ("summary_seven_sentences", "string", "Summarise the article in seven sentences."),
+    ("what", "string", "What is discussed?"),
+    ("how", "string", "How does it work?"),
+    ("why", "string", "Why is this relevant?"),
+    ("risks", "string", "What are the risks?"),
+    ("opportunities", "string", "What are the opportunities?"),
+    ("primary_technique", "string", "What is the primary technique used?"),
+    ("primary_tool", "string", "What is the primary tool used?"),
+    ("primary_domain", "string", "What is the primary domain mentioned in the article?")]
 
+# Columns of the output, in the order they are written to the txt file: the document details, then one per question
+OUTPUT_COLUMNS = ["tb_id", "tb_filename", "tb_url"] + [question[0] for question in QUESTIONS]
 
-if __name__ == "__main__":
+# The system context and temperature of every call
+SYSTEM_CONTEXT = cll.llm_contexts()["Normal"]
+TEMPERATURE = 0
+
+# Maximum number of documents sent to the LLM at the same time
+MAX_CONCURRENCY = 4
+
+# Re-use saved LLM responses for identical prompts, so that reruns at temperature=0 return instantly
+USE_CACHE = True
+
+# Skip documents already processed in a previous run, unless they have changed; set to False to process them again
+SKIP_PROCESSED = True
+
+# Submit all prompts as one Message Batch instead of interactive calls: half the price, but may take hours
+BATCH_MODE = False
+
+# Stream each interactive response and ask again as soon as it stops being the json object asked for, or is cut off at
+# max_tokens, rather than waiting for the whole of a response that cannot be used
+STREAM_JSON = True
+
+# Articles longer than this (in estimated tokens) are condensed section by section before the final prompt
+SINGLE_PASS_MAX_TOKENS = 12000
+
+# Estimated tokens per section of a long article, and how many of them are repeated at the start of the next section
+CHUNK_MAX_TOKENS = 6000
+CHUNK_OVERLAP_TOKENS = 300
+
+# Maximum tokens in the notes for each section, and in the final answers to the 15 questions
+MAP_MAX_TOKENS = 800
+ANSWER_MAX_TOKENS = 1500
+
+# Prompt for condensing each section of a long article into notes for the final prompt
+MAP_PROMPT = """
+    Below is section {section} of {n_sections} of an article. Write concise notes on this section that will later be
+    combined with notes on the other sections to answer questions about the whole article.
+    Use British spelling instead of American spelling.
+    Note the title, author, the author's organisation and the date if they are given, and whether there are any code
+    examples. Then note what is discussed, how it works, why it is relevant, the risks and opportunities, and the
+    techniques, tools and domains mentioned.
+    Do NOT add introductory remarks in any circumstances.
+
+    Section {section} of {n_sections}:
+    {text}
+    """
+
+# How long articles are split and condensed
+CHUNK_PLAN = clc.ChunkPlan(MAP_PROMPT, SINGLE_PASS_MAX_TOKENS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS)
+
+
+def build_prompt(tb_text: str, n_sections=1):
+    """Set the prompt for one article, or for the notes on the sections of a long article.
+
+    Args:
+        tb_text (str): The text of the article, or the notes from `clc.condense_long_texts()`.
+        n_sections (int): The number of sections the notes were made from; 1 for the article itself.
+
+    Returns:
+        str: The prompt.
+    """
+
+    article_label = "Article" if n_sections == 1 else f"Notes on the {n_sections} sections of the article"
+    return f"""
+        Given the article below, extract summary information for the following pieces of information.
+        Use British spelling instead of American spelling.
+        Record your answers with the {cso.TOOL_NAME} tool.
+        For 8 to 12, respond in one sentence.
+        For 13 to 15, respond in a few words.
+        {cso.numbered_questions(QUESTIONS)}
+
+        Return "Unknown" for a particular piece of information if it is not given.
+
+        {article_label}:
+        {tb_text}
+        """
+
+
+def load_documents(dict_docs_to_review: dict):
+    """Load the documents, parsing them in worker processes, one per core.
+
+    Args:
+        dict_docs_to_review (dict): The filename of each document in `DIR_INPUT_DOCX`, keyed on document id.
+
+    Returns:
+        list: (tb_id, tb_filename, tb_url) for each document, in the order of `dict_docs_to_review`.
+        list: The text of each document, in the same order.
+    """
+
+    dict_loaded = cpp.parse_many(
+        clm.load_docx_to_str,
+        {tb_id: (DIR_INPUT_DOCX + tb_filename,) for tb_id, tb_filename in dict_docs_to_review.items()})
+    list_docs = []
+    list_texts = []
+    for tb_id, tb_filename in dict_docs_to_review.items():
+        tb_url, tb_text = dict_loaded.pop(tb_id)
+        list_docs.append((tb_id, tb_filename, tb_url))
+        list_texts.append(tb_text)
+    return list_docs, list_texts
+
+
+def process_documents(dict_docs_to_review: dict, store, batch_mode=BATCH_MODE):
+    """Send the new or changed documents to the LLM, appending each result to the store as soon as it arrives.
+
+    Args:
+        dict_docs_to_review (dict): The filename of each document in `DIR_INPUT_DOCX`, keyed on document id.
+        store (crs.ResultStore): The app's result store.
+        batch_mode (bool): Submit the prompts as one Message Batch instead of interactive calls.
+    """
+
+    # Only send documents that are new or changed, and not already in the store from an interrupted run
+    dict_docs_to_review, dict_doc_hashes = crs.filter_processed(
+        dict_docs_to_review, DIR_INPUT_DOCX, store, skip_processed=SKIP_PROCESSED)
+
+    # Load the documents, parsing them in worker processes, one per core
+    list_docs, list_texts = load_documents(dict_docs_to_review)
+
+    # Condense long articles into notes, section by section, so that every article fits in one final prompt
+    list_condensed = clc.condense_long_texts(
+        list_texts,
+        plan=CHUNK_PLAN,
+        system_context=SYSTEM_CONTEXT,
+        options=cll.CallOptions(temperature=TEMPERATURE, max_tokens=MAP_MAX_TOKENS, use_cache=USE_CACHE),
+        max_concurrency=MAX_CONCURRENCY)
+    del list_texts
+
+    # Set the prompts, and the options they are sent with
+    list_prompts = [build_prompt(tb_text, n_sections) for tb_text, n_sections in list_condensed]
+    options = cll.CallOptions(
+        temperature=TEMPERATURE, max_tokens=ANSWER_MAX_TOKENS, use_cache=USE_CACHE,
+        tool=cso.tool_definition(QUESTIONS), stream_json=STREAM_JSON)
+
+    def store_answers(i: int, response_dict: dict):
+        """Append one response's answers to the store as soon as they are complete."""
+        tb_id, tb_filename, tb_url = list_docs[i]
+        print("")
+        print(f"Key: {tb_id}, Value: {tb_filename}")
+
+        # Store the output
+        tmp_dict = {
+            "tb_id": tb_id,
+            "tb_filename": tb_filename,
+            "tb_url": tb_url,
+            "llm_response": response_dict}
+        store.append(tmp_dict, dict_doc_hashes[tb_id])
+
+    # Check each response against the questions as it arrives
+    checker = cso.AnswerChecker(SYSTEM_CONTEXT, on_complete=store_answers, max_concurrency=MAX_CONCURRENCY)
+
+    def check_response(i: int, response_str: str):
+        """Check one response against the questions as soon as it arrives."""
+        checker.check(i, response_str, list_prompts[i], QUESTIONS, options)
+
+    # Send the prompts to the LLM and choose which context to use; each response is checked as it arrives
+    try:
+        if batch_mode:
+            # Map each response back to its document by id
+            cll.llm_response_batch(
+                prompts={doc[0]: prompt for doc, prompt in zip(list_docs, list_prompts)},
+                system_context=SYSTEM_CONTEXT,
+                options=options,
+                on_result=check_response,
+                path_state=DIR_OUTPUT + FNAME_OUTPUT + "__batch.json")
+        else:
+            # Send the prompts concurrently
+            cll.llm_response_many(
+                prompts=list_prompts,
+                system_context=SYSTEM_CONTEXT,
+                options=options,
+                max_concurrency=MAX_CONCURRENCY,
+                on_result=check_response)
+    finally:
+        # Ask again for every answer that is missing or invalid, all at once rather than one response at a time, even
+        # if some calls failed, so that every response that did come back is stored
+        checker.ask_again()
+
+
+def main():
+    """Summarise each new or changed article in the input folder."""
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every LLM call in this run
+    cme.start_run("app_2_2")
 
     # Get list of filenames in input directory
     list_docs_to_review = clm.list_docx_in_directory(DIR_INPUT_DOCX)
@@ -28,66 +236,58 @@ if __name__ == "__main__":
     if len(dict_docs_to_review) == 0:
         print(f"No docx files in input directory: '{DIR_INPUT_DOCX}'")
     else:
-        output_list_of_dicts = []
-        for tb_id, tb_filename in dict_docs_to_review.items():
-            print("")
-            print(f"Key: {tb_id}, Value: {tb_filename}")
-
-            tb_url, tb_text = clm.load_docx_to_str(DIR_INPUT_DOCX + tb_filename)
-
-            # Set the prompt
-            prompt = f"""
-                Given the article below, extract summary information for the following pieces of information.
-                Use British spelling instead of American spelling.
-                Provide output as a Python dictionary with the number as the key and your response as the value.
-                Use double quotes and start and end with curly braces.
-                For 8 to 12, respond in one sentence.
-                For 13 to 15, respond in a few words.
-                It is very important that you do not add introductory remarks.
-                If you add introductory remarks I will fire you.
-                Do NOT add introductory remarks in any circumstances.
-                    1. What is the title of the article?
-                    2. Who is the author?
-                    3. Which company or organisation is the author from?
-                    4. What is the date of the article?
-                    5. Are there any code examples (Yes or No)?
-                    6. Summarise the article in one sentence.
-                    7. Summarise the article in seven sentences.
-                    8. What is discussed?
-                    9. How does it work?
-                    10. Why is this relevant?
-                    11. What are the risks?
-                    12. What are the opportunities?
-                    13. What is the primary technique used?
-                    14. What is the primary tool used?
-                    15. What is the primary domain mentioned in the article?
-
-                Return "Unknown" for a particular piece of information if it is not given.
-
-                Article:
-                {tb_text}
-                """
-
-            # Send the prompt to the LLM and choose which context to use
-            response_str = cll.llm_response(
-                prompt=prompt,
-                system_context=cll.llm_contexts()["Normal"],
-                temperature=0)
-
-            # Convert response to dict
-            response_dict = cll.convert_llm_response_to_dict(response_str)
-            del response_str
-
-            # Append to output
-            tmp_dict = {
-                "tb_id": tb_id,
-                "tb_filename": tb_filename,
-                "tb_url": tb_url,
-                "llm_response": response_dict}
-            output_list_of_dicts.append(tmp_dict)
-
-        # Overwrite json file
-        cll.export_this_run_to_json(output_list_of_dicts, DIR_OUTPUT + FNAME_OUTPUT)
-
-        # Incrementally add output to pipe-delimited txt file
-        cll.insert_into_txt_from_json(DIR_OUTPUT + FNAME_OUTPUT)
+        # Each result is appended to the store as soon as it arrives
+        store = crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, OUTPUT_COLUMNS, id_field="tb_id")
+
+        process_documents(dict_docs_to_review, store)
+
+        # Incrementally add every stored result not yet exported, including any from an interrupted run, to
+        # the pipe-delimited txt file
+        n_exported = store.export_txt()
+        store.close()
+
+        if USE_CACHE:
+            print(f"LLM cache: {crc.cache_stats()}")
+
+        # Report latency, throughput and cost
+        print(cme.report(n_documents=n_exported))
+
+
+def watch():
+    """Summarise articles as they arrive in the input folder, moving each to the reviewed folder once stored."""
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every LLM call while watching
+    cme.start_run("app_2_2")
+
+    # The store stays open between batches, and each batch is exported as soon as it is stored
+    store = crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, OUTPUT_COLUMNS, id_field="tb_id")
+
+    def process_batch(list_filenames: list):
+        """Send one batch of new documents interactively, returning the files that are done."""
+        dict_docs = {filename[:7]: filename for filename in list_filenames}
+
+        # Time each batch from when it starts, rather than from the end of the last one
+        cme.clear_events()
+        process_documents(dict_docs, store, batch_mode=False)
+
+        # Report the batch's latency, throughput and cost, then forget its events so memory stays flat while watching
+        print(cme.report(n_documents=store.export_txt()))
+        cme.clear_events()
+        return list(dict_docs.values())
+
+    try:
+        cib.watch(DIR_INPUT_DOCX, DIR_REVIEWED_DOCX, process_batch)
+    finally:
+        n_exported = store.export_txt()
+        store.close()
+
+        # Report the latency, throughput and cost of any batch interrupted with Ctrl+C
+        if cme.events():
+            print(cme.report(n_documents=n_exported))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""This module downloads web pages and asks an LLM to summarise them in one streaming pipeline.
+See app_02/README.md
+"""
+
+from ..common_lib import chunking as clc
+from ..common_lib import html_extract as che
+from ..common_lib import llms as cll
+from ..common_lib import metrics as cme
+from ..common_lib import misc_utils as clm
+from ..common_lib import parse_pool as cpp
+from ..common_lib import pipeline as cpl
+from ..common_lib import response_cache as crc
+from ..common_lib import result_store as crs
+from ..common_lib import structured_output as cso
+from ..common_lib import web_fetch as cwf
+from . import app_2_1__text_from_web_page as app_2_1
+from . import app_2_2__toolbox_summary as app_2_2
+
+# Specify input and output directories and filenames: the urls of app 2.1 in, the summaries of app 2.2 out
+DIR_INPUT = app_2_1.DIR_INPUT
+FNAME_INPUT = app_2_1.FNAME_INPUT
+DIR_OUTPUT = app_2_2.DIR_OUTPUT
+FNAME_OUTPUT = app_2_2.FNAME_OUTPUT
+
+# Worker threads for each stage: downloads wait on websites, extraction on the CPU and summaries on the LLM. Each
+# extraction thread hands its page to a worker process, so that pages are extracted on every core at once
+FETCH_WORKERS = 8
+MAX_PER_HOST = 2
+EXTRACT_WORKERS = cpp.MAX_WORKERS
+SUMMARISE_WORKERS = 4
+
+# Maximum number of pages waiting in front of each stage
+QUEUE_SIZE = 16
+
+# Also save each downloaded page to a Word document in app 2.1's output folder, e.g. to check or edit it by hand
+SAVE_DOCX = False
+
+# Save pages that have an 'ETag' or 'Last-Modified' header, so that reruns only download pages that have changed
+USE_HTTP_CACHE = True
+
+# Re-use saved LLM responses for identical prompts, so that reruns at temperature=0 return instantly
+USE_CACHE = True
+
+# Skip pages already summarised in a previous run, unless their text has changed; set to False to summarise them again
+SKIP_PROCESSED = True
+
+# Stream each response and ask again as soon as it stops being the json object asked for, or is cut off at max_tokens
+STREAM_JSON = True
+
+
+def fetch(item: tuple):
+    """Stage 1: download one page."""
+    tb_id, tb_url = item
+    return tb_id, cwf.fetch_url(tb_url, max_per_host=MAX_PER_HOST, use_cache=USE_HTTP_CACHE)
+
+
+def summarise(item: tuple):
+    """Stage 3: ask the LLM the questions about one page, condensing it first if it is long."""
+    tb_id, tb_url, tb_filename, tb_text, doc_sha256 = item
+
+    # Condense a long page into notes, section by section, so that it fits in one prompt
+    [(tb_text, n_sections)] = clc.condense_long_texts(
+        [tb_text],
+        plan=app_2_2.CHUNK_PLAN,
+        system_context=app_2_2.SYSTEM_CONTEXT,
+        options=cll.CallOptions(
+            temperature=app_2_2.TEMPERATURE, max_tokens=app_2_2.MAP_MAX_TOKENS, use_cache=USE_CACHE),
+        max_concurrency=SUMMARISE_WORKERS)
+
+    # Ask the questions, then again for any answers that are missing or invalid
+    prompt = app_2_2.build_prompt(tb_text, n_sections)
+    options = cll.CallOptions(
+        temperature=app_2_2.TEMPERATURE, max_tokens=app_2_2.ANSWER_MAX_TOKENS, use_cache=USE_CACHE,
+        tool=cso.tool_definition(app_2_2.QUESTIONS), stream_json=STREAM_JSON)
+    response_str = cll.llm_response(prompt=prompt, system_context=app_2_2.SYSTEM_CONTEXT, options=options)
+    response_dict = cso.complete_answers(response_str, app_2_2.QUESTIONS, prompt, app_2_2.SYSTEM_CONTEXT, options)
+
+    record = {"tb_id": tb_id, "tb_filename": tb_filename, "tb_url": tb_url, "llm_response": response_dict}
+    return record, doc_sha256
+
+
+def main():
+    """Download and summarise the web pages listed in the input csv, in one pipeline."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every fetch and LLM call in this run
+    cme.start_run("app_2_3")
+
+    # Import csv, filter and create dictionary
+    df = pd.read_csv(DIR_INPUT + FNAME_INPUT)
+    df_fil = df[(df["to_get"] == 1) & df["tb_url"].notna()]
+    dict_urls_to_get = dict(zip(df_fil["tb_id"], df_fil["tb_url"]))
+
+    if len(dict_urls_to_get) == 0:
+        print("No urls to download")
+    else:
+        # Each result is appended to the store as soon as it arrives
+        store = crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, app_2_2.OUTPUT_COLUMNS, id_field="tb_id")
+
+        # Pages already summarised, by id and hash of their text; a page is only known once it has been downloaded
+        exported, pending = store.processed()
+        set_done = exported | pending if SKIP_PROCESSED else pending
+
+        def extract(item: tuple):
+            """Stage 2: extract the text of one page, and drop it if it failed or is unchanged since the last run."""
+            tb_id, result = item
+            blocks = pool.parse(result["content"], "auto", result["encoding"]) if result["status_code"] == 200 else []
+            tb_filename = app_2_1.save_page(tb_id, result, blocks) if SAVE_DOCX else None
+            if result["status_code"] != 200:
+                print(f"Key: {tb_id}, skipped: no text (response {result['status_code'] or result['error']})")
+                return None
+
+            # The url goes on the first line, as in the Word documents that app 2.2 reads
+            tb_text = result["url"] + "\n" + che.blocks_to_text(blocks)
+            doc_sha256 = crs.text_sha256(tb_text)
+            if (tb_id, doc_sha256) in set_done:
+                print(f"Key: {tb_id}, skipped: already summarised and unchanged")
+                return None
+            return tb_id, result["url"], tb_filename, tb_text, doc_sha256
+
+        def store_result(item: tuple):
+            """Append one summary to the store as soon as it comes out of the pipeline."""
+            record, doc_sha256 = item
+            print("")
+            print(f"Key: {record['tb_id']}, Value: {record['tb_url']}")
+            store.append(record, doc_sha256)
+
+        # Download, extract and summarise at the same time, each stage passing pages on as soon as they are ready
+        try:
+            with cpp.ParsePool(che.extract_blocks, max_workers=EXTRACT_WORKERS) as pool:
+                dict_stats = cpl.run_pipeline(
+                    dict_urls_to_get.items(),
+                    stages=[
+                        ("fetch", fetch, FETCH_WORKERS),
+                        ("extract", extract, EXTRACT_WORKERS),
+                        ("summarise", summarise, SUMMARISE_WORKERS)],
+                    queue_size=QUEUE_SIZE,
+                    on_result=store_result)
+            for name, stats in dict_stats.items():
+                print(f"Stage '{name}': {stats['items']} pages in, {stats['dropped']} dropped, "
+                      f"{stats['errors']} errors, {stats['busy_s']:.1f}s busy")
+
+        # Incrementally add every stored result not yet exported, including any from an interrupted run, to
+        # the pipe-delimited txt file
+        finally:
+            n_exported = store.export_txt()
+            store.close()
+
+        if USE_CACHE:
+            print(f"LLM cache: {crc.cache_stats()}")
+
+        # Report latency, throughput and cost
+        print(cme.report(n_documents=n_exported))
+
+
+if __name__ == "__main__":
+    main()
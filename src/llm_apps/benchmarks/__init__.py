@@ -0,0 +1,2 @@
+"""Local stand-in servers and benchmarks for exercising the apps without spending API credits.
+"""
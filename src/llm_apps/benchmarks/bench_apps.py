@@ -0,0 +1,213 @@
+"""This module benchmarks the apps end to end against local stand-ins for the Anthropic API and the web.
+
+For each corpus size, a throwaway copy of the data folders is filled with generated inputs: job descriptions, a CV
+and articles as docx files, and a csv of urls on the mock web server. Each app is then run as it would be from the
+command line, in its own process, and timed; its peak memory is read from the operating system when it exits.
+
+Runs use no API credits and no real websites, so the numbers reflect the apps' own overheads plus the simulated
+latency, and can be compared between versions to catch regressions. The shared rate limiter is switched off unless
+`--rpm` is given.
+
+Typical usage:
+    python -m llm_apps.benchmarks.bench_apps --sizes 10 40 160 --latency 0.5 --error-rate 0.02
+"""
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from docx import Document
+
+from . import mock_anthropic
+from . import mock_web
+
+# The apps, in the order they are run, with the name used on the command line
+APPS = {
+    "1_1": "llm_apps.app_01.app_1_1__shortlist",
+    "1_2": "llm_apps.app_01.app_1_2__compare",
+    "2_1": "llm_apps.app_02.app_2_1__text_from_web_page",
+    "2_2": "llm_apps.app_02.app_2_2__toolbox_summary",
+    "2_3": "llm_apps.app_02.app_2_3__web_to_summary"}
+
+# The repo's folders: 'src' for the apps and 'data' for the folder structure and txt headers
+DIR_SRC = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DIR_DATA = os.path.join(os.path.dirname(DIR_SRC), "data")
+
+WORDS = ("role", "data", "scientist", "python", "cloud", "the", "a", "of", "team", "model", "experience", "and",
+         "with", "machine", "learning", "deploy", "salary", "hybrid", "senior", "stakeholders", "transformer", "token")
+
+
+def _save_docx(path: str, url: str, rng: random.Random, n_paragraphs: int):
+    """Save a generated document: a url on the first line, then paragraphs of random words."""
+    doc = Document()
+    doc.add_paragraph(url)
+    for _ in range(n_paragraphs):
+        doc.add_paragraph(" ".join(rng.choice(WORDS) for _ in range(40)))
+    doc.save(path)
+
+
+def build_tree(dir_root: str, n_docs: int, web_url: str, n_paragraphs=30):
+    """Copy the data folders to a throwaway root and fill them with generated inputs.
+
+    Args:
+        dir_root (str): The root to build in, which the apps are given as their root folder.
+        n_docs (int): The number of documents (and urls) per app.
+        web_url (str): The base url of the mock web server.
+        n_paragraphs (int): The number of paragraphs per generated document.
+    """
+
+    shutil.copytree(DIR_DATA, os.path.join(dir_root, "data"))
+    for folder in ("logs", "cache"):
+        os.makedirs(os.path.join(dir_root, folder))
+
+    rng = random.Random(0)
+    dir_app_01 = os.path.join(dir_root, "data", "app_01__job_search_assistant")
+    dir_app_02 = os.path.join(dir_root, "data", "app_02__skills_toolbox")
+    for i in range(n_docs):
+        _save_docx(os.path.join(dir_app_01, "1.1.1__to_review", f"job-{i:03d}_generated.docx"),
+                   f"https://www.example.com/jobs/view/{i}", rng, n_paragraphs)
+        _save_docx(os.path.join(dir_app_02, "2.2.1__to_review", f"tb_{i:04d}_generated.docx"),
+                   f"{web_url}/page/{i}.html", rng, n_paragraphs)
+    shutil.copytree(os.path.join(dir_app_01, "1.1.1__to_review"), os.path.join(dir_app_01, "1.2.1__to_review"),
+                    dirs_exist_ok=True)
+    _save_docx(os.path.join(dir_app_01, "1.2.3__cv_to_compare", "cv_generated.docx"), "CV", rng, n_paragraphs)
+
+    with open(os.path.join(dir_app_02, "2.1.1__input_sources", "2.1.1__input_sources.csv"), "w",
+              encoding="utf-8") as f:
+        f.write("tb_id,to_get,tb_url\n")
+        for i in range(n_docs):
+            f.write(f"tb_{i:04d},1,{web_url}/page/{i}.html\n")
+
+
+def run_app(module: str, dir_root: str, env: dict):
+    """Run one app in its own process, with the throwaway root as its root folder.
+
+    Args:
+        module (str): The app's module, e.g. 'llm_apps.app_01.app_1_1__shortlist'.
+        dir_root (str): The throwaway root.
+        env (dict): The environment variables for the process.
+
+    Returns:
+        float: The wall time in seconds.
+        float: The peak resident memory in MB.
+        int: The exit status; 0 for success.
+    """
+
+    path_log = os.path.join(dir_root, "logs", module.rsplit(".", 1)[1] + "__stdout.txt")
+    with open(path_log, "w", encoding="utf-8") as f_log:
+        start = time.perf_counter()
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [sys.executable, "-m", module], cwd=dir_root, env=dict(env, LLM_APPS_ROOT=dir_root), stdout=f_log,
+            stderr=subprocess.STDOUT)
+
+        # wait4() returns the child's resource usage, including its peak memory, which Popen.wait() does not
+        _, status, rusage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    if process.returncode != 0:
+        with open(path_log, "r", encoding="utf-8") as f_log:
+            print(f"{module} exited with status {process.returncode}:\n" + "".join(f_log.readlines()[-15:]))
+    return seconds, peak_mb, process.returncode
+
+
+def app_env(api_url: str, rpm=0):
+    """Return the environment the apps are run in: pointed at the mock API, with the rate limiter set to `rpm`."""
+
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": DIR_SRC + os.pathsep + env.get("PYTHONPATH", ""),
+        "ANTHROPIC_BASE_URL": api_url,
+        "ANTHROPIC_API_KEY": "mock",
+        "LLM_BATCH_POLL_SECONDS": "1",
+        "LLM_RATE_LIMIT_RPM": str(rpm),
+        "LLM_RATE_LIMIT_INPUT_TPM": "0",
+        "LLM_RATE_LIMIT_OUTPUT_TPM": "0"})
+    return env
+
+
+def run_corpus(n_docs: int, apps: tuple, web_url: str, env: dict):
+    """Run each app over one throwaway corpus of `n_docs` documents, printing a line per app.
+
+    Returns:
+        list: One dict per app, with keys 'app', 'docs', 'seconds', 'docs_per_second', 'peak_mb' and 'status'.
+    """
+
+    list_results = []
+    with tempfile.TemporaryDirectory() as dir_root:
+        build_tree(dir_root, n_docs, web_url)
+        for app in apps:
+            seconds, peak_mb, status = run_app(APPS[app], dir_root, env)
+            list_results.append({
+                "app": app, "docs": n_docs, "seconds": seconds, "docs_per_second": n_docs / seconds,
+                "peak_mb": peak_mb, "status": status})
+            print(f"{app:>4} {n_docs:>6} {seconds:>8.2f} {n_docs / seconds:>8.1f} {peak_mb:>8.1f}"
+                  + ("" if status == 0 else "  FAILED"))
+    return list_results
+
+
+def run_benchmark(sizes=(10, 40), apps=tuple(APPS), api_settings=None, web_latency=0.05, rpm=0):
+    """Run each app over corpora of increasing size and report documents per second and peak memory.
+
+    Args:
+        sizes (tuple): The number of documents per corpus.
+        apps (tuple): The apps to run, e.g. ('1_1', '2_2').
+        api_settings (mock_anthropic.MockSettings): How the mock API behaves, e.g. its latency and error rate; None
+            for a latency of 0.2 seconds per message and no errors.
+        web_latency (float): Seconds the mock web server waits before answering each request.
+        rpm (int): Requests per minute for the shared rate limiter; 0 to switch it off.
+
+    Returns:
+        list: One dict per run, with keys 'app', 'docs', 'seconds', 'docs_per_second', 'peak_mb' and 'status'.
+    """
+
+    api_server = mock_anthropic.make_server(settings=api_settings or mock_anthropic.MockSettings(latency=0.2))
+    web_server = mock_web.make_server(latency=web_latency)
+    for server in (api_server, web_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = app_env(f"http://127.0.0.1:{api_server.server_address[1]}", rpm)
+    web_url = f"http://127.0.0.1:{web_server.server_address[1]}"
+
+    list_results = []
+    print(f"{'app':>4} {'docs':>6} {'seconds':>8} {'docs/s':>8} {'peak MB':>8}")
+    try:
+        for n_docs in sizes:
+            list_results += run_corpus(n_docs, apps, web_url, env)
+    finally:
+        api_server.shutdown()
+        web_server.shutdown()
+
+    return list_results
+
+
+def main():
+    """Run the benchmark from the command line."""
+
+    parser = argparse.ArgumentParser(description="Benchmark the apps end to end against local mock servers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 40])
+    parser.add_argument("--apps", nargs="+", default=list(APPS), choices=list(APPS))
+    parser.add_argument("--latency", type=float, default=0.2, help="mock API seconds per message")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="mock API seconds per output token")
+    parser.add_argument("--output-tokens", type=int, default=None, help="mock API output tokens per message")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of messages rejected with 429 or 529")
+    parser.add_argument("--web-latency", type=float, default=0.05, help="mock web server seconds per request")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute for the rate limiter; 0 for none")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of streamed replies made invalid json")
+    args = parser.parse_args()
+
+    api_settings = mock_anthropic.MockSettings(
+        latency=args.latency, seconds_per_token=args.seconds_per_token, output_tokens=args.output_tokens,
+        error_rate=args.error_rate, retry_after=0.5, invalid_rate=args.invalid_rate)
+    run_benchmark(args.sizes, args.apps, api_settings, args.web_latency, args.rpm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""This module benchmarks loading the text of docx files: python-docx vs. the streaming loader and its text cache.
+
+A corpus of documents is generated in a temporary directory, resembling job descriptions and articles: a url on the
+first line, then headings and paragraphs of several runs each, and a small table.
+
+Typical usage:
+    python -m llm_apps.benchmarks.bench_docx_load --docs 200 --paragraphs 150
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from docx import Document
+
+from ..common_lib import misc_utils as clm
+
+WORDS = ("role", "data", "scientist", "python", "cloud", "the", "a", "of", "team", "model", "experience", "and",
+         "with", "machine", "learning", "deploy", "salary", "hybrid", "senior", "stakeholders")
+
+
+def generate_corpus(dir_corpus: str, n_docs: int, n_paragraphs: int):
+    """Save generated docx files to a directory.
+
+    Args:
+        dir_corpus (str): The directory to save to.
+        n_docs (int): The number of documents.
+        n_paragraphs (int): The number of paragraphs per document.
+
+    Returns:
+        list: The paths of the documents.
+    """
+
+    rng = random.Random(0)
+    list_paths = []
+    for i in range(n_docs):
+        doc = Document()
+        doc.add_paragraph(f"https://www.example.com/jobs/view/{i}")
+        for j in range(n_paragraphs):
+            if j % 15 == 0:
+                doc.add_heading(" ".join(rng.choice(WORDS) for _ in range(4)), level=2)
+            paragraph = doc.add_paragraph(" ".join(rng.choice(WORDS) for _ in range(30)))
+            paragraph.add_run(" " + " ".join(rng.choice(WORDS) for _ in range(5))).bold = True
+        table = doc.add_table(rows=2, cols=2)
+        table.cell(0, 0).text = "Benefits"
+        path = os.path.join(dir_corpus, f"job-{i:03d}_generated.docx")
+        doc.save(path)
+        list_paths.append(path)
+    return list_paths
+
+
+def load_docx_to_str_python_docx(path_docx: str):
+    """The previous loader: build the python-docx object model and concatenate the paragraph text."""
+    doc = Document(path_docx)
+    first_paragraph = doc.paragraphs[0].text
+    all_text = ""
+    for paragraph in doc.paragraphs:
+        all_text += paragraph.text + "\n"
+    return first_paragraph, all_text
+
+
+def run_benchmark(n_docs=100, n_paragraphs=150):
+    """Time each loader over the same generated corpus, and check they give the same text.
+
+    Args:
+        n_docs (int): The number of documents.
+        n_paragraphs (int): The number of paragraphs per document.
+
+    Returns:
+        dict: Documents per second, keyed on loader name.
+    """
+
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        list_paths = generate_corpus(dir_tmp, n_docs, n_paragraphs)
+        clm.DIR_DOCX_TEXT_CACHE = os.path.join(dir_tmp, "cache")
+        print(f"{n_docs} documents, {sum(os.path.getsize(p) for p in list_paths) / n_docs / 1000:.0f} KB each")
+
+        dict_loaders = {
+            "python-docx (previous)": load_docx_to_str_python_docx,
+            "streaming xml, cold cache": clm.load_docx_to_str,
+            "streaming xml, warm cache": clm.load_docx_to_str,
+            "streaming xml, no cache": lambda path: clm.load_docx_to_str(path, use_cache=False)}
+
+        dict_docs_per_second = {}
+        dict_texts = {}
+        for name, load in dict_loaders.items():
+            start = time.perf_counter()
+            dict_texts[name] = [load(path) for path in list_paths]
+            seconds = time.perf_counter() - start
+            dict_docs_per_second[name] = n_docs / seconds
+            print(f"{name:>26}: {n_docs / seconds:8.1f} docs/s")
+
+        for name, texts in dict_texts.items():
+            if texts != dict_texts["python-docx (previous)"]:
+                print(f"Warning: '{name}' gave different text to python-docx")
+
+    return dict_docs_per_second
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark loading the text of docx files.")
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=150)
+    args = parser.parse_args()
+
+    run_benchmark(args.docs, args.paragraphs)
@@ -0,0 +1,106 @@
+"""This module benchmarks html text extraction: pages per second for each parser backend.
+
+The pages are generated: headings, paragraphs with inline markup and links, navigation and script blocks, to
+resemble an article page. BeautifulSoup with 'html.parser' (the approach app_2_1 used previously) is included as the
+baseline if it is installed.
+
+Typical usage:
+    python -m llm_apps.benchmarks.bench_html_extract --pages 200 --paragraphs 300
+"""
+
+import argparse
+import importlib.util
+import random
+import time
+
+from ..common_lib import html_extract as che
+
+WORDS = ("model", "language", "data", "training", "the", "a", "of", "neural", "network", "transformer", "token",
+         "attention", "learning", "deep", "inference", "and", "is", "with", "large", "evaluation")
+
+
+def generate_page(n_paragraphs: int, seed: int):
+    """Generate the html of a synthetic article page.
+
+    Args:
+        n_paragraphs (int): The number of paragraphs in the article body.
+        seed (int): The random seed, so pages are reproducible.
+
+    Returns:
+        str: The page html.
+    """
+
+    rng = random.Random(seed)
+
+    def sentence(n_words):
+        return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+    parts = [f"<html><head><title>{sentence(6)}</title><script>var config = {{a: 1}};</script>"
+             "<style>p {margin: 0}</style></head><body>"
+             "<nav><ul>" + "".join(f"<li><a href='/{i}'>Link {i}</a></li>" for i in range(30)) + "</ul></nav>"
+             f"<h1>{sentence(5)}</h1>"]
+    for i in range(n_paragraphs):
+        if i % 20 == 0:
+            parts.append(f"<h2>{sentence(4)}</h2>")
+        elif i % 7 == 0:
+            parts.append(f"<h3>{sentence(3)}</h3>")
+        parts.append(f"<div class='para'><p>{sentence(25)} <b>{sentence(3)}</b> <a href='#{i}'>{sentence(2)}</a> "
+                     f"&amp; {sentence(15)}<sup>[{i}]</sup></p></div>")
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def _extract_bs4(html: str):
+    """The previous approach in app_2_1: BeautifulSoup with Python's html.parser."""
+    from bs4 import BeautifulSoup  # pylint: disable=import-outside-toplevel
+    soup = BeautifulSoup(html, "html.parser")
+    return [(tag.name, tag.get_text()) for tag in soup.find_all(["p", "title", "h1", "h2", "h3"])]
+
+
+def run_benchmark(n_pages=100, n_paragraphs=300):
+    """Time each backend over the same generated pages.
+
+    Args:
+        n_pages (int): The number of pages to parse with each backend.
+        n_paragraphs (int): The number of paragraphs per page.
+
+    Returns:
+        dict: Pages per second, keyed on backend name.
+    """
+
+    pages = [generate_page(n_paragraphs, seed) for seed in range(n_pages)]
+    mb_total = sum(len(page) for page in pages) / 1e6
+    print(f"{n_pages} pages, {mb_total / n_pages * 1000:.0f} KB each")
+
+    dict_extractors = {backend: (lambda html, b=backend: che.extract_blocks(html, backend=b))
+                       for backend in che.available_backends()}
+    if importlib.util.find_spec("bs4") is not None:
+        dict_extractors["bs4 + html.parser (previous)"] = _extract_bs4
+
+    dict_pages_per_second = {}
+    n_blocks = None
+    for name, extract in dict_extractors.items():
+        start = time.perf_counter()
+        for page in pages:
+            blocks = extract(page)
+        seconds = time.perf_counter() - start
+
+        # Each backend should find the same blocks
+        if n_blocks is not None and len(blocks) != n_blocks:
+            print(f"Warning: '{name}' found {len(blocks)} blocks on the last page, expected {n_blocks}")
+        n_blocks = len(blocks)
+
+        dict_pages_per_second[name] = n_pages / seconds
+        print(f"{name:>30}: {n_pages / seconds:8.1f} pages/s ({mb_total / seconds:6.1f} MB/s)")
+
+    return dict_pages_per_second
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark html text extraction backends.")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=300)
+    args = parser.parse_args()
+
+    run_benchmark(args.pages, args.paragraphs)
@@ -0,0 +1,107 @@
+"""This module checks that the `llm-apps` command and the apps start quickly.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, which reports the time taken by every
+import. The check fails if a module takes longer than its budget, or if it imports any of the heavy packages that
+are only meant to be loaded once a run needs them, e.g. anthropic when every response comes from the cache. It is
+run as a pre-commit hook, so a heavy import added at the top of a module is caught before it is committed.
+
+The budgets are several times the measured times, to allow for slower machines; the list of heavy packages is the
+stricter check.
+
+Typical usage:
+    python -m llm_apps.benchmarks.bench_import_time
+    python -m llm_apps.benchmarks.bench_import_time --repeat 5 --budget-scale 2
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Milliseconds each module may take to import, including everything it imports: the command itself, and each app
+# (the apps only load their common_lib modules, lxml for reading docx files and NumPy for app 1.2)
+BUDGETS_MS = {
+    "llm_apps.cli": 50,
+    "llm_apps.app_01.app_1_1__shortlist": 250,
+    "llm_apps.app_01.app_1_2__compare": 400,
+    "llm_apps.app_02.app_2_1__text_from_web_page": 250,
+    "llm_apps.app_02.app_2_2__toolbox_summary": 250,
+    "llm_apps.app_02.app_2_3__web_to_summary": 250}
+
+# Packages that take a noticeable time to import, and so must not be imported until they are needed
+HEAVY_PACKAGES = ("anthropic", "pandas", "docx", "requests", "dotenv", "httpx", "pydantic")
+
+# The repo's 'src' folder, so the check works whether or not the package is installed
+DIR_SRC = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure_import(module: str):
+    """Import a module in a fresh interpreter and read the time taken by each import.
+
+    Args:
+        module (str): The module to import, e.g. 'llm_apps.cli'.
+
+    Returns:
+        float: The milliseconds taken to import the module, including everything it imports.
+        set: The top-level packages imported along the way.
+    """
+
+    env = dict(os.environ, PYTHONPATH=DIR_SRC + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], env=env, capture_output=True, text=True,
+        check=True)
+
+    # Each line is 'import time: self [us] | cumulative | imported package', nested imports indented under their parent
+    total_ms = 0.0
+    packages = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        packages.add(name.strip().split(".")[0])
+        if name.strip() == module:
+            total_ms = int(cumulative) / 1000
+    return total_ms, packages
+
+
+def check_import_times(repeat=3, budget_scale=1.0):
+    """Measure each module's import time against its budget, and check that it avoids the heavy packages.
+
+    Args:
+        repeat (int): The number of times each module is imported; the fastest is kept, as the others include noise
+            from the rest of the machine.
+        budget_scale (float): Multiplies every budget, e.g. for a slow machine.
+
+    Returns:
+        list: One message per failure; empty if every module is within its budget.
+    """
+
+    list_failures = []
+    print(f"{'module':<45} {'ms':>8} {'budget':>8}")
+    for module, budget_ms in BUDGETS_MS.items():
+        list_ms = []
+        for _ in range(repeat):
+            total_ms, packages = measure_import(module)
+            list_ms.append(total_ms)
+        budget_ms *= budget_scale
+        heavy = sorted(packages.intersection(HEAVY_PACKAGES))
+        print(f"{module:<45} {min(list_ms):>8.1f} {budget_ms:>8.0f}"
+              + (f"  imports {', '.join(heavy)}" if heavy else ""))
+        if min(list_ms) > budget_ms:
+            list_failures.append(f"{module} took {min(list_ms):.0f}ms to import; the budget is {budget_ms:.0f}ms")
+        if heavy:
+            list_failures.append(f"{module} imports {', '.join(heavy)} at import time; import it where it is used")
+    return list_failures
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Check the import time of the command and the apps.")
+    parser.add_argument("--repeat", type=int, default=3, help="imports per module; the fastest is kept")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiplies every budget")
+    args = parser.parse_args()
+
+    failures = check_import_times(args.repeat, args.budget_scale)
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,83 @@
+"""This module benchmarks parsing in worker processes: documents per second for 1, 2, 4, ... workers.
+
+Word documents are generated as in bench_docx_load.py and loaded without the text cache, and web pages are generated
+as in bench_html_extract.py; each is parsed with `cpp.parse_many()`. One worker parses in the calling process, the
+baseline; the speedup with more workers depends on the number of cores, printed first.
+
+Typical usage:
+    python -m llm_apps.benchmarks.bench_parse_pool --docs 200 --pages 200 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from ..common_lib import html_extract as che
+from ..common_lib import misc_utils as clm
+from ..common_lib import parse_pool as cpp
+from .bench_docx_load import generate_corpus
+from .bench_html_extract import generate_page
+
+
+def time_parse(function, dict_args: dict, list_workers: list, label: str):
+    """Time parsing the same items with each number of workers.
+
+    Args:
+        function (callable): The parser.
+        dict_args (dict): The arguments for each item, keyed on id.
+        list_workers (list): The numbers of workers to time.
+        label (str): The name of the items, for the printout.
+
+    Returns:
+        dict: Items per second, keyed on the number of workers.
+    """
+
+    dict_rate = {}
+    for n_workers in list_workers:
+        start = time.perf_counter()
+        cpp.parse_many(function, dict_args, max_workers=n_workers)
+        dict_rate[n_workers] = len(dict_args) / (time.perf_counter() - start)
+        print(f"{label:>6}, {n_workers:>2} workers: {dict_rate[n_workers]:8.1f}/s "
+              f"({dict_rate[n_workers] / dict_rate[list_workers[0]]:.2f}x)")
+    return dict_rate
+
+
+def run_benchmark(n_docs=200, n_pages=200, list_workers=None):
+    """Generate Word documents and web pages, then time parsing them with each number of workers.
+
+    Args:
+        n_docs (int): The number of Word documents.
+        n_pages (int): The number of web pages.
+        list_workers (list): The numbers of workers to time; by default 1, 2, 4, ... up to the number of cores.
+
+    Returns:
+        dict: Items per second keyed on the number of workers, for 'docx' and 'html'.
+    """
+
+    if list_workers is None:
+        list_workers = [1]
+        while list_workers[-1] < cpp.MAX_WORKERS:
+            list_workers.append(min(2 * list_workers[-1], cpp.MAX_WORKERS))
+    print(f"{os.cpu_count()} cores; workers started with 'spawn', which is included in the times")
+
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        list_paths = generate_corpus(dir_tmp, n_docs, 150)
+        dict_docx = time_parse(clm.load_docx_to_str, {path: (path, False) for path in list_paths}, list_workers,
+                               "docx")
+
+    dict_args = {i: (generate_page(300, i).encode("utf-8"), "auto", "utf-8") for i in range(n_pages)}
+    dict_html = time_parse(che.extract_blocks, dict_args, list_workers, "html")
+
+    return {"docx": dict_docx, "html": dict_html}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark parsing in worker processes.")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+")
+    args = parser.parse_args()
+
+    run_benchmark(args.docs, args.pages, args.workers)
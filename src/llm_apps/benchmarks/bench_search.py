@@ -0,0 +1,119 @@
+"""This module benchmarks the full-text search index: loading results, and the time per search as they grow.
+
+A store of results is generated in a temporary directory, resembling the job description summaries of app 1.1, then
+loaded into the index in full and incrementally, and each kind of search is timed.
+
+Typical usage:
+    python -m llm_apps.benchmarks.bench_search --records 20000
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from ..app_01 import app_1_1__shortlist as app_1_1
+from ..common_lib import search_index as csi
+
+WORDS = ("role", "data", "scientist", "python", "cloud", "the", "a", "of", "team", "model", "experience", "and",
+         "with", "machine", "learning", "deploy", "mlops", "hybrid", "senior", "stakeholders", "vision", "pandas")
+
+# Made-up words that, with the words above, make a vocabulary in which a word's frequency falls with its rank, as in
+# real text; the common words above are used most, so searches for them match many results
+VOCABULARY = WORDS + tuple(f"term{i}" for i in range(5000))
+CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+# The searches timed, by name: (query, filters, order_by)
+SEARCHES = {
+    "common keyword": ("mlops", [], None),
+    "rare keyword": ("term1500", [], None),
+    "phrase in one column": ('tools_summary: "machine learning"', [], None),
+    "field filters": (None, [("salary_max", ">", 80000), ("sentiment", ">=", 2)], None),
+    "keyword and filter": ("mlops AND pandas", [("salary_max", ">", 80000)], None),
+    "sorted by field": ("vision", [], "-inspiration")}
+
+
+def generate_store(path_jsonl: str, n_records: int, start=0):
+    """Append generated results to a '.jsonl' store, in the store's format.
+
+    Args:
+        path_jsonl (str): The path of the store.
+        n_records (int): The number of results.
+        start (int): The number of the first result.
+    """
+
+    rng = random.Random(start)
+    with open(path_jsonl, "a", encoding="utf-8") as f:
+        for i in range(start, start + n_records):
+            answers = {}
+            for column, field_type, _, *keywords in app_1_1.QUESTIONS:
+                if field_type == "integer":
+                    answers[column] = rng.randint(keywords[0]["minimum"], keywords[0]["maximum"])
+                else:
+                    words = rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=rng.randint(3, 30))
+                    answers[column] = " ".join(words)
+            salary = rng.randrange(30, 150) * 1000
+            answers["salary_range"] = f"£{salary:,} - £{salary + 10000:,}"
+            record = {"job_id": f"job-{i:06d}", "job_filename": f"job-{i:06d}_generated.docx",
+                      "job_link": f"https://www.example.com/jobs/view/{i}", "llm_response": answers,
+                      "cluster_id": f"job-{i:06d}"}
+            f.write(json.dumps({"doc_sha256": f"{i:064x}", "created_at": "2024-01-01T00:00:00+00:00",
+                                "record": record}) + "\n")
+
+
+def run_benchmark(n_records=20000, repeats=20):
+    """Load a generated store into the index, then time each search.
+
+    Args:
+        n_records (int): The number of results in the store.
+        repeats (int): The number of times each search is run.
+
+    Returns:
+        dict: The median milliseconds per search, keyed on search name.
+    """
+
+    columns = {column: "string" for column in app_1_1.OUTPUT_COLUMNS}
+    columns.update({column: field_type for column, field_type, *_ in app_1_1.QUESTIONS})
+    derived = {"salary_min": ("salary_range", min), "salary_max": ("salary_range", max)}
+
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        path_jsonl = os.path.join(dir_tmp, "results.jsonl")
+        generate_store(path_jsonl, n_records)
+        print(f"{n_records} results, {os.path.getsize(path_jsonl) / 1e6:.1f} MB")
+
+        with csi.SearchIndex(os.path.join(dir_tmp, "index.sqlite"), path_jsonl, columns, ("job_id",), derived) as index:
+            start = time.perf_counter()
+            index.update()
+            print(f"{'full load':>22}: {time.perf_counter() - start:8.2f}s")
+
+            generate_store(path_jsonl, 100, start=n_records)
+            start = time.perf_counter()
+            index.update()
+            print(f"{'load 100 more':>22}: {1000 * (time.perf_counter() - start):8.1f}ms")
+
+            dict_ms = {}
+            for name, (query, filters, order_by) in SEARCHES.items():
+                list_ms = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    list_results = index.search(query, filters, order_by)
+                    list_ms.append(1000 * (time.perf_counter() - start))
+                dict_ms[name] = statistics.median(list_ms)
+                print(f"{name:>22}: {dict_ms[name]:8.2f}ms median, {max(list_ms):8.2f}ms max "
+                      f"({len(list_results)} results)")
+
+    return dict_ms
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the full-text search index.")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    run_benchmark(args.records, args.repeats)
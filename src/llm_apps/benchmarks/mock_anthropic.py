@@ -0,0 +1,362 @@
+"""This module runs a local stand-in for the Anthropic Messages API, for testing the apps without spending credits.
+
+It implements the endpoints used by `common_lib/llms.py`:
+- POST /v1/messages
+- POST /v1/messages/batches
+- GET /v1/messages/batches/{id}
+- GET /v1/messages/batches/{id}/results
+
+Replies are a json dictionary with one made-up answer per numbered question found in the prompt, so the apps can
+parse them as usual; a request that forces a tool call is answered with a call whose input has a made-up value of
+the right type for each field of the tool's input schema. Token counts are estimated from text length, and blocks
+marked with 'cache_control' are reported as written to the prompt cache the first time and read from it afterwards.
+
+To resemble the real API under load, each message can be delayed by a fixed latency plus a time per output token,
+reported with a fixed number of output tokens, and a share of messages can be rejected as rate limited (429) or
+overloaded (529) with a 'retry-after' header.
+
+Messages requested with 'stream' are sent as server-sent events, a few characters at a time, and a share of them
+can be made invalid json part way through, for testing how streamed responses are checked. Replies longer than the
+request's max_tokens are cut off with the stop reason 'max_tokens', as the real API does.
+
+Typical usage:
+    python -m llm_apps.benchmarks.mock_anthropic --port 8765 --latency 0.5 --error-rate 0.05 --output-tokens 400
+
+    Then, in another terminal, point the apps at it:
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 LLM_BATCH_POLL_SECONDS=1 python -m llm_apps.app_01.app_1_1__shortlist
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+
+# Seconds for which a submitted batch reports 'in_progress' before it has 'ended'
+BATCH_SECONDS = 2.0
+
+# Characters of text in each event of a streamed message
+STREAM_CHUNK_CHARS = 16
+
+
+class MockSettings(NamedTuple):
+    """How the stand-in server behaves; every setting has a default, and `_replace()` returns a copy with some changed.
+
+    Attributes:
+        latency (float): Seconds to wait before answering each message.
+        seconds_per_token (float): Further seconds to wait per output token, to resemble generation time.
+        output_tokens (int): Output tokens to report for each message (up to its max_tokens); None to estimate them
+            from the reply.
+        error_rate (float): The share of messages, from 0 to 1, rejected with a 429 or 529 error.
+        retry_after (float): The seconds sent in the 'retry-after' header of each error.
+        seed (int): The random seed for choosing which messages fail.
+        invalid_rate (float): The share of streamed messages, from 0 to 1, that stop being json part way through.
+    """
+
+    latency: float = 0.0
+    seconds_per_token: float = 0.0
+    output_tokens: int = None
+    error_rate: float = 0.0
+    retry_after: float = 1.0
+    seed: int = 0
+    invalid_rate: float = 0.0
+
+
+def _estimate_tokens(text: str):
+    """Roughly estimate the number of tokens in some text, at four characters per token."""
+    return max(1, len(text) // 4)
+
+
+def _mock_tool_input(tool: dict):
+    """Make up a value of the right type for each field of a tool's input schema."""
+    dict_input = {}
+    for n, (name, schema) in enumerate(tool["input_schema"].get("properties", {}).items(), start=1):
+        types = schema.get("type", "string")
+        field_type = next(t for t in types if t != "null") if isinstance(types, list) else types
+        if field_type in ("integer", "number"):
+            dict_input[name] = schema.get("minimum", 1)
+        elif field_type == "boolean":
+            dict_input[name] = True
+        elif field_type == "array":
+            dict_input[name] = []
+        else:
+            dict_input[name] = f"Mock answer to question {n}"
+    return dict_input
+
+
+def _mock_usage(params: dict, content: list, cache_prefixes: set, lock: threading.Lock):
+    """Estimate a request's input tokens, with the blocks marked 'cache_control' counted as cache writes or reads."""
+    usage = {
+        "input_tokens": _estimate_tokens(str(params.get("system", ""))) + _estimate_tokens(
+            json.dumps(params.get("tools", ""))),
+        "cache_creation_input_tokens": 0,
+        "cache_read_input_tokens": 0,
+        "output_tokens": 0}
+    for block in content:
+        n_tokens = _estimate_tokens(block.get("text", ""))
+        if "cache_control" in block:
+            prefix_hash = hashlib.sha256((str(params.get("system")) + block["text"]).encode("utf-8")).hexdigest()
+            with lock:
+                is_cached = prefix_hash in cache_prefixes
+                cache_prefixes.add(prefix_hash)
+            usage["cache_read_input_tokens" if is_cached else "cache_creation_input_tokens"] += n_tokens
+        else:
+            usage["input_tokens"] += n_tokens
+    return usage
+
+
+def _mock_message(params: dict, cache_prefixes: set, lock: threading.Lock, output_tokens=None, invalid=False):
+    """Build a Messages API response for the request `params`, optionally reporting a fixed number of output tokens.
+
+    With `invalid`, the comma after the first answer is dropped so that the reply stops being json part way through.
+
+    Returns:
+        dict: The message.
+        str: The text of the reply or, for a tool call, its input as json, as it would be streamed.
+    """
+
+    content = params["messages"][-1]["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    usage = _mock_usage(params, content, cache_prefixes, lock)
+
+    # Call the tool if one is forced, otherwise answer each numbered question in the prompt, e.g. '12. Write a brief
+    # draft cover letter.'
+    prompt = "\n".join(block.get("text", "") for block in content)
+    question_numbers = re.findall(r"^\s*(\d+)\.\s", prompt, flags=re.MULTILINE)
+    tool = next((tool for tool in params.get("tools", []) if tool["name"] == params.get("tool_choice", {}).get("name")),
+                None)
+    if tool is not None:
+        dict_input = _mock_tool_input(tool)
+        text = json.dumps(dict_input)
+    elif question_numbers:
+        text = json.dumps({n: f"Mock answer to question {n}" for n in dict.fromkeys(question_numbers)})
+    else:
+        text = "Mock response"
+    if invalid:
+        text = text.replace('", "', '" "', 1)
+
+    # Cut off a reply longer than max_tokens, at the same four characters per token; a tool call keeps the fields
+    # that were complete
+    stop_reason = "end_turn" if tool is None else "tool_use"
+    max_tokens = params.get("max_tokens", 1000)
+    if _estimate_tokens(text) > max_tokens:
+        text = text[:max_tokens * 4]
+        stop_reason = "max_tokens"
+        if tool is not None:
+            dict_input = {name: value for name, value in dict_input.items()
+                          if f"{json.dumps(name)}: {json.dumps(value)}" in text}
+    usage["output_tokens"] = min(output_tokens or _estimate_tokens(text), max_tokens)
+
+    return {
+        "id": "msg_" + uuid.uuid4().hex[:24],
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "mock"),
+        "content": [{"type": "text", "text": text} if tool is None else
+                    {"type": "tool_use", "id": "toolu_" + uuid.uuid4().hex[:24], "name": tool["name"],
+                     "input": dict_input}],
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": usage}, text
+
+
+class MockAnthropicHandler(BaseHTTPRequestHandler):
+    """Handle requests to the stand-in Messages API; settings and state are held on the server object."""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the console quiet; the apps print their own progress."""
+
+    def _send_json(self, status: int, body, content_type="application/json"):
+        """Send a json (or pre-encoded jsonl) response."""
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int):
+        """Reject a message as rate limited (429) or overloaded (529), as the real API does under load."""
+        error_type = "rate_limit_error" if status == 429 else "overloaded_error"
+        data = json.dumps({"type": "error", "error": {"type": error_type, "message": "Mock error"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("retry-after", f"{self.server.settings.retry_after:g}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, message: dict, text: str):
+        """Send a message as server-sent events, a few characters at a time, at the server's pace per output token."""
+        server = self.server
+        block = message["content"][0]
+        if block["type"] == "tool_use":
+            block_start = {**block, "input": {}}
+            delta = {"type": "input_json_delta", "partial_json": ""}
+        else:
+            block_start = {"type": "text", "text": ""}
+            delta = {"type": "text_delta", "text": ""}
+        delta_key = next(key for key in delta if key != "type")
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        seconds_per_token = server.settings.seconds_per_token
+        seconds_per_chunk = message["usage"]["output_tokens"] * seconds_per_token / max(1, len(chunks))
+        events = [
+            ("message_start", {
+                "type": "message_start",
+                "message": {**message, "content": [], "stop_reason": None,
+                            "usage": {**message["usage"], "output_tokens": 1}}}),
+            ("content_block_start", {"type": "content_block_start", "index": 0,
+                                     "content_block": block_start})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {**delta, delta_key: chunk}}) for chunk in chunks]
+        events += [
+            ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+            ("message_delta", {"type": "message_delta",
+                               "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                               "usage": {"output_tokens": message["usage"]["output_tokens"]}}),
+            ("message_stop", {"type": "message_stop"})]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        time.sleep(server.settings.latency)
+        try:
+            for event, data in events:
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if event == "content_block_delta":
+                    time.sleep(seconds_per_chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream, e.g. because the reply stopped being json
+            with server.lock:
+                server.n_cancelled += 1
+
+    def _batch_status(self, batch: dict):
+        """Return the current state of a batch, which ends `BATCH_SECONDS` after it was submitted."""
+        ended = time.time() - batch["created"] >= BATCH_SECONDS
+        n_requests = len(batch["requests"])
+        return {
+            "id": batch["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else n_requests,
+                "succeeded": n_requests if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0},
+            "created_at": "2024-01-01T00:00:00Z",
+            "expires_at": "2024-01-02T00:00:00Z",
+            "ended_at": "2024-01-01T00:00:00Z" if ended else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": (
+                f"http://{self.headers['Host']}/v1/messages/batches/{batch['id']}/results" if ended else None)}
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Create a message or a batch."""
+        params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        settings = server.settings
+
+        if self.path.startswith("/v1/messages/batches"):
+            batch = {"id": "msgbatch_" + uuid.uuid4().hex[:24], "created": time.time(), "requests": params["requests"]}
+            with server.lock:
+                server.batches[batch["id"]] = batch
+            self._send_json(200, self._batch_status(batch))
+
+        elif self.path.startswith("/v1/messages"):
+            with server.lock:
+                is_error = server.random.random() < settings.error_rate
+                status = server.random.choice((429, 529))
+                is_invalid = params.get("stream", False) and server.random.random() < settings.invalid_rate
+            if is_error:
+                self._send_error(status)
+                return
+            message, text = _mock_message(
+                params, server.cache_prefixes, server.lock, settings.output_tokens, is_invalid)
+            if params.get("stream", False):
+                self._send_stream(message, text)
+                return
+            time.sleep(settings.latency + message["usage"]["output_tokens"] * settings.seconds_per_token)
+            self._send_json(200, message)
+
+        else:
+            self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Retrieve a batch or its results."""
+        match = re.match(r"^/v1/messages/batches/([\w-]+)(/results)?$", self.path.split("?")[0])
+        batch = self.server.batches.get(match.group(1)) if match else None
+        if batch is None:
+            self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+        elif match.group(2):
+            server = self.server
+            lines = [
+                json.dumps({
+                    "custom_id": request["custom_id"],
+                    "result": {
+                        "type": "succeeded",
+                        "message": _mock_message(
+                            request["params"], server.cache_prefixes, server.lock, server.settings.output_tokens)[0]}})
+                for request in batch["requests"]]
+            self._send_json(200, ("\n".join(lines) + "\n").encode("utf-8"), content_type="application/x-jsonl")
+        else:
+            self._send_json(200, self._batch_status(batch))
+
+
+def make_server(port=0, settings=None):
+    """Create the stand-in server; port 0 picks a free port.
+
+    Args:
+        port (int): The port to listen on, on 127.0.0.1.
+        settings (MockSettings): How the server behaves; None for MockSettings(), i.e. instant replies and no errors.
+
+    Returns:
+        ThreadingHTTPServer: The server; its base url is `f"http://127.0.0.1:{server.server_address[1]}"`.
+
+    Typical usage:
+        server = make_server(settings=MockSettings(latency=0.5))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockAnthropicHandler)
+    server.daemon_threads = True
+    server.settings = settings or MockSettings()
+    server.n_cancelled = 0
+    server.random = random.Random(server.settings.seed)
+    server.lock = threading.Lock()
+    server.batches = {}
+    server.cache_prefixes = set()
+    return server
+
+
+def main():
+    """Run the stand-in server from the command line until interrupted."""
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Anthropic Messages API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each message")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="further seconds per output token")
+    parser.add_argument("--output-tokens", type=int, default=None, help="output tokens to report for each message")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of messages rejected with 429 or 529")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="seconds in the 'retry-after' header")
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="share of streamed replies made invalid json")
+    args = parser.parse_args()
+
+    mock_server = make_server(args.port, MockSettings(
+        latency=args.latency, seconds_per_token=args.seconds_per_token, output_tokens=args.output_tokens,
+        error_rate=args.error_rate, retry_after=args.retry_after, invalid_rate=args.invalid_rate))
+    print(f"Mock Anthropic API listening on http://127.0.0.1:{args.port}")
+    mock_server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
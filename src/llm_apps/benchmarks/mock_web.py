@@ -0,0 +1,93 @@
+"""This module runs a local web server of synthetic article pages, for testing app_2_1 without hitting real websites.
+
+Each page, '/page/{n}.html', is generated from its number so it is the same on every request, and is sent with an
+'ETag' header so that conditional GETs are answered '304 Not Modified'. Every response can be delayed to resemble a
+remote site.
+
+Typical usage:
+    python -m llm_apps.benchmarks.mock_web --port 8766 --latency 0.2
+"""
+
+import argparse
+import hashlib
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .bench_html_extract import generate_page
+
+
+class MockWebHandler(BaseHTTPRequestHandler):
+    """Serve the synthetic pages; settings are held on the server object."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the console quiet; the apps print their own progress."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Send a page, '304 Not Modified' if the client's copy is current, or 404."""
+        time.sleep(self.server.latency)
+        match = re.match(r"^/page/(\d+)\.html$", self.path)
+        if match is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = generate_page(self.server.n_paragraphs, seed=int(match.group(1))).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(port=0, latency=0.0, n_paragraphs=100):
+    """Create the web server; port 0 picks a free port.
+
+    Args:
+        port (int): The port to listen on, on 127.0.0.1.
+        latency (float): Seconds to wait before answering each request.
+        n_paragraphs (int): The number of paragraphs per page.
+
+    Returns:
+        ThreadingHTTPServer: The server; page n is at `f"http://127.0.0.1:{server.server_address[1]}/page/{n}.html"`.
+
+    Typical usage:
+        server = make_server(latency=0.2)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockWebHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.n_paragraphs = n_paragraphs
+    return server
+
+
+def main():
+    """Run the web server from the command line until interrupted."""
+
+    parser = argparse.ArgumentParser(description="Run a local web server of synthetic article pages.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each request")
+    parser.add_argument("--paragraphs", type=int, default=100, help="paragraphs per page")
+    args = parser.parse_args()
+
+    web_server = make_server(args.port, args.latency, args.paragraphs)
+    print(f"Mock web server listening on http://127.0.0.1:{args.port}/page/1.html")
+    web_server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""This module provides the `llm-apps` command, which runs any of the apps by name.
+
+Only the standard library is imported here. Each app, and with it the packages it needs (e.g. anthropic, pandas,
+python-docx), is imported once its subcommand has been chosen and its paths set, so that `llm-apps --help` and the
+start of every run are quick; `python -m llm_apps.benchmarks.bench_import_time` checks that this stays true.
+
+Typical usage:
+    llm-apps shortlist
+    llm-apps shortlist --watch
+    llm-apps web-to-summary --root ~/llm_labs
+    llm-apps search shortlist mlops --where "salary_max>60000"
+    llm-apps sweep toolbox --contexts Normal "Film noir" --temperatures 0 1
+    python -m llm_apps 2.2
+"""
+
+import argparse
+import importlib
+import os
+
+from . import __version__
+
+# The apps, keyed on subcommand: the app number, which also works as a subcommand, its module and what it does
+APPS = {
+    "shortlist": ("1.1", "llm_apps.app_01.app_1_1__shortlist", "Summarise job descriptions"),
+    "compare": ("1.2", "llm_apps.app_01.app_1_2__compare", "Compare a CV against job descriptions"),
+    "fetch-pages": ("2.1", "llm_apps.app_02.app_2_1__text_from_web_page", "Save web pages to Word documents"),
+    "toolbox-summary": ("2.2", "llm_apps.app_02.app_2_2__toolbox_summary", "Summarise articles in Word documents"),
+    "web-to-summary": ("2.3", "llm_apps.app_02.app_2_3__web_to_summary", "Download and summarise web pages")}
+
+# The apps that can keep running and process documents as they arrive in their input folder
+WATCH_APPS = ("shortlist", "toolbox-summary")
+
+
+def build_parser():
+    """Build the parser for the `llm-apps` command, with one subcommand per app.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+
+    # Options shared by every subcommand
+    parent = argparse.ArgumentParser(add_help=False)
+    parent.add_argument(
+        "--root", help="the folder containing 'data', 'logs', 'cache' and '.env' (default: $LLM_APPS_ROOT, or the "
+        "clone location)")
+
+    parser = argparse.ArgumentParser(prog="llm-apps", description="Run one of the LLM apps.")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    subparsers = parser.add_subparsers(dest="app", required=True, metavar="APP")
+    for name, (number, module, description) in APPS.items():
+        subparser = subparsers.add_parser(
+            name, aliases=[number], parents=[parent], help=f"{number}: {description}", description=description)
+        subparser.set_defaults(module=module, watch=False)
+        if name in WATCH_APPS:
+            subparser.add_argument(
+                "--watch", action="store_true", help="keep running, processing documents as they arrive in the input "
+                "folder and then moving them to the reviewed folder")
+
+    # Searching the results that the apps have stored
+    subparser = subparsers.add_parser(
+        "search", parents=[parent], help="Search the apps' results by keyword and by field",
+        description="Search the results of 'shortlist', 'compare' or 'toolbox' (the toolbox summaries) by keyword and "
+        "by field, best matches first.")
+    subparser.set_defaults(module="llm_apps.search", watch=False)
+    subparser.add_argument("source", choices=("shortlist", "compare", "toolbox"), help="the results to search")
+    subparser.add_argument(
+        "query", nargs="?", help="words to search for, e.g. 'mlops', '\"computer vision\" OR nlp' or "
+        "'primary_tool: pandas'")
+    subparser.add_argument(
+        "--where", action="append", default=[], metavar="FILTER", help="a condition on a field, e.g. "
+        "'salary_max>60000' or 'remote_hybrid_onsite=Remote'; may be repeated")
+    subparser.add_argument(
+        "--order-by", metavar="COLUMN", help="sort by a field, descending if it starts with '-', e.g. "
+        "--order-by=-salary_max")
+    subparser.add_argument("--limit", type=int, default=20, help="the maximum number of results (default: 20)")
+    subparser.add_argument("--show", metavar="COLUMNS", help="comma-separated fields to show for each result")
+    subparser.add_argument("--rebuild", action="store_true", help="rebuild the index from the stored results")
+
+    # Comparing the answers of the personas in `llm_contexts()` at several temperatures
+    subparser = subparsers.add_parser(
+        "sweep", parents=[parent], help="Compare personas and temperatures on an app's documents",
+        description="Ask the questions of 'shortlist' (App 1.1) or 'toolbox' (App 2.2) about the first documents in "
+        "its input folder once for each persona and temperature, concurrently, and save the answers side by side.")
+    subparser.set_defaults(module="llm_apps.sweep", watch=False)
+    subparser.add_argument("source", choices=("shortlist", "toolbox"), help="the app whose documents and questions "
+                           "to use")
+    subparser.add_argument(
+        "--contexts", nargs="+", metavar="PERSONA", help="the personas to compare, e.g. Normal 'Film noir' "
+        "(default: all)")
+    subparser.add_argument(
+        "--temperatures", nargs="+", type=float, metavar="T", help="the temperatures to compare (default: 0 0.5 1)")
+    subparser.add_argument("--docs", type=int, default=5, help="the maximum number of documents (default: 5)")
+    return parser
+
+
+def main(argv=None):
+    """Run the app chosen on the command line.
+
+    Args:
+        argv (list): The command line arguments, excluding the program name; None for `sys.argv[1:]`.
+
+    Returns:
+        int: The exit status; 0 for success.
+
+    Typical usage:
+        cli.main(["shortlist", "--root", "/path/to/llm_labs"])
+    """
+
+    args = build_parser().parse_args(argv)
+
+    # The paths are read when the app is imported, so the root must be set first
+    if args.root:
+        os.environ["LLM_APPS_ROOT"] = os.path.abspath(os.path.expanduser(args.root))
+
+    app = importlib.import_module(args.module)
+    if args.app in ("search", "sweep"):
+        return app.run(args)
+    if args.watch:
+        app.watch()
+    else:
+        app.main()
+    return 0
@@ -0,0 +1,2 @@
+"""Functions and classes shared by the apps: LLM calls, document loading, result storage and metrics.
+"""
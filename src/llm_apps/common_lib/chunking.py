@@ -0,0 +1,178 @@
+"""This module provides common functions for summarising documents too long for a single prompt.
+
+Long documents are handled map-reduce style:
+- Map: the document is split into overlapping sections of a fixed token budget, and each section is condensed into
+  notes by its own LLM call, with all the sections of all the documents sent concurrently.
+- Reduce: the notes for each document, in order, replace its text in the app's usual prompt, so the final call
+  returns the same fields as for a short document.
+
+Token counts are estimated locally from the number of characters, erring on the high side, so no extra API calls
+are needed to decide how to split a document.
+"""
+
+import re
+from typing import NamedTuple
+
+from . import llms as cll
+
+# Split sections at paragraph breaks, then at sentence ends, then at spaces
+_RE_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _split_piece(piece: str, max_tokens: int):
+    """Split a paragraph longer than `max_tokens` at sentence ends, then at spaces for sentences still too long."""
+    max_chars = int(max_tokens * cll.CHARS_PER_TOKEN)
+    pieces = []
+    for sentence in _RE_SENTENCE_END.split(piece):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        pieces.append(sentence)
+    return pieces
+
+
+def split_into_chunks(text: str, max_tokens: int, overlap_tokens=0):
+    """Split a text into sections of at most `max_tokens` each, at paragraph or sentence boundaries where possible.
+
+    Each section after the first starts with the last `overlap_tokens` of the section before it, so that a point
+    made across a boundary is seen whole by at least one section.
+
+    Args:
+        text (str): The text to split.
+        max_tokens (int): The maximum estimated tokens per section, including the overlap.
+        overlap_tokens (int): The estimated tokens repeated from the end of each section at the start of the next.
+
+    Returns:
+        list: The sections, in order; a text that fits in `max_tokens` is returned as one section.
+
+    Raises:
+        ValueError: The overlap needs to be less than half of max_tokens.
+
+    Typical usage:
+        list_chunks = clc.split_into_chunks(tb_text, max_tokens=6000, overlap_tokens=300)
+    """
+
+    if not 0 <= overlap_tokens < max_tokens / 2:
+        raise ValueError("overlap_tokens needs to be at least 0 and less than half of max_tokens.")
+    if cll.estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    # Pack whole paragraphs (or sentences of paragraphs that are too long) into sections, leaving room for the overlap
+    budget = max_tokens - overlap_tokens
+    list_pieces = []
+    for paragraph in text.split("\n"):
+        list_pieces.extend(_split_piece(paragraph, budget) if cll.estimate_tokens(paragraph) > budget else [paragraph])
+
+    list_sections = []
+    section = []
+    n_tokens = 0
+    for piece in list_pieces:
+        piece_tokens = cll.estimate_tokens(piece + "\n")
+        if section and n_tokens + piece_tokens > budget:
+            list_sections.append("\n".join(section))
+            section = []
+            n_tokens = 0
+        section.append(piece)
+        n_tokens += piece_tokens
+    if section:
+        list_sections.append("\n".join(section))
+
+    # Start each section with the end of the previous one, cut at a word boundary
+    overlap_chars = int(overlap_tokens * cll.CHARS_PER_TOKEN)
+    list_chunks = list_sections[:1]
+    for previous, section in zip(list_sections, list_sections[1:]):
+        overlap = previous[-overlap_chars:] if overlap_chars > 0 else ""
+        if " " in overlap and len(overlap) < len(previous):
+            overlap = overlap.split(" ", 1)[1]
+        list_chunks.append(overlap + "\n" + section if overlap else section)
+    return list_chunks
+
+
+class ChunkPlan(NamedTuple):
+    """How texts too long for one prompt are split into sections and condensed.
+
+    Attributes:
+        map_prompt (str): The prompt for each section, with placeholders '{section}', '{n_sections}' and '{text}'.
+        single_pass_max_tokens (int): The estimated tokens above which a text is split into sections.
+        chunk_max_tokens (int): The maximum estimated tokens per section, including the overlap.
+        overlap_tokens (int): The estimated tokens repeated from the end of each section at the start of the next.
+    """
+
+    map_prompt: str
+    single_pass_max_tokens: int
+    chunk_max_tokens: int
+    overlap_tokens: int = 0
+
+
+def _section_prompts(texts: list, plan: ChunkPlan):
+    """Split the texts longer than `plan.single_pass_max_tokens` into sections and build a prompt for each section.
+
+    Returns:
+        list: The prompt for each section, in order.
+        list: The index in `texts` of the text each section belongs to.
+    """
+
+    list_prompts = []
+    list_owners = []
+    for i, text in enumerate(texts):
+        if cll.estimate_tokens(text) <= plan.single_pass_max_tokens:
+            continue
+        list_chunks = split_into_chunks(text, plan.chunk_max_tokens, plan.overlap_tokens)
+        for j, chunk in enumerate(list_chunks):
+            list_prompts.append(plan.map_prompt.format(section=j + 1, n_sections=len(list_chunks), text=chunk))
+            list_owners.append(i)
+    return list_prompts, list_owners
+
+
+def condense_long_texts(texts: list, plan: ChunkPlan, system_context: str, options=None,
+                        max_concurrency=cll.MAX_CONCURRENCY):
+    """Replace each text that is too long for one prompt with notes condensed from its sections by the LLM.
+
+    Texts within `plan.single_pass_max_tokens` are returned unchanged. The sections of every longer text are sent to
+    the LLM together, `max_concurrency` at a time, and each text's notes are joined in section order.
+
+    Args:
+        texts (list): The document texts.
+        plan (ChunkPlan): The prompt for each section, and the token budgets for splitting the texts.
+        system_context (str): The context that you have set under which the LLM should respond.
+        options (cll.CallOptions): The options of the call for each section, e.g. the max_tokens of its notes; None
+            for temperature 0 and otherwise the defaults.
+        max_concurrency (int): The maximum number of requests in flight at any one time.
+
+    Returns:
+        list: For each text, a tuple of (text or notes, number of sections); 1 section means the text is unchanged.
+
+    Raises:
+        Exception: The first error from any of the LLM calls.
+
+    Typical usage:
+        list_condensed = clc.condense_long_texts(
+            list_texts, clc.ChunkPlan(MAP_PROMPT, SINGLE_PASS_MAX_TOKENS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS),
+            cll.llm_contexts()["Normal"])
+    """
+
+    list_condensed = [(text, 1) for text in texts]
+
+    # Split the long texts, keeping track of which text each section belongs to
+    list_prompts, list_owners = _section_prompts(texts, plan)
+    if len(list_prompts) == 0:
+        return list_condensed
+    print(f"Condensing {len(set(list_owners))} long documents from {len(list_prompts)} sections")
+
+    list_notes = cll.llm_response_many(
+        prompts=list_prompts,
+        system_context=system_context,
+        options=cll.CallOptions(temperature=0) if options is None else options,
+        max_concurrency=max_concurrency)
+
+    # Join each text's notes in section order
+    dict_notes = {}
+    for i, notes in zip(list_owners, list_notes):
+        dict_notes.setdefault(i, []).append(notes)
+    for i, list_section_notes in dict_notes.items():
+        list_condensed[i] = (
+            "\n\n".join(f"Section {j + 1}:\n{notes}" for j, notes in enumerate(list_section_notes)),
+            len(list_section_notes))
+    return list_condensed
@@ -0,0 +1,154 @@
+"""This module provides common functions for finding near-duplicate documents locally, without an LLM.
+
+Each document is reduced to its set of shingles, i.e. every run of a few consecutive words, and two documents are
+near-duplicates if they share most of their shingles (their Jaccard similarity). Comparing every pair of sets
+directly grows with the square of the number of documents, so instead:
+- Each document gets a MinHash signature: for each of `NUM_PERM` random hash functions, the smallest hash of any of
+  its shingles. The share of positions where two signatures agree estimates the Jaccard similarity of the documents.
+- Signatures are split into `BANDS` bands, and documents whose signatures match on every row of any one band are
+  indexed together (locality-sensitive hashing), so only documents likely to be similar are ever compared.
+- Candidate pairs above the threshold are joined into clusters, and the first document in each is its
+  representative.
+
+A document shorter than one shingle, e.g. an empty or truncated file, has no shingles to compare, so it is never
+joined to a cluster: it is always its own representative.
+
+This is used to send one representative of each group of reposted adverts to the LLM, instead of paying for a full
+call per copy.
+"""
+
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from . import relevance as clr
+
+# Words per shingle: long enough that documents only share shingles if they share passages, not just vocabulary
+SHINGLE_WORDS = 5
+
+# Hash functions per signature, in bands of rows; with 16 bands of 8, pairs above about 0.7 similarity are compared
+NUM_PERM = 128
+BANDS = 16
+
+# Estimated share of shingles two documents must share to be treated as near-duplicates
+THRESHOLD = 0.8
+
+# A Mersenne prime larger than any shingle hash, for the hash functions (a * x + b) % prime
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text: str, shingle_words=SHINGLE_WORDS):
+    """Hash each run of consecutive words in a text.
+
+    Args:
+        text (str): The text.
+        shingle_words (int): The number of words per shingle.
+
+    Returns:
+        numpy.ndarray: The distinct shingle hashes; empty for a text of fewer than `shingle_words` words.
+
+    Typical usage:
+        hashes = cdd.shingles(job_text)
+    """
+
+    words = clr.tokenise(text)
+    n = max(len(words) - shingle_words + 1, 0)
+    return np.unique(np.array(
+        [zlib.crc32(" ".join(words[i:i + shingle_words]).encode("utf-8")) % _PRIME for i in range(n)],
+        dtype=np.int64))
+
+
+def minhash_signatures(texts: list, num_perm=NUM_PERM, shingle_words=SHINGLE_WORDS, seed=0):
+    """Compute a MinHash signature for each text.
+
+    Args:
+        texts (list): The texts.
+        num_perm (int): The number of hash functions, i.e. the length of each signature.
+        shingle_words (int): The number of words per shingle.
+        seed (int): Seeds the hash functions; signatures are only comparable if computed with the same seed.
+
+    Returns:
+        numpy.ndarray: One row per text and one column per hash function; the row of a text with no shingles is all
+            `_PRIME`, which no hash reaches.
+
+    Typical usage:
+        signatures = cdd.minhash_signatures(list_texts)
+    """
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.int64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.int64)
+
+    # Both factors are below 2**31, so (a * x + b) fits in 64 bits
+    signatures = np.empty((len(texts), num_perm), dtype=np.int64)
+    for row, text in enumerate(texts):
+        hashes = shingles(text, shingle_words)
+        signatures[row] = ((hashes[:, None] * a + b) % _PRIME).min(axis=0, initial=_PRIME)
+    return signatures
+
+
+def _candidate_pairs(signatures, bands: int, list_indices: list):
+    """Yield each pair of the rows `list_indices`, (i, j) with i before j, whose signatures match on every row of at
+    least one band; a pair that matches on several bands is yielded once."""
+    rows = signatures.shape[1] // bands
+    compared = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i in list_indices:
+            buckets[signatures[i, band * rows:(band + 1) * rows].tobytes()].append(i)
+        for list_i in buckets.values():
+            for pos, i in enumerate(list_i):
+                for j in list_i[pos + 1:]:
+                    if (i, j) not in compared:
+                        compared.add((i, j))
+                        yield i, j
+
+
+def near_duplicate_clusters(texts: list, threshold=THRESHOLD, num_perm=NUM_PERM, bands=BANDS,
+                            shingle_words=SHINGLE_WORDS):
+    """Group texts that are near-duplicates of each other.
+
+    Similarity is transitive here: if A is a near-duplicate of B and B of C, all three are in one cluster.
+
+    Args:
+        texts (list): The texts.
+        threshold (float): The estimated Jaccard similarity of shingles, 0 to 1, above which two texts are joined.
+        num_perm (int): The number of hash functions per signature; must be a multiple of `bands`.
+        bands (int): The number of bands the signatures are split into for the LSH index.
+        shingle_words (int): The number of words per shingle.
+
+    Returns:
+        list: For each text, the index of its cluster's representative: the first text in the cluster. A text shorter
+            than one shingle is always its own representative.
+
+    Raises:
+        ValueError: `num_perm` is not a multiple of `bands`.
+
+    Typical usage:
+        list_reps = cdd.near_duplicate_clusters(list_job_texts)
+    """
+
+    if num_perm % bands != 0:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands}).")
+    signatures = minhash_signatures(texts, num_perm, shingle_words)
+
+    # Texts shorter than one shingle have nothing to compare, so each is left in a cluster of its own
+    list_indices = [i for i, signature in enumerate(signatures) if signature[0] < _PRIME]
+
+    # Union-find over the texts, each joined to the earliest text in its cluster
+    parent = list(range(len(texts)))
+
+    def find(i: int):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Compare only the texts indexed under a shared bucket in at least one band
+    for i, j in _candidate_pairs(signatures, bands, list_indices):
+        if np.mean(signatures[i] == signatures[j]) >= threshold:
+            root_i, root_j = find(i), find(j)
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    return [find(i) for i in range(len(texts))]
@@ -0,0 +1,187 @@
+"""This module provides common functions for extracting the main text from a web page.
+
+The page is parsed once, streaming through the html and collecting the title, headings and paragraphs in page order.
+Two parser backends give the same output:
+- 'lxml': the fast C parser, installed as a dependency of python-docx.
+- 'html.parser': Python's built-in parser, used if lxml is not available.
+"""
+
+import re
+from html.parser import HTMLParser
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Tags to extract, and the Word heading level for each heading tag; 'p' is added as a plain paragraph
+TAGS = ("title", "h1", "h2", "h3", "p")
+HEADING_LEVELS = {"title": 1, "h1": 1, "h2": 2, "h3": 3}
+
+# Tags whose content is code rather than text
+SKIP_TAGS = ("script", "style")
+
+# Block-level tags that close an open paragraph when they start, and those that close one it is inside when they
+# end, so that text after an unclosed <p> is not counted as part of it; as lxml's parser does
+P_CLOSING_START_TAGS = (
+    "address", "blockquote", "center", "dd", "div", "dl", "dt", "fieldset", "form", "h1", "h2", "h3", "h4", "h5",
+    "h6", "hr", "li", "menu", "ol", "p", "pre", "table", "td", "tr", "ul")
+P_CLOSING_END_TAGS = P_CLOSING_START_TAGS + (
+    "article", "aside", "details", "figcaption", "figure", "footer", "header", "hgroup", "main", "nav", "section",
+    "summary")
+
+# Characters that are not allowed in Word's XML, which would otherwise make python-docx raise an error
+_RE_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+
+
+class _BlockParser(HTMLParser):
+    """Collect the text of each tag in `TAGS`, in the order the tags start.
+
+    Text inside nested tags counts towards every open tag, matching BeautifulSoup's `get_text()`; the content of
+    script and style tags is skipped.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self.stack = []
+        self.in_skip_tag = False
+
+    def _close(self, tag):
+        """Close the most recent open tag with this name, and any left unclosed inside it."""
+        for depth in range(len(self.stack) - 1, -1, -1):
+            if self.blocks[self.stack[depth]][0] == tag:
+                del self.stack[depth:]
+                break
+
+    def handle_starttag(self, tag, attrs):
+        if tag in P_CLOSING_START_TAGS:
+            self._close("p")
+        if tag in SKIP_TAGS:
+            self.in_skip_tag = True
+        elif tag in TAGS:
+            self.blocks.append((tag, []))
+            self.stack.append(len(self.blocks) - 1)
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.in_skip_tag = False
+        if tag in P_CLOSING_END_TAGS:
+            self._close("p")
+        self._close(tag)
+
+    def handle_data(self, data):
+        if self.in_skip_tag:
+            return
+        for i in self.stack:
+            self.blocks[i][1].append(data)
+
+
+def _extract_html_parser(html: str):
+    """Extract blocks with Python's built-in html.parser."""
+    parser = _BlockParser()
+    parser.feed(html)
+    parser.close()
+    return [(tag, "".join(parts)) for tag, parts in parser.blocks]
+
+
+# The text of an element, without that of scripts and styles; compiled once, only if lxml is available
+_XPATH_TEXT = etree.XPath(".//text()[not(ancestor::script) and not(ancestor::style)]") if etree is not None else None
+
+
+def _extract_lxml(html: str):
+    """Extract blocks with lxml's pull parser, filling in each block's text when its tag closes."""
+    parser = etree.HTMLPullParser(events=("start", "end"), tag=TAGS)
+    parser.feed(html)
+    parser.close()
+
+    blocks = []
+    dict_open = {}
+    for event, element in parser.read_events():
+        if event == "start":
+            dict_open[element] = len(blocks)
+            blocks.append((element.tag, ""))
+        else:
+            blocks[dict_open.pop(element)] = (element.tag, "".join(_XPATH_TEXT(element)))
+    return blocks
+
+
+def available_backends():
+    """List the parser backends that can be used here, fastest first.
+
+    Returns:
+        list: The backend names, e.g. ['lxml', 'html.parser'].
+
+    Typical usage:
+        print(che.available_backends())
+    """
+
+    return (["lxml"] if etree is not None else []) + ["html.parser"]
+
+
+def extract_blocks(html, backend="auto", encoding=None):
+    """Extract the title, headings and paragraphs from a web page, in page order.
+
+    Args:
+        html (str): The page content, or its raw bytes, e.g. so that a worker process decodes them as well.
+        backend (str): 'lxml', 'html.parser', or 'auto' for the fastest available.
+        encoding (str): The character encoding of raw bytes, e.g. `result["encoding"]`; utf-8 if None.
+
+    Returns:
+        list: One (tag, text) tuple per block, where tag is one of `TAGS`; text has characters that are invalid in
+            a Word document removed.
+
+    Raises:
+        ValueError: An unknown or unavailable backend.
+
+    Typical usage:
+        blocks = che.extract_blocks(result["text"])
+        >> [("title", "Large language model - Wikipedia"), ("h1", "Large language model"), ("p", "A large ..."), ...]
+    """
+
+    if backend == "auto":
+        backend = available_backends()[0]
+    if backend not in available_backends():
+        raise ValueError(f"Unknown or unavailable html parser backend: '{backend}'")
+
+    if isinstance(html, bytes):
+        html = html.decode(encoding or "utf-8", errors="replace")
+    if not html:
+        return []
+
+    blocks = _extract_lxml(html) if backend == "lxml" else _extract_html_parser(html)
+    return [(tag, _RE_XML_INVALID.sub("", text)) for tag, text in blocks]
+
+
+def add_blocks_to_docx(doc, blocks: list):
+    """Add extracted blocks to a Word document: headings at their level and paragraphs as plain text.
+
+    Args:
+        doc (docx.document.Document): The Word document to add to.
+        blocks (list): The (tag, text) tuples from `extract_blocks()`.
+
+    Typical usage:
+        che.add_blocks_to_docx(doc, che.extract_blocks(result["text"]))
+    """
+
+    for tag, text in blocks:
+        if tag in HEADING_LEVELS:
+            doc.add_heading(text, level=HEADING_LEVELS[tag])
+        else:
+            doc.add_paragraph(text)
+
+
+def blocks_to_text(blocks: list):
+    """Join extracted blocks into plain text, one block per line, as `clm.load_docx_to_str()` reads a saved page.
+
+    Args:
+        blocks (list): The (tag, text) tuples from `extract_blocks()`.
+
+    Returns:
+        str: The text of every block, each followed by a newline.
+
+    Typical usage:
+        tb_text = che.blocks_to_text(che.extract_blocks(result["text"]))
+    """
+
+    return "".join(text + "\n" for _, text in blocks)
@@ -0,0 +1,178 @@
+"""This module provides common functions for watching an input folder and processing documents as they arrive.
+
+The folder is polled every few seconds, which works the same on every operating system and network drive. Each poll
+costs one `stat()` of the folder: its modification time only changes when a file is added, removed or renamed, so
+the folder's files are only listed again when it has changed, or while a file is still being written. A file is
+ready once its size and modification time are the same at two polls in a row, so a document that is still being
+saved or copied is not read half-written.
+
+Ready files are passed to the app in batches, and each one the app has processed is then moved to the reviewed
+folder with an atomic rename, so it is never in both folders or half-moved, and is not picked up again.
+"""
+
+import errno
+import os
+import shutil
+import threading
+import time
+
+# Seconds between polls of the input folder
+POLL_SECONDS = 2.0
+
+# The input folder is listed again at least this often, even if its modification time has not changed, in case the
+# file system only records it to the nearest second or two
+FULL_SCAN_SECONDS = 60.0
+
+# Maximum number of documents passed to the app at once, and seconds before a batch that failed is tried again
+MAX_BATCH = 50
+RETRY_SECONDS = 300.0
+
+
+class InboxWatcher:
+    """Poll a folder for new or changed files, returning each once it has finished being written.
+
+    Args:
+        dir_inbox (str): The folder to watch.
+        suffix (str): Only files with this extension are returned, e.g. '.docx'; Word's '~$' lock files are ignored.
+
+    Typical usage:
+        watcher = cib.InboxWatcher(DIR_INPUT_DOCX)
+        list_filenames = watcher.poll()
+    """
+
+    def __init__(self, dir_inbox: str, suffix=".docx"):
+        self.dir_inbox = dir_inbox
+        self.suffix = suffix
+        self._dir_mtime = None
+        self._last_scan = 0.0
+        self._pending = {}
+        self._offered = {}
+        self._retry_at = {}
+
+    def _scan(self):
+        """List the folder's files with their size and modification time."""
+        files = {}
+        with os.scandir(self.dir_inbox) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(self.suffix) and not entry.name.startswith("~$") and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def poll(self):
+        """Return the files that are new, or changed since they were last returned, and have finished being written.
+
+        Returns:
+            list: The filenames, sorted.
+        """
+
+        now = time.monotonic()
+        dir_mtime = os.stat(self.dir_inbox).st_mtime_ns
+        if (dir_mtime == self._dir_mtime and not self._pending and now - self._last_scan < FULL_SCAN_SECONDS
+                and not any(retry_at <= now for retry_at in self._retry_at.values())):
+            return []
+        self._dir_mtime = dir_mtime
+        self._last_scan = now
+
+        files = self._scan()
+        list_ready = []
+        for name, signature in files.items():
+            if self._offered.get(name) == signature and self._retry_at.get(name, now + 1) > now:
+                continue
+            if self._pending.get(name) == signature:
+                list_ready.append(name)
+            else:
+                self._pending[name] = signature
+
+        # Forget files that have gone, e.g. moved to the reviewed folder
+        for known in (self._pending, self._offered, self._retry_at):
+            for name in set(known).difference(files):
+                del known[name]
+
+        for name in list_ready:
+            del self._pending[name]
+            self._offered[name] = files[name]
+            self._retry_at.pop(name, None)
+        return sorted(list_ready)
+
+    def retry_later(self, filenames: list, seconds=RETRY_SECONDS):
+        """Return files again after a delay, e.g. when processing them failed; sooner if they change.
+
+        Args:
+            filenames (list): The filenames.
+            seconds (float): The delay.
+        """
+
+        for name in filenames:
+            self._retry_at[name] = time.monotonic() + seconds
+
+
+def move_file(path: str, dir_dest: str):
+    """Move a file into a folder atomically, replacing any file of the same name there.
+
+    The file is renamed, so it is in exactly one of the two folders at any moment. If the folders are on different
+    file systems, it is copied to a temporary name in the destination first and then renamed into place.
+
+    Args:
+        path (str): The file to move.
+        dir_dest (str): The destination folder.
+
+    Returns:
+        str: The new path of the file.
+
+    Typical usage:
+        cib.move_file(DIR_INPUT_DOCX + filename, DIR_REVIEWED_DOCX)
+    """
+
+    path_dest = os.path.join(dir_dest, os.path.basename(path))
+    try:
+        os.replace(path, path_dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(path, path_dest + ".tmp")
+        os.replace(path_dest + ".tmp", path_dest)
+        os.remove(path)
+    return path_dest
+
+
+def watch(dir_inbox: str, dir_done: str, process_batch, suffix=".docx", stop=None):
+    """Process files as they arrive in a folder, moving each one to another folder once it has been processed.
+
+    Files already in the folder are processed first. The folder is polled every `POLL_SECONDS`, and runs until
+    interrupted with Ctrl+C, or until `stop` is set.
+
+    Args:
+        dir_inbox (str): The folder to watch.
+        dir_done (str): The folder that processed files are moved to.
+        process_batch (callable): Called as `process_batch(list_filenames)` with the names of up to `MAX_BATCH`
+            ready files; returns the names of the files to move, i.e. those processed or skipped as already done. If
+            it raises an error, the batch is tried again after `RETRY_SECONDS`.
+        suffix (str): Only files with this extension are processed.
+        stop (threading.Event): Optional event that stops watching when set, e.g. from another thread.
+
+    Typical usage:
+        cib.watch(DIR_INPUT_DOCX, DIR_REVIEWED_DOCX, process_batch)
+    """
+
+    stop = stop or threading.Event()
+    watcher = InboxWatcher(dir_inbox, suffix)
+    print(f"Watching '{dir_inbox}' for new {suffix} files every {POLL_SECONDS:g}s; press Ctrl+C to stop")
+    try:
+        while not stop.is_set():
+            list_ready = watcher.poll()
+            for i in range(0, len(list_ready), MAX_BATCH):
+                list_batch = list_ready[i:i + MAX_BATCH]
+                try:
+                    list_done = process_batch(list_batch)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    print(f"Batch of {len(list_batch)} files failed, trying again in {RETRY_SECONDS:g}s: "
+                          f"{e.__class__.__name__}: {e}")
+                    watcher.retry_later(list_batch, RETRY_SECONDS)
+                    continue
+                for filename in list_done:
+                    move_file(os.path.join(dir_inbox, filename), dir_done)
+                print(f"Moved {len(list_done)} files to '{dir_done}'")
+            stop.wait(POLL_SECONDS)
+    except KeyboardInterrupt:
+        print("Stopped watching")
@@ -0,0 +1,192 @@
+"""This module provides an incremental parser for a json object that arrives a few characters at a time.
+
+It is fed the text of a streamed LLM response as it arrives and reports each top-level field of the object as soon
+as its value is complete, so that a reply that is not the json object we asked for is detected at the first
+character that breaks the structure, rather than after the whole reply has been generated.
+
+Any remarks before the opening '{' are skipped, as are any after the closing '}'; a reply with no '{' in its first
+`MAX_PREAMBLE_CHARS` characters is taken to be prose rather than json.
+"""
+
+import json
+
+_WHITESPACE = " \t\r\n"
+
+# Characters of remarks allowed before the opening '{', e.g. 'Here are the answers in json format:'
+MAX_PREAMBLE_CHARS = 300
+
+
+class JSONStreamError(ValueError):
+    """The text fed to the parser cannot be the json object that was expected."""
+
+
+class JSONObjectStreamParser:
+    """Parse a json object incrementally, reporting each top-level field as soon as its value is complete.
+
+    Args:
+        on_field (callable): Optional function called as `on_field(key, value)` for each field as it completes.
+        max_preamble (int): The most characters of remarks allowed before the opening '{'.
+
+    Attributes:
+        fields (dict): The fields completed so far.
+        done (bool): Whether the closing '}' has been read.
+
+    Typical usage:
+        parser = cjs.JSONObjectStreamParser(on_field=lambda key, value: print(key, value))
+        for text in stream.text_stream:
+            parser.feed(text)
+    """
+
+    def __init__(self, on_field=None, max_preamble=MAX_PREAMBLE_CHARS):
+        self.on_field = on_field
+        self.fields = {}
+        self._preamble_left = max_preamble
+
+        # The state is the method that reads the next character; the characters of the current key or value are
+        # collected in `_chars`, the raw key is kept in `_key` while its value is read, and `_depth` counts the
+        # objects and arrays open in the value
+        self._read = self._read_preamble
+        self._key = ""
+        self._chars = []
+        self._depth = 0
+
+    @property
+    def done(self):
+        """Whether the closing '}' has been read."""
+        return self._read == self._read_done
+
+    def feed(self, text: str):
+        """Parse the next piece of text.
+
+        Args:
+            text (str): The next characters of the response.
+
+        Returns:
+            dict: The fields completed so far.
+
+        Raises:
+            JSONStreamError: The text breaks the structure of a json object.
+        """
+
+        for char in text:
+            self._read(char)
+        return self.fields
+
+    def _error(self, char: str, expected: str):
+        raise JSONStreamError(f"Expected {expected} but found {char!r} after {len(self.fields)} complete fields")
+
+    def _end_value(self):
+        """Decode the value read so far and report its field."""
+        raw = "".join(self._chars)
+        try:
+            value = json.loads(raw, strict=False)
+        except ValueError as e:
+            raise JSONStreamError(f"Invalid value for key {self._key!r}: {raw[:80]!r}") from e
+        key = json.loads('"' + self._key + '"', strict=False)
+        self.fields[key] = value
+        self._chars = []
+        if self.on_field is not None:
+            self.on_field(key, value)
+
+    def _read_preamble(self, char: str):
+        """Skip any remarks before the opening '{', up to the limit."""
+        if char == "{":
+            self._read = self._read_key_or_end
+            return
+        self._preamble_left -= 1
+        if self._preamble_left < 0:
+            raise JSONStreamError("Expected '{' but found only remarks, e.g. an answer in prose")
+
+    def _read_key_or_end(self, char: str):
+        """Read the opening quote of the first key, or the '}' of an empty object."""
+        if char == "}":
+            self._read = self._read_done
+        else:
+            self._read_key(char)
+
+    def _read_key(self, char: str):
+        """Read the opening quote of a key."""
+        if char == '"':
+            self._read = self._read_in_key
+        elif char not in _WHITESPACE:
+            self._error(char, "a key in double quotes")
+
+    def _read_in_key(self, char: str):
+        """Read a key up to its closing quote."""
+        if char == '"':
+            self._key = "".join(self._chars)
+            self._chars = []
+            self._read = self._read_colon
+            return
+        self._chars.append(char)
+        if char == "\\":
+            self._read = self._read_key_escape
+
+    def _read_key_escape(self, char: str):
+        """Read the character after a backslash in a key."""
+        self._chars.append(char)
+        self._read = self._read_in_key
+
+    def _read_colon(self, char: str):
+        """Read the ':' after a key."""
+        if char == ":":
+            self._read = self._read_value
+        elif char not in _WHITESPACE:
+            self._error(char, "':'")
+
+    def _read_value(self, char: str):
+        """Read the first character of a value."""
+        if char in _WHITESPACE:
+            return
+        if char in ",}]":
+            self._error(char, "a value")
+        self._chars.append(char)
+        self._depth = 1 if char in "{[" else 0
+        self._read = self._read_in_string if char == '"' else self._read_in_value
+
+    def _read_in_value(self, char: str):
+        """Read a value outside any string: nested objects and arrays end at their closing character, and numbers and
+        literals at the ',' or '}' that follows them."""
+        if self._depth == 0 and (char in ",}" or char in _WHITESPACE):
+            self._end_value()
+            self._read = self._read_comma_or_end
+            self._read_comma_or_end(char)
+            return
+        self._chars.append(char)
+        if char == '"':
+            self._read = self._read_in_string
+        elif self._depth > 0 and char in "{[":
+            self._depth += 1
+        elif self._depth > 0 and char in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                self._end_value()
+                self._read = self._read_comma_or_end
+
+    def _read_in_string(self, char: str):
+        """Read a string in a value up to its closing quote, which ends the value unless the string is nested."""
+        self._chars.append(char)
+        if char == "\\":
+            self._read = self._read_string_escape
+        elif char == '"' and self._depth == 0:
+            self._end_value()
+            self._read = self._read_comma_or_end
+        elif char == '"':
+            self._read = self._read_in_value
+
+    def _read_string_escape(self, char: str):
+        """Read the character after a backslash in a string."""
+        self._chars.append(char)
+        self._read = self._read_in_string
+
+    def _read_comma_or_end(self, char: str):
+        """Read the ',' before the next key, or the closing '}'."""
+        if char == ",":
+            self._read = self._read_key
+        elif char == "}":
+            self._read = self._read_done
+        elif char not in _WHITESPACE:
+            self._error(char, "',' or '}'")
+
+    def _read_done(self, char: str):
+        """Ignore any remarks after the closing '}'."""
@@ -2,14 +2,73 @@
 """
 
 import json
-import anthropic
-import pandas as pd
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple, Optional
+
+from . import json_stream as cjs
+from . import metrics as cme
+from . import paths as cpa
+from . import rate_limit as crl
+from . import response_cache as crc
+
+# Default model and response length for every call
+LLM_MODEL = "claude-3-5-sonnet-20240620"
+LLM_MAX_TOKENS = 1000
+
+# A smaller model, several times faster and cheaper, for simple extraction questions; see `MODEL_TIERS`
+LLM_MODEL_SMALL = "claude-3-5-haiku-20241022"
+
+# The models by tier, so apps can route each question to the smallest model that answers it well
+MODEL_TIERS = {"small": LLM_MODEL_SMALL, "large": LLM_MODEL}
+
+# Default number of requests that llm_response_many() keeps in flight at once
+MAX_CONCURRENCY = 4
+
+# One client (and so one connection pool) is shared by every call in the process
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+# Seconds between status checks of a Message Batch; can be lowered, e.g. when testing against a local stand-in server
+BATCH_POLL_SECONDS = float(os.environ.get("LLM_BATCH_POLL_SECONDS", 60))
+
+# Token usage reported by the API, summed over every call in this process
+_USAGE_STATS = {
+    "calls": 0,
+    "input_tokens": 0,
+    "cache_creation_input_tokens": 0,
+    "cache_read_input_tokens": 0,
+    "output_tokens": 0,
+    "retries": 0}
+_USAGE_LOCK = threading.Lock()
+
+# Retries for rate-limited (429), overloaded (529) and failed (5xx) requests, and for dropped connections
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+MAX_RETRIES = 6
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+# Streamed json replies that break the structure, or are cut off at max_tokens, are abandoned and asked for again up to
+# MAX_INVALID_RETRIES times; a reply cut off at max_tokens is asked for again with twice the max_tokens, up to a cap
+MAX_INVALID_RETRIES = 2
+STREAM_MAX_TOKENS_CAP = 4096
+
+# Answer recorded in place of a response that could not be converted to a dict
+PARSE_ERROR = "Error: check logs"
+
+# Average characters per token for English prose; lower than the usual ~4 so that estimates err on the high side
+CHARS_PER_TOKEN = 3.5
 
 
 def llm_contexts():
     """Define different 'system contexts' for an LLM.
 
-    The purpose of this is to experiment how the LLM outputs in each app change under different contexts.
+    The purpose of this is to experiment how the LLM outputs in each app change under different contexts; `llm-apps
+    sweep` asks an app's questions in each of them, at several temperatures, and saves the answers side by side.
 
     Returns:
         dict: A dictionary of different contexts to be used for an LLM.
@@ -41,21 +100,390 @@ def llm_contexts():
     return context_dict
 
 
-def llm_response(prompt: str, system_context: str, temperature=0.6):
-    """Send a prompt and system context via API to Anthropic's LLM, 'Claude 3.5 Sonnet'.
+def get_client():
+    """Return the shared Anthropic client, creating it on first use.
+
+    The client holds an HTTP connection pool, so re-using it avoids a fresh TCP/TLS handshake for every call.
+    It is safe to share between threads.
+
+    Returns:
+        anthropic.Anthropic: The shared client.
+
+    Typical usage:
+        client = cll.get_client()
+    """
+
+    import anthropic  # pylint: disable=import-outside-toplevel
+
+    global _CLIENT  # pylint: disable=global-statement
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            # Retries are left to llm_response(), which backs off across all threads rather than per request
+            _CLIENT = anthropic.Anthropic(max_retries=0)
+    return _CLIENT
+
+
+def estimate_tokens(text: str):
+    """Estimate the number of tokens in a text, without calling the API.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+
+    Typical usage:
+        n_tokens = cll.estimate_tokens(tb_text)
+    """
+
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _retry_after_seconds(error):
+    """Read the 'retry-after-ms' or 'retry-after' header of an API error; None if absent or invalid."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            return float(response.headers[header]) / scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+def _backoff_seconds(attempt: int, error):
+    """Seconds to wait before the next attempt: the API's 'retry-after' if given, else exponential with jitter."""
+    retry_after = _retry_after_seconds(error)
+    if retry_after is None:
+        retry_after = BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+    return min(retry_after, MAX_BACKOFF_SECONDS)
+
+
+def _is_retryable(error):
+    """Whether an API error is worth retrying: rate limits, overloading, server errors and dropped connections."""
+    import anthropic  # pylint: disable=import-outside-toplevel
+
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return getattr(error, "status_code", None) in RETRY_STATUS_CODES
+
+
+def usage_stats():
+    """Return the token usage reported by the API, summed over every call in this process.
+
+    'input_tokens' counts only uncached input; 'cache_creation_input_tokens' and 'cache_read_input_tokens' count
+    input written to and read from the prompt cache.
+
+    Returns:
+        dict: A copy of the counters.
+
+    Typical usage:
+        print(cll.usage_stats())
+    """
+
+    with _USAGE_LOCK:
+        return dict(_USAGE_STATS)
+
+
+def usage_report():
+    """Summarise cached vs. uncached input tokens for this process, e.g. to print at the end of a run.
+
+    Returns:
+        str: A one-line summary of token usage.
+
+    Typical usage:
+        print(cll.usage_report())
+        >> LLM usage: 12 calls; input tokens: 1520 uncached, 2048 written to cache, 22528 read from cache
+            (86% cached); output tokens: 9120; retries: 0
+    """
+
+    usage = usage_stats()
+    total_input = usage["input_tokens"] + usage["cache_creation_input_tokens"] + usage["cache_read_input_tokens"]
+    pct_cached = 100 * usage["cache_read_input_tokens"] / total_input if total_input else 0
+    return (
+        f"LLM usage: {usage['calls']} calls; input tokens: {usage['input_tokens']} uncached, "
+        f"{usage['cache_creation_input_tokens']} written to cache, {usage['cache_read_input_tokens']} read from cache "
+        f"({pct_cached:.0f}% cached); output tokens: {usage['output_tokens']}; retries: {usage['retries']}")
+
+
+def _usage_fields(usage):
+    """Return the token counts from one API response as a dict."""
+    return {name: getattr(usage, name, 0) or 0
+            for name in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens")}
+
+
+def _record_usage(usage: dict):
+    """Add the token counts from one API response, as returned by `_usage_fields()`, to the process totals."""
+    with _USAGE_LOCK:
+        _USAGE_STATS["calls"] += 1
+        for name, n_tokens in usage.items():
+            _USAGE_STATS[name] += n_tokens
+
+
+class CallOptions(NamedTuple):
+    """The options of an LLM call, other than the prompt and system context; every one has a default.
+
+    The options are immutable, so one can be shared by many prompts; `_replace()` returns a copy with some changed.
+
+    Attributes:
+        temperature (float): Controls randomness and variability in responses, ranging between 0 and 1.
+        max_tokens (int): The maximum number of tokens in the response.
+        model (str): The model to send the prompt to, e.g. `LLM_MODEL_SMALL` for simple extraction questions.
+        use_cache (bool): Re-use a saved response for identical inputs; best suited to temperature=0.
+        prompt_prefix (str): Optional start of the prompt that is identical across many calls, e.g. instructions and
+            a CV. It is sent first and marked for Anthropic prompt caching, so later calls read it from the cache at
+            a fraction of the cost and latency; the system context is cached with it. The API only caches prefixes
+            of at least 1024 tokens for this model.
+        tool (dict): Optional tool definition, e.g. from `cso.tool_definition()`, that the LLM is made to call; the
+            tool's input is returned as a json string in place of the response text.
+        stream_json (bool): Stream the response and parse it as a json object as it arrives; see `llm_response()`.
+        priority (int): The request's place in the queue for the shared rate limiter; lower numbers are sent first.
+        tags (dict): Optional fields added to the call's metrics events, e.g. {"cell": "Sci-Fi @ 0.5"}, so that the
+            calls can be summarised by them; see `cme.llm_summary_by()`.
+
+    Typical usage:
+        options = cll.CallOptions(temperature=0, use_cache=True, tool=cso.tool_definition(QUESTIONS))
+        options_small = options._replace(model=cll.LLM_MODEL_SMALL)
+    """
+
+    temperature: float = 0.6
+    max_tokens: int = LLM_MAX_TOKENS
+    model: str = LLM_MODEL
+    use_cache: bool = False
+    prompt_prefix: Optional[str] = None
+    tool: Optional[dict] = None
+    stream_json: bool = False
+    priority: int = 0
+    tags: Optional[dict] = None
+
+
+def _check_temperature(list_options: list):
+    """Raise a ValueError if the temperature of any of the options is not between 0 and 1."""
+    if not all(0 <= options.temperature <= 1 for options in list_options):
+        raise ValueError("Claude LLM requires temperature to be between 0 and 1.")
+
+
+def _message_params(prompt: str, system_context: str, options: CallOptions):
+    """Build the keyword arguments for one Messages API request, as used by both the interactive and batch calls."""
+
+    content = [{"type": "text", "text": prompt}]
+    if options.prompt_prefix:
+        content.insert(0, {"type": "text", "text": options.prompt_prefix, "cache_control": {"type": "ephemeral"}})
+
+    params = {
+        "model": options.model,
+        "max_tokens": options.max_tokens,
+        "temperature": options.temperature,
+        "system": system_context,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
+
+    # Make the LLM answer by calling the tool, so the answers arrive as a json object that matches its input schema
+    if options.tool:
+        params["tools"] = [options.tool]
+        params["tool_choice"] = {"type": "tool", "name": options.tool["name"]}
+    return params
+
+
+def _response_text(message):
+    """Return the text of a response or, if the LLM answered with a tool call, the tool's input as json."""
+    for block in message.content:
+        if block.type == "tool_use":
+            return json.dumps(block.input, ensure_ascii=False)
+    return "".join(block.text for block in message.content if block.type == "text")
+
+
+def _stream_json_message(client, params: dict, on_field=None):
+    """Stream one message, parsing it as a json object as it arrives and abandoning it as soon as it breaks.
+
+    The json is the text of the response or, if the LLM answers with a tool call, the tool's input.
+
+    Returns:
+        Message: The final message, or a snapshot of it (with the input tokens) if it was abandoned.
+        float: Seconds until the first text arrived; None if none did.
+        JSONStreamError: Why the reply is not the json object asked for; None if it is.
+    """
+
+    parser = cjs.JSONObjectStreamParser(on_field=on_field)
+    ttft_s = None
+    start = time.perf_counter()
+    with client.messages.stream(**params) as stream:
+        try:
+            for event in stream:
+                if event.type == "text":
+                    text = event.text
+                elif event.type == "input_json":
+                    text = event.partial_json
+                else:
+                    continue
+                if ttft_s is None:
+                    ttft_s = time.perf_counter() - start
+                parser.feed(text)
+
+        # The SDK raises a ValueError of its own if a tool's input is not json; leaving the 'with' block closes the
+        # connection, which stops the generation and its billing
+        except ValueError as e:
+            if not isinstance(e, cjs.JSONStreamError):
+                e = cjs.JSONStreamError(str(e))
+            return stream.current_message_snapshot, ttft_s, e
+        message = stream.get_final_message()
+
+    error = None
+    if not parser.done:
+        error = cjs.JSONStreamError(f"The reply ended ({message.stop_reason}) before the json object was complete")
+    return message, ttft_s, error
+
+
+class _Reply(NamedTuple):
+    """One reply from the API, as returned by `_send_once()`."""
+
+    message: object
+    text: str
+    usage: dict
+    ttft_s: Optional[float]
+    invalid: Optional[cjs.JSONStreamError]
+
+
+def _send_once(client, params: dict, stream_json: bool, on_field=None):
+    """Send one request, streaming it as json if asked; see `llm_response()`.
+
+    Returns:
+        _Reply: The message, its text, its token usage, the seconds until its first text if streamed, and why it is not
+            the json object asked for if it is not.
+    """
+
+    if not stream_json:
+        message = client.messages.create(**params)
+        return _Reply(message, _response_text(message), _usage_fields(message.usage), None, None)
+    message, ttft_s, invalid = _stream_json_message(client, params, on_field)
+    response_str = _response_text(message)
+
+    # An abandoned response is billed for what was generated before it was cancelled
+    usage = _usage_fields(message.usage)
+    usage["output_tokens"] = max(usage["output_tokens"], estimate_tokens(response_str))
+    return _Reply(message, response_str, usage, ttft_s, invalid)
+
+
+def _settle_usage(limiter, estimated: dict, usage: dict):
+    """Swap a request's estimated tokens for those it used in the rate limiter, and add them to the process totals."""
+
+    # Prompt cache reads don't count towards the input rate limit
+    limiter.settle(estimated, {
+        "input_tokens": usage["input_tokens"] + usage["cache_creation_input_tokens"],
+        "output_tokens": usage["output_tokens"]})
+    _record_usage(usage)
+
+
+def _back_off(limiter, attempt: int, error):
+    """Wait before retrying a failed request, holding back every thread if the API is rate limited or overloaded."""
+
+    seconds = _backoff_seconds(attempt, error)
+    print(f"LLM request failed ({error.__class__.__name__}), retrying in {seconds:.1f}s")
+    with _USAGE_LOCK:
+        _USAGE_STATS["retries"] += 1
+
+    # A rate limit or overload applies to every thread, so hold them all back; otherwise only this one waits
+    if getattr(error, "status_code", None) in (429, 529):
+        limiter.pause(seconds)
+    else:
+        time.sleep(seconds)
+
+
+def _abandon(limiter, estimated: dict, params: dict, options: CallOptions, reply: _Reply):
+    """Count what an invalid streamed reply used, and double its max_tokens if it was cut off, to ask again."""
+
+    _settle_usage(limiter, estimated, reply.usage)
+    cme.record("llm", model=options.model, ttft_s=reply.ttft_s, abandoned=True, stop_reason=reply.message.stop_reason,
+               error=reply.invalid.__class__.__name__, **(options.tags or {}), **reply.usage)
+    if reply.message.stop_reason == "max_tokens":
+        params["max_tokens"] = min(2 * params["max_tokens"], max(STREAM_MAX_TOKENS_CAP, options.max_tokens))
+        estimated["output_tokens"] = params["max_tokens"]
+    print(f"LLM response abandoned ({reply.invalid}), asking again with max_tokens={params['max_tokens']}")
+    with _USAGE_LOCK:
+        _USAGE_STATS["retries"] += 1
+
+
+def _send_with_retries(params: dict, estimated: dict, options: CallOptions, on_field, start: float):
+    """Send one request under the shared rate limits, retrying failures and asking again for invalid json replies.
+
+    Returns:
+        _Reply: The last reply, which is only invalid once `MAX_INVALID_RETRIES` or `MAX_RETRIES` is used up.
+        int: The number of attempts before it.
+        float: Seconds spent waiting for room under the rate limits.
+
+    Raises:
+        anthropic.APIError: An error that is not worth retrying, or the last error once the retries are used up.
+    """
+
+    # The SDK takes about a second to import, so it is only imported once a call is needed, e.g. not for a rerun
+    # answered entirely from the cache
+    import anthropic  # pylint: disable=import-outside-toplevel
+
+    client = get_client()
+    limiter = crl.get_rate_limiter()
+    queue_s = 0.0
+    n_invalid = 0
+    for attempt in range(MAX_RETRIES + 1):
+        queue_start = time.perf_counter()
+        limiter.acquire(priority=options.priority, **estimated)
+        queue_s += time.perf_counter() - queue_start
+        try:
+            reply = _send_once(client, params, options.stream_json, on_field)
+        except anthropic.APIError as e:
+            limiter.settle(estimated, {"input_tokens": 0, "output_tokens": 0})
+            if attempt == MAX_RETRIES or not _is_retryable(e):
+                cme.record("llm", model=options.model, wall_s=time.perf_counter() - start, queue_s=queue_s,
+                           retries=attempt, error=e.__class__.__name__, **(options.tags or {}))
+                raise
+            _back_off(limiter, attempt, e)
+            continue
+        if reply.invalid is None or n_invalid == MAX_INVALID_RETRIES or attempt == MAX_RETRIES:
+            break
+
+        # The streamed response is not the json object asked for: count what it used, then ask again straight away
+        n_invalid += 1
+        _abandon(limiter, estimated, params, options, reply)
+
+    _settle_usage(limiter, estimated, reply.usage)
+    return reply, attempt, queue_s
+
+
+def llm_response(prompt: str, system_context: str, options=None, on_field=None):
+    """Send a prompt and system context via API to Anthropic's LLM, 'Claude 3.5 Sonnet' by default.
 
     Code adapted from the Anthropic docs: https://docs.anthropic.com/en/docs/initial-setup#call-the-api
 
     Args:
         prompt (str): The prompt to which you are asking the the LLM to respond.
         system_context (str): The context that you have set under which the LLM should respond.
-        temperature (float): Controls randomness and variability in responses, ranging between 0 and 1.
+        options (CallOptions): The temperature, max_tokens, model and other options of the call; None for the
+            defaults.
+        on_field (callable): Optional function called as `on_field(key, value)` as each top-level field of a
+            streamed json response completes; a field may be reported again if the response is asked for again.
+
+    Each call waits for room under the shared rate limits before it is sent (see `crl.get_rate_limiter()`). Rate-limited
+    (429), overloaded (529) and failed (5xx) requests, and dropped connections, are retried up to `MAX_RETRIES` times
+    with exponential backoff and jitter, or after the API's 'retry-after' time; a rate limit or overload holds back
+    every thread, not just the one that hit it.
+
+    With `options.stream_json`, a response that stops being a json object is cancelled at the first character that
+    breaks the structure, or once `cjs.MAX_PREAMBLE_CHARS` characters have arrived without a '{' (e.g. the LLM answers
+    in prose), and one cut off at `max_tokens` is asked for again with twice the `max_tokens`, rather than waiting for
+    the whole of a response that cannot be used. Either is asked for again up to `MAX_INVALID_RETRIES` times; after
+    that the last text is returned as it is, for the caller to log.
 
     Returns:
         str: The unfiltered text output from the LLM.
 
     Raises:
         ValueError: Temperature needs to be a value between 0 and 1.
+        anthropic.APIError: An error that is not worth retrying, or the last error once the retries are used up.
 
     Typical usage:
         prompt = "Why are we here?"
@@ -94,28 +522,270 @@ def llm_response(prompt: str, system_context: str, temperature=0.6):
             have seen something."
     """
 
-    if not 0 <= temperature <= 1:
-        raise ValueError("Claude LLM requires temperature to be between 0 and 1.")
-    client = anthropic.Anthropic()
-
-    message = client.messages.create(
-        model="claude-3-5-sonnet-20240620",
-        max_tokens=1000,
-        temperature=temperature,
-        system=system_context,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
-    )
-    return message.content[0].text
+    options = CallOptions() if options is None else options
+    _check_temperature([options])
+
+    start = time.perf_counter()
+    if options.use_cache:
+        key = crc.cache_key(options.model, system_context, prompt, options.temperature, options.max_tokens,
+                            options.prompt_prefix, options.tool)
+        response_str = crc.cache_get(key)
+        if response_str is not None:
+            cme.record("llm", model=options.model, cache_hit=True, wall_s=time.perf_counter() - start,
+                       **(options.tags or {}))
+            return response_str
+
+    params = _message_params(prompt, system_context, options)
+    estimated = {
+        "input_tokens": estimate_tokens(system_context + (options.prompt_prefix or "") + prompt
+                                        + (json.dumps(options.tool) if options.tool else "")),
+        "output_tokens": options.max_tokens}
+    reply, retries, queue_s = _send_with_retries(params, estimated, options, on_field, start)
+    cme.record(
+        "llm", model=options.model, wall_s=time.perf_counter() - start, queue_s=queue_s, ttft_s=reply.ttft_s,
+        retries=retries, stop_reason=getattr(reply.message, "stop_reason", None), **(options.tags or {}),
+        **reply.usage)
+
+    # A response that is still not a json object is returned for the caller to log, but not cached
+    if options.use_cache and reply.invalid is None:
+        crc.cache_put(key, reply.text)
+    return reply.text
+
+
+def _split_by_prefix(list_options: list):
+    """Split prompts into those to send at once and those that wait for a response with the same prompt_prefix.
+
+    A prefix is only in the prompt cache once one response has been generated, so the first prompt with each prefix
+    is sent alone, and the others with it wait until it has come back; prompts without a prefix are all sent at once.
+
+    Returns:
+        list: The index of each prompt to send at once.
+        dict: The indexes of the prompts that wait, keyed on the prefix they wait for.
+    """
+
+    list_first = []
+    dict_waiting = {}
+    for i, options in enumerate(list_options):
+        if options.prompt_prefix in dict_waiting:
+            dict_waiting[options.prompt_prefix].append(i)
+            continue
+        if options.prompt_prefix:
+            dict_waiting[options.prompt_prefix] = []
+        list_first.append(i)
+    return list_first, dict_waiting
+
+
+def llm_response_many(prompts: list, system_context: str, options=None, max_concurrency=MAX_CONCURRENCY,
+                      on_result=None):
+    """Send several prompts concurrently to the LLM, sharing one client and its connection pool.
+
+    Each prompt is sent with `llm_response()` from a pool of worker threads, so a run takes roughly the time of the
+    slowest batch of `max_concurrency` calls rather than the sum of every round-trip.
+
+    When a `prompt_prefix` is given, the first prompt with each prefix is sent on its own so that the prefix is in the
+    prompt cache before the other prompts with it are sent; otherwise they would all miss the cache at once. Prompts
+    with different prefixes, e.g. one document each, are sent alongside one another.
+
+    If a call fails, prompts not yet sent are cancelled, responses already in flight are still passed to `on_result`,
+    and then the first error is raised; this lets the caller checkpoint everything that did come back.
+
+    Args:
+        prompts (list): The prompts to send, one string per document.
+        system_context (str): The context that you have set under which the LLM should respond.
+        options (CallOptions): The options of every call, or a list with one per prompt, e.g. for prompts that each
+            ask a different shard of the questions with its own tool, model and max_tokens, or the text of each
+            document as the prompt_prefix when every document is asked several prompts; None for the defaults.
+        max_concurrency (int): The maximum number of requests in flight at any one time.
+        on_result (callable): Optional function called as `on_result(index, response_str)` in the calling thread as
+            soon as each response arrives, e.g. to checkpoint it.
+
+    Returns:
+        list: The unfiltered text output from the LLM for each prompt, in the same order as `prompts`.
+
+    Raises:
+        ValueError: Temperature needs to be a value between 0 and 1, and max_concurrency needs to be at least 1.
+        Exception: The first error from any of the LLM calls.
+
+    Typical usage:
+        list_response_str = cll.llm_response_many(
+            prompts=list_prompts,
+            system_context=cll.llm_contexts()["Normal"],
+            options=cll.CallOptions(temperature=0, use_cache=True),
+            max_concurrency=8)
+    """
+
+    if not isinstance(options, list):
+        options = [CallOptions() if options is None else options] * len(prompts)
+    _check_temperature(options)
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency needs to be at least 1.")
+    if len(prompts) == 0:
+        return []
+
+    # Results are stored by index, so the output keeps the order of the inputs whatever order calls complete in
+    responses = [None] * len(prompts)
+    first_error = None
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(prompts))) as executor:
+        list_first, dict_waiting = _split_by_prefix(options)
+        futures = {executor.submit(llm_response, prompts[i], system_context, options[i]): i for i in list_first}
+        while futures:
+            for future in wait(futures, return_when=FIRST_COMPLETED).done:
+                i = futures.pop(future)
+                if future.cancelled():
+                    continue
+                if future.exception() is not None:
+                    if first_error is None:
+                        first_error = future.exception()
+                        dict_waiting.clear()
+                        for future_pending in futures:
+                            future_pending.cancel()
+                    continue
+                responses[i] = future.result()
+
+                # Send the prompts that were waiting for this one's prefix to be cached
+                futures.update({executor.submit(llm_response, prompts[j], system_context, options[j]): j
+                                for j in dict_waiting.pop(options[i].prompt_prefix, [])})
+                if on_result is not None:
+                    on_result(i, responses[i])
+
+    if any(prompt_options.use_cache for prompt_options in options):
+        crc.cache_evict()
+
+    if first_error is not None:
+        raise first_error
+
+    return responses
+
+
+def _submit_batch(client, dict_params: dict, path_state=None):
+    """Submit a Message Batch, or re-attach to one submitted by an earlier, interrupted run for the same requests.
+
+    Args:
+        client (anthropic.Anthropic): The shared client.
+        dict_params (dict): The parameters of each request, from `_message_params()`, keyed on custom id.
+        path_state (str): Optional path of a json file in which to keep the id of the batch in progress.
+
+    Returns:
+        str: The id of the batch.
+    """
+
+    if path_state is not None and os.path.exists(path_state):
+        with open(path_state, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state["custom_ids"] == list(dict_params):
+            print(f"Re-attaching to Message Batch {state['batch_id']}")
+            return state["batch_id"]
+
+    batch = client.messages.batches.create(
+        requests=[{"custom_id": custom_id, "params": params} for custom_id, params in dict_params.items()])
+    print(f"Submitted Message Batch {batch.id} with {len(dict_params)} requests")
+    if path_state is not None:
+        with open(path_state, "w", encoding="utf-8") as f:
+            json.dump({"batch_id": batch.id, "custom_ids": list(dict_params)}, f)
+    return batch.id
+
+
+def _wait_for_batch(client, batch_id: str):
+    """Poll a Message Batch every `BATCH_POLL_SECONDS` until every request in it has finished."""
+    batch = client.messages.batches.retrieve(batch_id)
+    while batch.processing_status != "ended":
+        counts = batch.request_counts
+        print(f"Message Batch {batch_id}: {counts.processing} processing, {counts.succeeded} succeeded, "
+              f"{counts.errored} errored")
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.messages.batches.retrieve(batch_id)
+
+
+def llm_response_batch(prompts: dict, system_context: str, options=None, on_result=None, path_state=None):
+    """Send several prompts to the LLM as one Message Batch and wait for it to finish.
+
+    The Message Batches API processes requests asynchronously, typically within an hour (at most 24 hours), at half
+    the price of interactive calls; suited to large overnight runs where latency does not matter.
+    See: https://docs.anthropic.com/en/docs/build-with-claude/message-batches
+
+    Prompts with a saved response (if `options.use_cache`) are answered from the cache and not submitted. If
+    `path_state` is given, the batch id is saved there so that a run stopped while waiting re-attaches to the same
+    batch instead of submitting (and paying for) it again. The batch's status is checked every `BATCH_POLL_SECONDS`.
+
+    Args:
+        prompts (dict): The prompts to send, one string per document, keyed on a unique id for each, e.g. the job_id;
+            the ids map the results back to prompts, and may contain only letters, digits, '-' and '_', up to 64
+            characters.
+        system_context (str): The context that you have set under which the LLM should respond.
+        options (CallOptions): The options of every call in the batch; None for the defaults. `stream_json` and
+            `priority` do not apply to batches.
+        on_result (callable): Optional function called as `on_result(index, response_str)` for each response, where
+            index is the prompt's position in `prompts`.
+        path_state (str): Optional path of a json file in which to keep the id of the batch in progress.
+
+    Returns:
+        list: The unfiltered text output from the LLM for each prompt, in the same order as `prompts`.
+
+    Raises:
+        ValueError: Temperature needs to be a value between 0 and 1.
+        RuntimeError: One or more requests in the batch did not succeed; all successful responses are passed to
+            `on_result` first, so a rerun only needs to send the failures.
+
+    Typical usage:
+        list_response_str = cll.llm_response_batch(
+            prompts={doc[0]: prompt for doc, prompt in zip(list_docs, list_prompts)},
+            system_context=cll.llm_contexts()["Normal"],
+            path_state=DIR_OUTPUT + FNAME_OUTPUT + "__batch.json")
+    """
+
+    options = CallOptions() if options is None else options
+    _check_temperature([options])
+
+    responses = [None] * len(prompts)
+    dict_index = {custom_id: i for i, custom_id in enumerate(prompts)}
+
+    # Answer what we can from the cache
+    dict_keys = {}
+    if options.use_cache:
+        for i, prompt in enumerate(prompts.values()):
+            dict_keys[i] = crc.cache_key(options.model, system_context, prompt, options.temperature,
+                                         options.max_tokens, options.prompt_prefix, options.tool)
+            responses[i] = crc.cache_get(dict_keys[i])
+            if responses[i] is not None:
+                cme.record("llm", model=options.model, cache_hit=True, batch=True)
+                if on_result is not None:
+                    on_result(i, responses[i])
+
+    list_to_send = [custom_id for custom_id, i in dict_index.items() if responses[i] is None]
+    if len(list_to_send) == 0:
+        return responses
+
+    client = get_client()
+    batch_id = _submit_batch(
+        client, {custom_id: _message_params(prompts[custom_id], system_context, options) for custom_id in list_to_send},
+        path_state)
+    _wait_for_batch(client, batch_id)
+
+    # Results come back in any order, so map them back to prompts by custom_id
+    list_failed = []
+    for entry in client.messages.batches.results(batch_id):
+        i = dict_index[entry.custom_id]
+        if entry.result.type != "succeeded":
+            list_failed.append(f"{entry.custom_id} ({entry.result.type})")
+            continue
+        _record_usage(_usage_fields(entry.result.message.usage))
+        cme.record("llm", model=options.model, batch=True, **_usage_fields(entry.result.message.usage))
+        responses[i] = _response_text(entry.result.message)
+        if options.use_cache:
+            crc.cache_put(dict_keys[i], responses[i])
+        if on_result is not None:
+            on_result(i, responses[i])
+
+    if path_state is not None and os.path.exists(path_state):
+        os.remove(path_state)
+    if options.use_cache:
+        crc.cache_evict()
+
+    if len(list_failed) > 0:
+        raise RuntimeError(f"{len(list_failed)} requests in Message Batch {batch_id} did not succeed: "
+                           + ", ".join(list_failed))
+
+    return responses
 
 
 def convert_llm_response_to_dict(response_str: str):
@@ -123,7 +793,7 @@ def convert_llm_response_to_dict(response_str: str):
 
     The prompts in this repo ask the LLM to answer several questions and give the output in json format
     The reason for asking for json format is to reduce the risk of data going to the wrong column.
-    Additional processing is undertaken to force the output into a json-compatible format.
+    Any remarks before the json are dropped; the answers themselves are kept exactly as given.
 
     Args:
         response_str (str): The raw text output from the LLM.
@@ -138,18 +808,20 @@ def convert_llm_response_to_dict(response_str: str):
         response_dict = cll.convert_llm_response_to_dict(response_str)
     """
 
-    # Convert new lines to spaces so that it doesn't break the json format
-    # Convert pipe to hyphen so that it doesn't break the pipe-delimited file
-    resp_one_line = response_str.replace("\n", " ").replace("|", "-")
+    # Keep the answers as given: newlines inside answers are allowed by non-strict parsing, and newlines and pipes
+    # are only replaced when exporting to the pipe-delimited txt file
+    resp_one_line = response_str.replace("\n", " ")
 
-    # Sometimes we get leading remarks, such as 'Here is your json file: ' so split at '{' and take the part after it
-    resp_cleaned = "{" + resp_one_line.split(sep="{", maxsplit=1)[1]
+    # Sometimes we get leading remarks, such as 'Here is your json file: ' so split at '{' and take the part after it;
+    # with no '{' at all (e.g. an answer in prose) nothing is left to parse, and the output is logged below
+    _, brace, rest = response_str.partition("{")
+    resp_cleaned = brace + rest
 
     print("**OUTPUT**")
     print(resp_cleaned)
 
     try:
-        response_dict = json.loads(resp_cleaned)
+        response_dict = json.loads(resp_cleaned, strict=False)
 
     except Exception as e:
         print(f"""Listen, kid, I don't know how to break this to you, but that ain't JSON. I've seen cleaner
@@ -157,11 +829,11 @@ def convert_llm_response_to_dict(response_str: str):
                 your prompt, because something's not lining up. Adjust it - before things get ugly.: {e}""")
 
         # Save the LLM output to logs
-        with open("../logs/log_llm.txt", "a", encoding="utf-8") as f:
-            f.write(resp_one_line + "/n")
+        with open(cpa.DIR_LOGS + "log_llm.txt", "a", encoding="utf-8") as f:
+            f.write(resp_one_line + "\n")
 
         # Return a placeholder so that the program can continue to process the next file
-        response_dict = {"1": "Error: check logs"}
+        response_dict = {"1": PARSE_ERROR}
 
     return response_dict
 
@@ -193,6 +865,8 @@ def insert_into_txt_from_json(path_output: str):
         cll.insert_into_txt_from_json(DIR_OUTPUT + FNAME_OUTPUT)
     """
 
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
     # Open the json file and convert to a Pandas dataframe
     with open(path_output + ".json", "r", encoding="utf-8") as json_file:
         tmp_json = json.load(json_file)
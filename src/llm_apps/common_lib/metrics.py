@@ -0,0 +1,303 @@
+"""This module provides common functions for recording where a run's time and money go.
+
+Every LLM call and web page fetch records one event: its wall time, and for LLM calls its time to first token (when
+streamed), input, output and cached tokens, retries and whether it was answered from the response cache. Events are
+kept in memory for the end-of-run report and, once `start_run()` has been called, appended to a json lines log:
+- 'logs/metrics.jsonl': one json object per event, tagged with the app name and a run id.
+
+The report gives p50/p95 latency, throughput, tokens and the estimated cost per document.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from . import paths as cpa
+
+# Structured log of every event, appended to by every run
+PATH_METRICS_LOG = cpa.DIR_LOGS + "metrics.jsonl"
+
+# Prices in US dollars per million tokens, from https://www.anthropic.com/pricing; Message Batches cost half as much
+PRICES_PER_MTOK = {
+    "claude-3-5-sonnet-20240620": {"input": 3.00, "cache_write": 3.75, "cache_read": 0.30, "output": 15.00},
+    "claude-3-5-sonnet-20241022": {"input": 3.00, "cache_write": 3.75, "cache_read": 0.30, "output": 15.00},
+    "claude-3-5-haiku-20241022": {"input": 0.80, "cache_write": 1.00, "cache_read": 0.08, "output": 4.00},
+    "claude-3-haiku-20240307": {"input": 0.25, "cache_write": 0.30, "cache_read": 0.03, "output": 1.25}}
+BATCH_DISCOUNT = 0.5
+
+_RUN = {"run_id": None, "app": None, "started": time.perf_counter(), "path_log": None}
+_EVENTS = []
+_LOCK = threading.Lock()
+
+
+def start_run(app: str, path_log=PATH_METRICS_LOG):
+    """Start a new run: clear the events in memory and tag the events that follow with a new run id.
+
+    Args:
+        app (str): The name of the app, e.g. 'app_1_1'.
+        path_log (str): The json lines file to append events to; None to keep them in memory only.
+
+    Returns:
+        str: The run id.
+
+    Typical usage:
+        cme.start_run("app_1_1")
+    """
+
+    with _LOCK:
+        _RUN.update({"run_id": uuid.uuid4().hex[:12], "app": app, "started": time.perf_counter(), "path_log": path_log})
+        _EVENTS.clear()
+        if path_log is not None:
+            os.makedirs(os.path.dirname(path_log) or ".", exist_ok=True)
+        return _RUN["run_id"]
+
+
+def clear_events():
+    """Forget the events in memory and restart the run clock, keeping the run id.
+
+    A long-running process, e.g. an app watching its input folder, reports each batch and then clears its events, so
+    memory does not grow with the number of batches; every event is still in the log.
+
+    Typical usage:
+        print(cme.report(n_documents=n_batch))
+        cme.clear_events()
+    """
+
+    with _LOCK:
+        _RUN["started"] = time.perf_counter()
+        _EVENTS.clear()
+
+
+def record(kind: str, **fields):
+    """Record one event.
+
+    Args:
+        kind (str): 'llm' for an LLM call, 'http' for a web page fetch, or 'escalation' for answers asked again of a
+            larger model.
+        **fields: The measurements, e.g. wall_s=1.2, input_tokens=2000, output_tokens=350, retries=0.
+
+    Typical usage:
+        cme.record("http", url=url, wall_s=0.41, status_code=200, attempts=1, from_cache=False, bytes=81234)
+    """
+
+    event = {"kind": kind, **fields}
+    with _LOCK:
+        _EVENTS.append(event)
+        if _RUN["path_log"] is not None:
+            line = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "run_id": _RUN["run_id"],
+                    "app": _RUN["app"], **event}
+            with open(_RUN["path_log"], "a", encoding="utf-8") as f:
+                f.write(json.dumps(line) + "\n")
+
+
+def events(kind=None):
+    """Return a copy of this run's events.
+
+    Args:
+        kind (str): Only return events of this kind, e.g. 'llm'; None for all.
+
+    Returns:
+        list: One dict per event, in the order they were recorded.
+
+    Typical usage:
+        list_llm_events = cme.events("llm")
+    """
+
+    with _LOCK:
+        return [dict(event) for event in _EVENTS if kind is None or event["kind"] == kind]
+
+
+def percentile(values: list, pct: float):
+    """Return a percentile of a list of numbers by the nearest-rank method; None for an empty list.
+
+    Typical usage:
+        p95 = cme.percentile([0.8, 1.2, 4.1], 95)
+    """
+
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), math.ceil(pct / 100 * len(ordered))) - 1)]
+
+
+def llm_cost(event: dict):
+    """Estimate the cost in US dollars of one LLM call from its tokens; None if the model's prices are unknown.
+
+    Typical usage:
+        cost = cme.llm_cost(event)
+    """
+
+    prices = PRICES_PER_MTOK.get(event.get("model"))
+    if prices is None:
+        return None
+    cost = (event.get("input_tokens", 0) * prices["input"]
+            + event.get("cache_creation_input_tokens", 0) * prices["cache_write"]
+            + event.get("cache_read_input_tokens", 0) * prices["cache_read"]
+            + event.get("output_tokens", 0) * prices["output"]) / 1e6
+    return cost * BATCH_DISCOUNT if event.get("batch") else cost
+
+
+def _format_seconds(seconds):
+    return "n/a" if seconds is None else f"{seconds:.2f}s"
+
+
+def _llm_group_summary(list_calls: list):
+    """Summarise a group of calls, e.g. those to one model: their number, latency, tokens and cost.
+
+    Streamed responses abandoned part way and asked for again are counted apart from the calls and left out of the
+    latency, but their tokens and cost are included, as they are billed.
+    """
+    list_completed = [e for e in list_calls if not e.get("abandoned")]
+    list_timed = [e["wall_s"] for e in list_completed if e.get("wall_s") is not None]
+    list_ttft = [e["ttft_s"] for e in list_completed if e.get("ttft_s") is not None]
+    list_costs = [llm_cost(e) for e in list_calls]
+    return {
+        "calls": len(list_completed),
+        "abandoned": len(list_calls) - len(list_completed),
+        "p50_s": percentile(list_timed, 50),
+        "p95_s": percentile(list_timed, 95),
+        "ttft_p50_s": percentile(list_ttft, 50),
+        "ttft_p95_s": percentile(list_ttft, 95),
+        "input_tokens": sum(e.get(name, 0) for e in list_calls
+                            for name in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")),
+        "cache_creation_input_tokens": sum(e.get("cache_creation_input_tokens", 0) for e in list_calls),
+        "cache_read_input_tokens": sum(e.get("cache_read_input_tokens", 0) for e in list_calls),
+        "output_tokens": sum(e.get("output_tokens", 0) for e in list_calls),
+        "cost_usd": None if None in list_costs else sum(list_costs)}
+
+
+def llm_summary_by(field: str):
+    """Summarise this run's LLM calls grouped by one of their fields, e.g. 'model', or a tag given to the calls.
+
+    Calls answered from the response cache are left out.
+
+    Args:
+        field (str): The field to group on; calls without it are grouped under None.
+
+    Returns:
+        dict: For each value of the field, in order of first use: the calls, abandoned streams, latency p50 and p95,
+            first token p50 and p95, input tokens (with those written to and read from the prompt cache), output
+            tokens and cost.
+
+    Typical usage:
+        dict_by_cell = cme.llm_summary_by("cell")
+    """
+
+    list_calls = [e for e in events("llm") if not e.get("cache_hit")]
+    return {value: _llm_group_summary([e for e in list_calls if e.get(field) == value])
+            for value in dict.fromkeys(e.get(field) for e in list_calls)}
+
+
+def summary(n_documents=None):
+    """Summarise this run's events.
+
+    Args:
+        n_documents (int): The number of documents processed, for throughput and cost per document.
+
+    Returns:
+        dict: The summary, with keys 'wall_s', 'llm' and 'http'. 'llm' has the same fields as each group of
+            `llm_summary_by()`, and also 'by_model', the calls, latency and cost of each model used, and 'escalated',
+            the number of answers asked again of a larger model.
+
+    Typical usage:
+        dict_summary = cme.summary(n_documents=len(list_docs))
+    """
+
+    with _LOCK:
+        wall_s = time.perf_counter() - _RUN["started"]
+    list_llm = events("llm")
+    list_http = events("http")
+
+    list_calls = [e for e in list_llm if not e.get("cache_hit")]
+    dict_llm = _llm_group_summary(list_calls)
+    cost = dict_llm["cost_usd"]
+    dict_llm.update({
+        "cache_hits": len(list_llm) - len(list_calls),
+        "retries": sum(e.get("retries", 0) for e in list_calls),
+        "cost_per_document_usd": cost / n_documents if cost is not None and n_documents else None})
+
+    # The same by model, when questions are routed to more than one
+    dict_llm["by_model"] = llm_summary_by("model")
+    dict_llm["escalated"] = sum(e.get("answers", 0) for e in events("escalation"))
+
+    list_fetch_s = [e["wall_s"] for e in list_http]
+    dict_http = {
+        "fetches": len(list_http),
+        "not_modified": sum(1 for e in list_http if e.get("from_cache")),
+        "failed": sum(1 for e in list_http if e.get("status_code") != 200),
+        "retries": sum(e.get("attempts", 1) - 1 for e in list_http),
+        "megabytes": sum(e.get("bytes", 0) for e in list_http) / 1e6,
+        "p50_s": percentile(list_fetch_s, 50),
+        "p95_s": percentile(list_fetch_s, 95)}
+
+    return {
+        "wall_s": wall_s,
+        "documents": n_documents,
+        "documents_per_second": n_documents / wall_s if n_documents and wall_s > 0 else None,
+        "llm": dict_llm,
+        "http": dict_http}
+
+
+def report(n_documents=None):
+    """Summarise this run's events as text, e.g. to print at the end of a run.
+
+    Args:
+        n_documents (int): The number of documents processed, for throughput and cost per document.
+
+    Returns:
+        str: A few lines covering run time, LLM calls and web page fetches; sections with no events are left out.
+
+    Typical usage:
+        print(cme.report(n_documents=len(list_docs)))
+        >> Run: 42.1s for 12 documents (0.29 documents/s)
+           LLM: 12 calls, 0 cache hits, 1 retries; latency p50 11.80s, p95 19.02s; tokens: 30120 input (68% cached),
+                4630 output; cost $0.1102 ($0.0092 per document)
+             claude-3-5-haiku-20241022: 8 calls; latency p50 3.10s, p95 4.62s; 2210 output tokens; cost $0.0301
+             claude-3-5-sonnet-20240620: 4 calls; latency p50 12.40s, p95 19.02s; 2420 output tokens; cost $0.0801
+             3 answers escalated to a larger model
+    """
+
+    dict_summary = summary(n_documents)
+    lines = [f"Run: {dict_summary['wall_s']:.1f}s"
+             + (f" for {n_documents} documents ({dict_summary['documents_per_second']:.2f} documents/s)"
+                if dict_summary["documents_per_second"] else "")]
+
+    dict_llm = dict_summary["llm"]
+    if dict_llm["calls"] or dict_llm["abandoned"] or dict_llm["cache_hits"]:
+        total_input = dict_llm["input_tokens"]
+        pct_cached = 100 * dict_llm["cache_read_input_tokens"] / total_input if total_input else 0
+        line = (f"LLM: {dict_llm['calls']} calls, {dict_llm['cache_hits']} cache hits, {dict_llm['retries']} retries"
+                + (f" ({dict_llm['abandoned']} abandoned streams)" if dict_llm["abandoned"] else "")
+                + f"; latency p50 {_format_seconds(dict_llm['p50_s'])}, p95 {_format_seconds(dict_llm['p95_s'])}")
+        if dict_llm["ttft_p50_s"] is not None:
+            line += (f"; first token p50 {_format_seconds(dict_llm['ttft_p50_s'])}, "
+                     f"p95 {_format_seconds(dict_llm['ttft_p95_s'])}")
+        line += (f"; tokens: {total_input} input ({pct_cached:.0f}% cached), {dict_llm['output_tokens']} output")
+        if dict_llm["cost_usd"] is not None:
+            line += f"; cost ${dict_llm['cost_usd']:.4f}"
+            if dict_llm["cost_per_document_usd"] is not None:
+                line += f" (${dict_llm['cost_per_document_usd']:.4f} per document)"
+        lines.append(line)
+
+        # Each model's share, when questions are routed to more than one
+        if len(dict_llm["by_model"]) > 1:
+            for model, dict_tier in dict_llm["by_model"].items():
+                lines.append(
+                    f"  {model}: {dict_tier['calls']} calls; latency p50 {_format_seconds(dict_tier['p50_s'])}, "
+                    f"p95 {_format_seconds(dict_tier['p95_s'])}; {dict_tier['output_tokens']} output tokens"
+                    + (f"; cost ${dict_tier['cost_usd']:.4f}" if dict_tier["cost_usd"] is not None else ""))
+        if dict_llm["escalated"]:
+            lines.append(f"  {dict_llm['escalated']} answers escalated to a larger model")
+
+    dict_http = dict_summary["http"]
+    if dict_http["fetches"]:
+        lines.append(
+            f"HTTP: {dict_http['fetches']} fetches, {dict_http['not_modified']} not modified, "
+            f"{dict_http['failed']} failed, {dict_http['retries']} retries, {dict_http['megabytes']:.1f} MB; "
+            f"latency p50 {_format_seconds(dict_http['p50_s'])}, p95 {_format_seconds(dict_http['p95_s'])}")
+
+    return "\n".join(lines)
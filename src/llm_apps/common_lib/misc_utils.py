@@ -1,10 +1,27 @@
 """This module provides common functions for miscellaneous utilities.
 """
 
+import hashlib
+import json
 import os
+import zipfile
 
-from dotenv import load_dotenv
-from docx import Document
+try:
+    from lxml import etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+from . import paths as cpa
+
+# WordprocessingML element names used when reading the text of a .docx file
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_BODY, _W_P, _W_R, _W_HYPERLINK = _W + "body", _W + "p", _W + "r", _W + "hyperlink"
+
+# Text equivalent of each element inside a run, matching python-docx's `Paragraph.text`
+_RUN_TEXT = {_W + "tab": "\t", _W + "ptab": "\t", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
+
+# Directory for the text extracted from each docx file, re-used while the file's size and modification time match
+DIR_DOCX_TEXT_CACHE = cpa.DIR_CACHE + "docx_text/"
 
 
 def load_dotenv_all():
@@ -15,7 +32,9 @@ def load_dotenv_all():
     Typical usage:
         clm.load_dotenv_all()
     """
-    load_dotenv("../.env", override=True)
+    from dotenv import load_dotenv  # pylint: disable=import-outside-toplevel
+
+    load_dotenv(cpa.PATH_DOTENV, override=True)
 
 
 def list_docx_in_directory(dir_docx: str):
@@ -42,11 +61,62 @@ def list_docx_in_directory(dir_docx: str):
     return files
 
 
-def load_docx_to_str(path_docx: str):
+def _is_run_content(stack: list):
+    """Whether the innermost of a stack of element tags is run content in a top-level paragraph, i.e. the stack is
+    [document, body, p, r, content] or [document, body, p, hyperlink, r, content]."""
+    if len(stack) == 5:
+        return stack[1] == _W_BODY and stack[2] == _W_P and stack[3] == _W_R
+    if len(stack) == 6:
+        return stack[1] == _W_BODY and stack[2] == _W_P and stack[3] == _W_HYPERLINK and stack[4] == _W_R
+    return False
+
+
+def _read_docx_paragraphs(path_docx: str):
+    """Read the text of each top-level paragraph in a docx file, streaming 'word/document.xml' straight from the zip.
+
+    This gives the same text as python-docx's `Document(path_docx).paragraphs`, i.e. paragraphs directly in the body
+    (not in tables), each made of the runs and hyperlinked runs directly in the paragraph, without building the
+    whole document object model.
+    """
+
+    paragraphs = []
+    parts = []
+    stack = []
+    with zipfile.ZipFile(path_docx) as docx_zip, docx_zip.open("word/document.xml") as f:
+        for event, element in etree.iterparse(f, events=("start", "end")):
+            if event == "start":
+                stack.append(element.tag)
+                continue
+
+            # Run content, directly in a top-level paragraph or in a hyperlink in one
+            if _is_run_content(stack):
+                if element.tag == _W + "t":
+                    parts.append(element.text or "")
+                elif element.tag == _W + "br":
+                    parts.append("\n" if element.get(_W + "type", "textWrapping") == "textWrapping" else "")
+                else:
+                    parts.append(_RUN_TEXT.get(element.tag, ""))
+
+            # End of a top-level paragraph: save its text and free the memory used by its elements
+            elif len(stack) == 3 and element.tag == _W_P and stack[1] == _W_BODY:
+                paragraphs.append("".join(parts))
+                parts = []
+                element.clear()
+
+            stack.pop()
+
+    return paragraphs
+
+
+def load_docx_to_str(path_docx: str, use_cache=True):
     """Load the text from a docx file.
 
+    The text is read straight from the file's xml, which is several times faster than python-docx, and is cached
+    on disk so that unchanged documents (same path, size and modification time) are not parsed again.
+
     Args:
         path_docx (str): The path of the docx file.
+        use_cache (bool): Re-use the text extracted from an unchanged file on a previous run.
 
     Returns:
         str: The first paragraph of the file; the convention used is for this to be the url to the source material.
@@ -56,15 +126,38 @@ def load_docx_to_str(path_docx: str):
         doc_first_para, doc_all_text = clm.load_docx_to_str(DIR_INPUT_DOCX + FNAME_INPUT_DOCX)
     """
 
-    # Load the .docx file
-    doc = Document(path_docx)
+    stat = os.stat(path_docx)
+    path_cache = os.path.join(
+        DIR_DOCX_TEXT_CACHE, hashlib.sha256(os.path.abspath(path_docx).encode("utf-8")).hexdigest() + ".json")
 
-    # Get first paragraph, e.g. document url
-    first_paragraph = doc.paragraphs[0].text
+    if use_cache:
+        try:
+            with open(path_cache, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                return entry["first_paragraph"], entry["all_text"]
+        except (OSError, ValueError, KeyError):
+            pass
 
-    # Iterate through each paragraph and concatenate the text
-    all_text = ""
-    for paragraph in doc.paragraphs:
-        all_text += paragraph.text + "\n"
+    paragraphs = _read_docx_paragraphs(path_docx)
+
+    # Get first paragraph, e.g. document url
+    first_paragraph = paragraphs[0]
+
+    # Concatenate the text of every paragraph
+    all_text = "".join(paragraph + "\n" for paragraph in paragraphs)
+
+    if use_cache:
+        os.makedirs(DIR_DOCX_TEXT_CACHE, exist_ok=True)
+        entry = {
+            "path": path_docx,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "first_paragraph": first_paragraph,
+            "all_text": all_text}
+        path_tmp = f"{path_cache}.{os.getpid()}.tmp"
+        with open(path_tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(path_tmp, path_cache)
 
     return first_paragraph, all_text
@@ -0,0 +1,190 @@
+"""This module provides a pool of worker processes for parsing documents, e.g. Word files and web pages, in batches.
+
+Parsing is CPU-bound, so threads in one process take turns on one core (Python's global interpreter lock), whereas
+worker processes parse on every core at once. Items are sent to the workers in batches, to spread the cost of
+passing them between processes, and each worker sends back a compact record, e.g. the (tag, text) blocks of a page
+rather than its parsed tree. Submitting an item does not wait for it to be parsed, so the main process can keep
+downloading pages or calling the LLM while the workers parse.
+
+With one worker, or on a machine with one core, items are parsed in the calling process instead, as before.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import NamedTuple
+
+# Worker processes: one per core
+MAX_WORKERS = os.cpu_count() or 1
+
+# Maximum items in each batch sent to a worker; a smaller batch is sent straight away if a worker is idle
+BATCH_SIZE = 8
+
+
+def _parse_batch(function, list_args: list):
+    """Worker: parse each item of a batch, returning its result or the error it raised."""
+    list_results = []
+    for args in list_args:
+        try:
+            list_results.append((True, function(*args)))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            list_results.append((False, e))
+    return list_results
+
+
+class _Batches(NamedTuple):
+    """The state of a `ParsePool`: the items waiting to be batched, the batches being parsed, and the errors so far."""
+
+    pending: list
+    futures: dict
+    errors: list
+
+
+class ParsePool:
+    """Parse items in worker processes, in batches, passing each result back as soon as its batch is done.
+
+    Workers are started with 'spawn', as on Windows and macOS, so that they do not inherit the threads and locks of
+    the main process, e.g. those of the LLM rate limiter.
+
+    If an item fails, the other items are still parsed and passed to `on_result`, and then the first error is raised
+    by `close()`.
+
+    Args:
+        function (callable): The parser, a function defined at the top level of a module so that workers can import
+            it, e.g. `che.extract_blocks`; called with the arguments given to `submit()`.
+        on_result (callable): Called as `on_result(key, result)` in the thread that calls `submit()` or `close()`,
+            for each item whose batch has finished; not needed if items are only parsed with `parse()`.
+        max_workers (int): The number of worker processes; 1 to parse in the calling process.
+        batch_size (int): The maximum number of items sent to a worker at once.
+
+    Typical usage:
+        with cpp.ParsePool(che.extract_blocks, on_result=save_page) as pool:
+            for tb_id, result in fetched_pages:
+                pool.submit(tb_id, result["content"], "auto", result["encoding"])
+    """
+
+    def __init__(self, function, on_result=None, max_workers=MAX_WORKERS, batch_size=BATCH_SIZE):
+        self.function = function
+        self.on_result = on_result
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self._executor = None
+        if max_workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self._batches = _Batches(pending=[], futures={}, errors=[])
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        elif self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    def _send(self):
+        """Send the items waiting to be batched to the workers as one batch."""
+        if self._batches.pending:
+            future = self._executor.submit(_parse_batch, self.function, [args for _, args in self._batches.pending])
+            self._batches.futures[future] = [key for key, _ in self._batches.pending]
+            self._batches.pending.clear()
+
+    def _collect(self, block: bool):
+        """Pass on the results of the batches that have finished; with `block`, wait for at least one first."""
+        if block:
+            wait(self._batches.futures, return_when=FIRST_COMPLETED)
+        for future in [future for future in self._batches.futures if future.done()]:
+            list_keys = self._batches.futures.pop(future)
+            try:
+                list_results = future.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                list_results = [(False, e)] * len(list_keys)
+            for key, (ok, result) in zip(list_keys, list_results):
+                if ok:
+                    self.on_result(key, result)
+                else:
+                    self._batches.errors.append(result)
+
+    def submit(self, key, *args):
+        """Add an item to be parsed, without waiting for it, and pass on any results that are ready.
+
+        Args:
+            key (object): Identifies the item in the call to `on_result`, e.g. its id.
+            *args (object): The arguments for the parser.
+        """
+
+        if self._executor is None:
+            try:
+                result = self.function(*args)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._batches.errors.append(e)
+                return
+            self.on_result(key, result)
+            return
+
+        with self._lock:
+            self._batches.pending.append((key, args))
+            if len(self._batches.pending) >= self.batch_size or len(self._batches.futures) < self.max_workers:
+                self._send()
+            self._collect(block=False)
+
+    def parse(self, *args):
+        """Parse one item in a worker and wait for the result, e.g. from the worker threads of a pipeline stage.
+
+        Args:
+            *args (object): The arguments for the parser.
+
+        Returns:
+            The parser's result.
+        """
+
+        if self._executor is None:
+            return self.function(*args)
+        return self._executor.submit(self.function, *args).result()
+
+    def close(self):
+        """Wait for every item to be parsed, passing on the results, then stop the workers.
+
+        Raises:
+            Exception: The first error from the parser.
+        """
+
+        if self._executor is not None:
+            with self._lock:
+                self._send()
+                while self._batches.futures:
+                    self._collect(block=True)
+            self._executor.shutdown()
+        if self._batches.errors:
+            raise self._batches.errors[0]
+
+
+def parse_many(function, dict_args: dict, max_workers=MAX_WORKERS, batch_size=BATCH_SIZE):
+    """Parse several items in worker processes, e.g. every Word document in an input folder.
+
+    Few items are parsed in the calling process, as starting workers would take longer than parsing them.
+
+    Args:
+        function (callable): The parser, defined at the top level of a module, e.g. `clm.load_docx_to_str`.
+        dict_args (dict): The arguments for each item, as a tuple, keyed on id.
+        max_workers (int): The maximum number of worker processes.
+        batch_size (int): The maximum number of items sent to a worker at once.
+
+    Returns:
+        dict: The result for each item, keyed on id, in the same order as `dict_args`.
+
+    Raises:
+        Exception: The first error from the parser, once every other item has been parsed.
+
+    Typical usage:
+        dict_loaded = cpp.parse_many(clm.load_docx_to_str, {job_id: (DIR_INPUT_DOCX + job_filename,) ...})
+    """
+
+    dict_results = dict.fromkeys(dict_args)
+    n_workers = min(max_workers, -(-len(dict_args) // batch_size))
+    with ParsePool(function, dict_results.__setitem__, n_workers, batch_size) as pool:
+        for key, args in dict_args.items():
+            pool.submit(key, *args)
+    return dict_results
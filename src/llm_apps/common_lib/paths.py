@@ -0,0 +1,20 @@
+"""This module provides the locations of the data, logs and cache folders and of the '.env' file.
+
+They are all found under one root folder: the clone location by default, or the folder given by the environment
+variable `LLM_APPS_ROOT` (which the `--root` option of the `llm-apps` command sets), so the apps can be run from any
+working directory. Each path ends with a separator, so file names can be added to it directly.
+"""
+
+import os
+
+# The root folder: the clone location, i.e. three levels above this file, unless LLM_APPS_ROOT is set
+DIR_ROOT = os.path.join(os.path.abspath(
+    os.environ.get("LLM_APPS_ROOT") or os.path.join(os.path.dirname(__file__), "..", "..", "..")), "")
+
+# The folders under the root: inputs and outputs, logs, and caches that can be deleted at any time
+DIR_DATA = DIR_ROOT + "data/"
+DIR_LOGS = DIR_ROOT + "logs/"
+DIR_CACHE = DIR_ROOT + "cache/"
+
+# The file containing the user's local environment variables, e.g. API keys
+PATH_DOTENV = DIR_ROOT + ".env"
@@ -0,0 +1,158 @@
+"""This module provides a runner for pipelines of stages connected by bounded in-memory queues.
+
+Each stage has its own pool of worker threads, which take items from the queue in front of the stage, process them
+and put the results on the queue in front of the next stage. The first item can therefore reach the last stage
+while later items are still in the first, e.g. page 1 is summarised while page 50 is still downloading.
+
+The queues are bounded: once the queue in front of a slow stage is full, the stages before it wait, so memory stays
+flat however many items there are and a fast stage cannot race ahead of a slow one.
+"""
+
+import queue
+import threading
+import time
+
+# Maximum number of items waiting in front of each stage
+QUEUE_SIZE = 16
+
+# Marks the end of the items on a queue
+_END = object()
+
+
+class _Pipeline:
+    """The queues, statistics and error state shared by the threads of one `run_pipeline()` call.
+
+    Args:
+        stages (list): One (name, function, n_workers) tuple per stage, in order.
+        queue_size (int): The maximum number of items waiting in front of each stage.
+    """
+
+    def __init__(self, stages: list, queue_size: int):
+        self.stages = stages
+
+        # One queue in front of each stage, and one for the results of the last stage
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self.stats = {name: {"items": 0, "dropped": 0, "errors": 0, "busy_s": 0.0} for name, _, _ in stages}
+        self.n_running = [n_workers for _, _, n_workers in stages]
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.errors = []
+
+    def fail(self, e: Exception):
+        """Keep the first error and stop new items from being started."""
+        with self.lock:
+            self.errors.append(e)
+        self.stop.set()
+
+    def feed(self, items):
+        """Put the items on the first queue, then one end marker per worker of the first stage."""
+        try:
+            for item in items:
+                if self.stop.is_set():
+                    break
+                self.queues[0].put(item)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.fail(e)
+        for _ in range(self.stages[0][2]):
+            self.queues[0].put(_END)
+
+    def _process(self, i: int, item):
+        """Pass one item through stage i and count it; return the item for the next stage, or None."""
+        name, function, _ = self.stages[i]
+        start = time.perf_counter()
+        try:
+            result = function(item)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Pipeline stage '{name}' failed: {e.__class__.__name__}: {e}")
+            result = None
+            self.fail(e)
+            with self.lock:
+                self.stats[name]["errors"] += 1
+        with self.lock:
+            self.stats[name]["items"] += 1
+            self.stats[name]["busy_s"] += time.perf_counter() - start
+            if result is None:
+                self.stats[name]["dropped"] += 1
+        return result
+
+    def work(self, i: int):
+        """Process items from the queue in front of stage i until its end marker."""
+        while True:
+            item = self.queues[i].get()
+            if item is _END:
+                break
+            if self.stop.is_set():
+                continue
+            result = self._process(i, item)
+            if result is not None:
+                self.queues[i + 1].put(result)
+
+        # The last worker of a stage to finish passes the end on, once per worker of the next stage
+        with self.lock:
+            self.n_running[i] -= 1
+            is_last = self.n_running[i] == 0
+        if is_last:
+            for _ in range(self.stages[i + 1][2] if i + 1 < len(self.stages) else 1):
+                self.queues[i + 1].put(_END)
+
+    def deliver(self, on_result=None):
+        """Hand each result to the caller as it comes out of the last stage, until the caller itself fails."""
+        while True:
+            item = self.queues[-1].get()
+            if item is _END:
+                break
+            if on_result is not None:
+                try:
+                    on_result(item)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    self.fail(e)
+                    on_result = None
+
+
+def run_pipeline(items, stages: list, queue_size=QUEUE_SIZE, on_result=None):
+    """Pass items through a series of stages, each with its own worker threads, connected by bounded queues.
+
+    If a stage raises an error, items still waiting in the queues are dropped, items already inside a stage are
+    finished, results that reach the end are still passed to `on_result`, and then the first error is raised; this
+    lets the caller keep everything that did complete.
+
+    Args:
+        items (iterable): The inputs to the first stage, e.g. (tb_id, tb_url) tuples; read as the pipeline has room.
+        stages (list): One (name, function, n_workers) tuple per stage, in order. Each function is called with one
+            item and returns the item for the next stage, or None to drop it, e.g. a page that failed to download.
+        queue_size (int): The maximum number of items waiting in front of each stage.
+        on_result (callable): Optional function called as `on_result(item)` in the calling thread for each item
+            that comes out of the last stage, e.g. to store it.
+
+    Returns:
+        dict: For each stage, keyed on name: 'items' in, 'dropped', 'errors' and 'busy_s', the seconds its workers
+            spent processing.
+
+    Raises:
+        ValueError: A stage needs at least one worker.
+        Exception: The first error from any stage or from `on_result`.
+
+    Typical usage:
+        dict_stats = cpl.run_pipeline(
+            dict_urls.items(),
+            stages=[("fetch", fetch, 8), ("extract", extract, 2), ("summarise", summarise, 4)],
+            on_result=store_result)
+    """
+
+    if any(n_workers < 1 for _, _, n_workers in stages):
+        raise ValueError("Every stage needs at least one worker.")
+
+    pipeline = _Pipeline(stages, queue_size)
+    threads = [threading.Thread(target=pipeline.feed, args=(items,), daemon=True)]
+    for i, (_, _, n_workers) in enumerate(stages):
+        threads += [threading.Thread(target=pipeline.work, args=(i,), daemon=True) for _ in range(n_workers)]
+    for thread in threads:
+        thread.start()
+
+    pipeline.deliver(on_result)
+    for thread in threads:
+        thread.join()
+
+    if pipeline.errors:
+        raise pipeline.errors[0]
+    return pipeline.stats
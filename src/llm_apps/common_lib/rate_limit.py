@@ -0,0 +1,137 @@
+"""This module provides a rate limiter for LLM calls, shared by every thread in the process.
+
+It paces requests, input tokens and output tokens per minute to the account's limits, so that concurrent calls use
+the quota without being rejected, and holds back every call after the API reports that a limit was reached.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+
+# Account rate limits, shared by every call in the process; set a limit to 0 to disable it
+RATE_LIMIT_RPM = int(os.environ.get("LLM_RATE_LIMIT_RPM", 50))
+RATE_LIMIT_INPUT_TPM = int(os.environ.get("LLM_RATE_LIMIT_INPUT_TPM", 40000))
+RATE_LIMIT_OUTPUT_TPM = int(os.environ.get("LLM_RATE_LIMIT_OUTPUT_TPM", 8000))
+_RATE_LIMITER = None
+_RATE_LIMITER_LOCK = threading.Lock()
+
+
+class RateLimiter:
+    """Token buckets for requests, input tokens and output tokens per minute, shared by every thread.
+
+    Each bucket holds up to one minute's allowance and refills continuously. A request takes one request, its
+    estimated input tokens and its `max_tokens` from the buckets before it is sent, waiting until all three have
+    enough; unused tokens are returned once the response reports its actual usage. Waiting requests are served in
+    priority order (lower first), then in order of arrival.
+
+    Args:
+        rpm (int): Requests per minute; 0 for no limit.
+        input_tpm (int): Input tokens per minute; 0 for no limit.
+        output_tpm (int): Output tokens per minute; 0 for no limit.
+
+    Typical usage:
+        limiter = crl.get_rate_limiter()
+        limiter.acquire(input_tokens=2000, output_tokens=1000)
+    """
+
+    def __init__(self, rpm: int, input_tpm: int, output_tpm: int):
+        self.limits = {"requests": rpm, "input_tokens": input_tpm, "output_tokens": output_tpm}
+        self._levels = dict(self.limits)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def _refill(self):
+        """Top up each bucket for the time since it was last topped up."""
+        now = time.monotonic()
+        for name, limit in self.limits.items():
+            if limit > 0:
+                self._levels[name] = min(limit, self._levels[name] + (now - self._updated) * limit / 60)
+        self._updated = now
+
+    def _seconds_until_available(self, amounts: dict):
+        """Seconds until every bucket holds enough, or until a pause ends; 0 if the request can go now."""
+        seconds = max(0.0, self._paused_until - time.monotonic())
+        for name, limit in self.limits.items():
+            # A request larger than a whole bucket waits for a full bucket and then overdraws it
+            needed = min(amounts[name], limit)
+            if limit > 0 and self._levels[name] < needed:
+                seconds = max(seconds, (needed - self._levels[name]) * 60 / limit)
+        return seconds
+
+    def acquire(self, input_tokens: int, output_tokens: int, priority=0):
+        """Wait until the request can be sent within the limits, then take its allowance from the buckets.
+
+        Args:
+            input_tokens (int): The estimated input tokens of the request.
+            output_tokens (int): The maximum output tokens of the request, i.e. its `max_tokens`.
+            priority (int): Lower numbers are served first.
+        """
+
+        amounts = {"requests": 1, "input_tokens": input_tokens, "output_tokens": output_tokens}
+        with self._condition:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    # Only the request at the front of the queue may take from the buckets; the others wait their turn
+                    if self._queue[0] != ticket:
+                        self._condition.wait()
+                        continue
+                    self._refill()
+                    seconds = self._seconds_until_available(amounts)
+                    if seconds == 0:
+                        for name, amount in amounts.items():
+                            self._levels[name] -= amount
+                        return
+                    self._condition.wait(timeout=seconds)
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+    def settle(self, estimated: dict, actual: dict):
+        """Return the difference between a request's estimated and actual tokens to the buckets.
+
+        Args:
+            estimated (dict): The 'input_tokens' and 'output_tokens' passed to `acquire()`.
+            actual (dict): The 'input_tokens' and 'output_tokens' used, e.g. 0 for a request that was rejected.
+        """
+
+        with self._condition:
+            self._refill()
+            for name in ("input_tokens", "output_tokens"):
+                if self.limits[name] > 0:
+                    self._levels[name] = min(self.limits[name], self._levels[name] + estimated[name] - actual[name])
+            self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold back every request for a number of seconds, e.g. after the API reports a rate limit."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+
+def get_rate_limiter():
+    """Return the rate limiter shared by every call in the process, creating it on first use.
+
+    The limits are read from `RATE_LIMIT_RPM`, `RATE_LIMIT_INPUT_TPM` and `RATE_LIMIT_OUTPUT_TPM`, which can be set with
+    the environment variables 'LLM_RATE_LIMIT_RPM', 'LLM_RATE_LIMIT_INPUT_TPM' and 'LLM_RATE_LIMIT_OUTPUT_TPM' to
+    match your account's usage tier.
+
+    Returns:
+        RateLimiter: The shared rate limiter.
+
+    Typical usage:
+        limiter = crl.get_rate_limiter()
+    """
+
+    global _RATE_LIMITER  # pylint: disable=global-statement
+    with _RATE_LIMITER_LOCK:
+        if _RATE_LIMITER is None:
+            _RATE_LIMITER = RateLimiter(RATE_LIMIT_RPM, RATE_LIMIT_INPUT_TPM, RATE_LIMIT_OUTPUT_TPM)
+    return _RATE_LIMITER
@@ -0,0 +1,158 @@
+"""This module provides common functions for scoring the relevance of documents to each other locally, without an LLM.
+
+Documents are compared by the cosine similarity of their TF-IDF vectors, built with NumPy: words that are frequent in
+one document but rare across the others (e.g. 'pytorch', 'kubernetes') count for more than words every document uses.
+Scoring every pair this way takes milliseconds, so it can be used to choose which pairs are worth an LLM call.
+"""
+
+import csv
+import os
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+# Words, allowing the characters used in the names of tools and languages, e.g. 'c++', 'c#', 'node.js'
+_RE_WORD = re.compile(r"[a-z][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+
+# Common words that carry no information about relevance
+STOP_WORDS = frozenset(
+    "a about an and are as at be been but by can do for from has have how i if in into is it its job may me more "
+    "most my not of on or our role should so such than that the their them there these they this to we what when "
+    "which who will with work would you your".split())
+
+
+def tokenise(text: str):
+    """Split a text into lower-case words, dropping stop words and single characters.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The words, in order.
+
+    Typical usage:
+        list_words = clr.tokenise(job_text)
+    """
+
+    return [word for word in _RE_WORD.findall(text.lower()) if len(word) > 1 and word not in STOP_WORDS]
+
+
+def tfidf_vectors(texts: list):
+    """Build a TF-IDF vector for each text, normalised to unit length.
+
+    Term frequencies are sublinear (1 + log of the count), so a word repeated many times does not swamp the rest, and
+    inverse document frequencies are smoothed, so a word in every text still counts for a little.
+
+    Args:
+        texts (list): The texts.
+
+    Returns:
+        numpy.ndarray: One row per text and one column per word in the vocabulary.
+
+    Typical usage:
+        vectors = clr.tfidf_vectors(list_cv_texts + list_job_texts)
+    """
+
+    # Map each word to a column, and count each text's words
+    vocabulary = {}
+    list_rows, list_cols = [], []
+    for row, text in enumerate(texts):
+        for word in tokenise(text):
+            list_rows.append(row)
+            list_cols.append(vocabulary.setdefault(word, len(vocabulary)))
+
+    counts = np.zeros((len(texts), max(len(vocabulary), 1)))
+    np.add.at(counts, (np.array(list_rows, dtype=int), np.array(list_cols, dtype=int)), 1)
+
+    tf = np.zeros_like(counts)
+    np.log(counts, out=tf, where=counts > 0)
+    tf[counts > 0] += 1
+    doc_freq = (counts > 0).sum(axis=0)
+    idf = np.log((1 + len(texts)) / (1 + doc_freq)) + 1
+
+    vectors = tf * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def score_matrix(row_texts: list, col_texts: list):
+    """Score every pair of texts from two lists by cosine similarity.
+
+    Args:
+        row_texts (list): The texts for the rows, e.g. CVs.
+        col_texts (list): The texts for the columns, e.g. job descriptions.
+
+    Returns:
+        numpy.ndarray: The similarity, from 0 to 1, of each row text (row) to each column text (column).
+
+    Typical usage:
+        scores = clr.score_matrix(list_cv_texts, list_job_texts)
+    """
+
+    vectors = tfidf_vectors(list(row_texts) + list(col_texts))
+    return vectors[:len(row_texts)] @ vectors[len(row_texts):].T
+
+
+class Ranking(NamedTuple):
+    """The ranks of the rows within each column of a score matrix, and the pairs selected from them.
+
+    Attributes:
+        ranks (numpy.ndarray): The rank of each row within its column, starting at 1.
+        selected (numpy.ndarray): True where the row is in the top k of its column and scores more than the minimum.
+    """
+
+    ranks: np.ndarray
+    selected: np.ndarray
+
+
+def top_k_per_column(scores, k: int, min_score=0.0):
+    """Select the k highest scoring rows in each column, ignoring rows that score no more than `min_score`.
+
+    Args:
+        scores (numpy.ndarray): The scores, e.g. from `score_matrix()`.
+        k (int): The number of rows to select per column; all rows if k is larger.
+        min_score (float): The score a row must exceed to be selected; 0 drops pairs with no words in common.
+
+    Returns:
+        Ranking: The rank of each row within its column, starting at 1, and True where the row is in the top k of its
+            column and scores more than `min_score`.
+
+    Typical usage:
+        ranking = clr.top_k_per_column(scores, k=2)
+    """
+
+    order = np.argsort(-scores, axis=0, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(1, scores.shape[0] + 1)[:, None].repeat(scores.shape[1], axis=1), axis=0)
+    return Ranking(ranks, (ranks <= k) & (scores > min_score))
+
+
+def export_ranked_matrix(path_txt: str, scores, ranking: Ranking, rows: tuple, cols: tuple):
+    """Write every scored pair to a pipe-delimited txt file, grouped by column and ranked within each column.
+
+    The file is rewritten on each run, as it covers every pair of the current inputs.
+
+    Args:
+        path_txt (str): The path of the txt file.
+        scores (numpy.ndarray): The scores, from `score_matrix()`.
+        ranking (Ranking): The ranks and selected pairs, from `top_k_per_column()`.
+        rows (tuple): The header of the row label column and a label for each row, e.g.
+            ("cv_filename", list_cv_filenames).
+        cols (tuple): The header of the column label column and a label for each column, e.g.
+            ("job_id", list_job_ids).
+
+    Typical usage:
+        clr.export_ranked_matrix(DIR_OUTPUT + FNAME_OUTPUT + "__matrix.txt", scores, ranking,
+                                 ("cv_filename", list_cv_filenames), ("job_id", list_job_ids))
+    """
+
+    (row_header, row_labels), (col_header, col_labels) = rows, cols
+    with open(path_txt + ".tmp", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="|", lineterminator=os.linesep)
+        writer.writerow([col_header, row_header, "relevance_score", "relevance_rank", "sent_to_llm"])
+        for col, col_label in enumerate(col_labels):
+            for row in np.argsort(ranking.ranks[:, col]):
+                writer.writerow([col_label, row_labels[row], f"{scores[row, col]:.4f}", ranking.ranks[row, col],
+                                 "Yes" if ranking.selected[row, col] else "No"])
+    os.replace(path_txt + ".tmp", path_txt)
@@ -0,0 +1,164 @@
+"""This module provides a disk-backed cache of LLM responses, so that identical requests are not paid for twice.
+
+Each response is saved as one json file in '[root]/cache/llm_responses/', named by a hash of everything that shapes
+the response. Entries not used for `CACHE_MAX_AGE_DAYS` are treated as misses, and the least recently used entries
+are evicted once the cache is larger than `CACHE_MAX_BYTES`.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from . import paths as cpa
+
+# Disk-backed response cache: one json file per response, named by a hash of everything that shapes the response
+DIR_CACHE = cpa.DIR_CACHE + "llm_responses/"
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+CACHE_MAX_AGE_DAYS = 90
+_CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0}
+_CACHE_LOCK = threading.Lock()
+
+
+def cache_key(*inputs):
+    """Hash the inputs that determine an LLM response into a cache key.
+
+    Args:
+        *inputs: Everything that shapes the response, in a fixed order, e.g. the model, system context, prompt,
+            temperature and max_tokens, then the cacheable start of the prompt and the tool, if any; None is left
+            out, so that adding an optional input does not change the keys of responses saved without it.
+
+    Returns:
+        str: A sha256 hex digest identifying the request.
+
+    Typical usage:
+        key = crc.cache_key(model, system_context, prompt, 0, 1000)
+    """
+
+    payload = json.dumps([value for value in inputs if value is not None], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key: str):
+    """Return the path of the cache file for a key, sharded into sub-directories by the first two characters."""
+    return os.path.join(DIR_CACHE, key[:2], key + ".json")
+
+
+def cache_get(key: str, max_age_days=CACHE_MAX_AGE_DAYS):
+    """Look up a cached LLM response, counting the hit or miss.
+
+    Entries older than `max_age_days` are treated as a miss and deleted. A hit refreshes the file's modification
+    time so that eviction removes the least recently used entries first.
+
+    Args:
+        key (str): The key from `cache_key()`.
+        max_age_days (float): The age after which an entry is considered stale.
+
+    Returns:
+        str: The cached response, or None if there is no fresh entry.
+
+    Typical usage:
+        response_str = crc.cache_get(key)
+    """
+
+    path = _cache_path(key)
+    response_str = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if time.time() - entry["created"] <= max_age_days * 86400:
+            response_str = entry["response"]
+            os.utime(path)
+        else:
+            os.remove(path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with _CACHE_LOCK:
+        _CACHE_STATS["hits" if response_str is not None else "misses"] += 1
+    return response_str
+
+
+def cache_put(key: str, response_str: str):
+    """Save an LLM response to the cache.
+
+    The file is written to a temporary name and then renamed, so concurrent readers never see a partial entry.
+
+    Args:
+        key (str): The key from `cache_key()`.
+        response_str (str): The text output from the LLM.
+
+    Typical usage:
+        crc.cache_put(key, response_str)
+    """
+
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"created": time.time(), "response": response_str}, f)
+    os.replace(tmp_path, path)
+
+
+def cache_evict(max_bytes=CACHE_MAX_BYTES, max_age_days=CACHE_MAX_AGE_DAYS):
+    """Remove stale cache entries, then the least recently used ones until the cache fits within `max_bytes`.
+
+    Args:
+        max_bytes (int): The maximum total size of the cache on disk.
+        max_age_days (float): Entries not used for longer than this are removed.
+
+    Returns:
+        int: The number of entries removed.
+
+    Typical usage:
+        crc.cache_evict(max_bytes=50 * 1024 * 1024)
+    """
+
+    if not os.path.isdir(DIR_CACHE):
+        return 0
+
+    # Collect (last used, size, path) for every entry
+    entries = []
+    for dirpath, _, filenames in os.walk(DIR_CACHE):
+        for filename in filenames:
+            if filename.endswith(".json"):
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    oldest_allowed = time.time() - max_age_days * 86400
+    total_bytes = sum(size for _, size, _ in entries)
+    n_removed = 0
+    for mtime, size, path in entries:
+        if mtime >= oldest_allowed and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        n_removed += 1
+
+    with _CACHE_LOCK:
+        _CACHE_STATS["evictions"] += n_removed
+    return n_removed
+
+
+def cache_stats():
+    """Return the cache hit, miss and eviction counters for this process.
+
+    Returns:
+        dict: A copy of the counters.
+
+    Typical usage:
+        print(f"LLM cache: {crc.cache_stats()}")
+        >> LLM cache: {'hits': 12, 'misses': 3, 'evictions': 0}
+    """
+
+    with _CACHE_LOCK:
+        return dict(_CACHE_STATS)
@@ -0,0 +1,309 @@
+"""This module provides a streaming, append-only store for the results of the LLM apps.
+
+Each result is written as soon as it arrives to two files next to the app's outputs, so memory stays flat however
+large a run grows and nothing is lost if a run is interrupted:
+- '[FNAME_OUTPUT].jsonl': one json line per result, exactly as returned, including any '|' or newlines.
+- '[FNAME_OUTPUT].sqlite': a table, 'results', with one column per field of the app's fixed schema, for querying.
+
+The pipe-delimited '[FNAME_OUTPUT].txt' file is an export from the '.jsonl' file, appended to incrementally as before.
+
+Results not yet exported to the '.txt' file belong to the current run (or to an interrupted one, which a rerun
+resumes); a rerun skips documents whose id and content hash have already been exported.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+# Columns that the store adds to every row, before the app's own columns
+STORE_COLUMNS = ("row_id", "doc_id", "doc_sha256", "jsonl_offset", "created_at", "extra_json")
+
+
+def file_sha256(path: str, salt=""):
+    """Hash the contents of a file.
+
+    Args:
+        path (str): The path of the file.
+        salt (str): Optional text mixed into the hash, e.g. the hash of another input that the result depends on.
+
+    Returns:
+        str: A sha256 hex digest.
+
+    Typical usage:
+        cv_sha256 = crs.file_sha256(DIR_INPUT_DOCX_CV + cv_filename)
+    """
+
+    sha = hashlib.sha256(salt.encode("utf-8"))
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def text_sha256(text: str, salt=""):
+    """Hash a text, e.g. a web page's extracted text when there is no file to hash.
+
+    Args:
+        text (str): The text.
+        salt (str): Optional text mixed into the hash.
+
+    Returns:
+        str: A sha256 hex digest.
+
+    Typical usage:
+        doc_sha256 = crs.text_sha256(tb_text)
+    """
+
+    return hashlib.sha256((salt + text).encode("utf-8")).hexdigest()
+
+
+def flatten_record(record: dict):
+    """Flatten an output record: its own fields followed by the fields of its nested 'llm_response' dict.
+
+    Args:
+        record (dict): The output for one document, e.g. {"job_id": ..., "llm_response": {"1": ..., "2": ...}}.
+
+    Returns:
+        dict: The fields of the record and its LLM response at one level.
+
+    Typical usage:
+        row = crs.flatten_record(tmp_dict)
+    """
+
+    row = {key: value for key, value in record.items() if key != "llm_response"}
+    row.update(record.get("llm_response") or {})
+    return row
+
+
+def txt_value(value):
+    """Format one value for a pipe-delimited txt file, replacing the characters that would break its layout.
+
+    Args:
+        value (object): The value, e.g. an answer from the LLM; None, dicts and lists are written as 'None' and json.
+
+    Returns:
+        str: The value on one line, with newlines and '|' replaced by spaces and '-'.
+
+    Typical usage:
+        writer.writerow([crs.txt_value(row.get(column)) for column in list_columns])
+    """
+    if value is None:
+        return "None"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).replace("\r\n", " ").replace("\n", " ").replace("\r", " ").replace("|", "-")
+
+
+class ResultStore:
+    """An append-only store of one app's results, with a fixed column schema.
+
+    Args:
+        path_output (str): The path of the output files, excluding the extension.
+        columns (list): The app's fields, in the order they are written to the txt file, e.g.
+            ["job_id", "job_filename", "job_link", "1", "2", ...]. Fields a result has that are not in `columns`
+            are kept in the '.jsonl' file and the 'extra_json' column, but not in the txt file.
+        id_field (str): The name of the document id in each record, e.g. 'job_id'.
+
+    Typical usage:
+        with crs.ResultStore(DIR_OUTPUT + FNAME_OUTPUT, OUTPUT_COLUMNS, id_field="job_id") as store:
+            store.append(tmp_dict, doc_sha256)
+            store.export_txt()
+    """
+
+    def __init__(self, path_output: str, columns: list, id_field: str):
+        self.path_output = path_output
+        self.columns = list(columns)
+        self.id_field = id_field
+        self._lock = threading.Lock()
+
+        # The connection is shared by threads that append results, so access to it is serialised by the lock
+        self._conn = sqlite3.connect(path_output + ".sqlite", check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS store_state (key TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (row_id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT, "
+            "doc_sha256 TEXT, jsonl_offset INTEGER, created_at TEXT, extra_json TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_doc ON results (doc_id, doc_sha256)")
+        self._ensure_columns(self.columns)
+        self._conn.commit()
+        self._recover()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
+
+    def _ensure_columns(self, columns: list):
+        """Add any of `columns` missing from the results table, e.g. after an app's schema gains a field."""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        for column in columns:
+            if column not in existing and column not in STORE_COLUMNS:
+                self._conn.execute(f'ALTER TABLE results ADD COLUMN "{column}"')
+
+    def _insert(self, line: dict, jsonl_offset: int):
+        """Insert one '.jsonl' line into the results table."""
+        row = flatten_record(line["record"])
+        extra = {key: value for key, value in row.items() if key not in self.columns}
+        values = [row.get(column) for column in self.columns]
+        values = [json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v for v in values]
+        placeholders = ", ".join("?" * (5 + len(self.columns)))
+        quoted_columns = "".join(f', "{column}"' for column in self.columns)
+        self._conn.execute(
+            f"INSERT INTO results (doc_id, doc_sha256, jsonl_offset, created_at, extra_json{quoted_columns}) "
+            f"VALUES ({placeholders})",
+            [str(line["record"][self.id_field]), line["doc_sha256"], jsonl_offset, line["created_at"],
+             json.dumps(extra, ensure_ascii=False) if extra else None] + values)
+
+    def _recover(self):
+        """Insert any '.jsonl' lines missing from the table, e.g. after a crash between writing the two."""
+        last_offset = self._conn.execute("SELECT MAX(jsonl_offset) FROM results").fetchone()[0]
+        if not os.path.exists(self.path_output + ".jsonl"):
+            return
+        with open(self.path_output + ".jsonl", "rb") as f:
+            if last_offset is not None:
+                f.seek(last_offset)
+                f.readline()
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                self._insert(json.loads(line), offset)
+        self._conn.commit()
+
+    def append(self, record: dict, doc_sha256: str):
+        """Append one result to the '.jsonl' file (flushed to disk) and the results table.
+
+        Args:
+            record (dict): The output for one document, with its id, filename, link and 'llm_response' dict.
+            doc_sha256 (str): The content hash of the document.
+
+        Typical usage:
+            store.append(tmp_dict, dict_doc_hashes[job_id])
+        """
+
+        line = {
+            "doc_sha256": doc_sha256,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "record": record}
+        with self._lock:
+            with open(self.path_output + ".jsonl", "ab") as f:
+                offset = f.tell()
+                f.write(json.dumps(line, ensure_ascii=False).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._insert(line, offset)
+            self._conn.commit()
+
+    def _exported_offset(self):
+        """Return the '.jsonl' offset up to which results have been exported to the txt file."""
+        row = self._conn.execute("SELECT value FROM store_state WHERE key = 'txt_exported_offset'").fetchone()
+        return row[0] if row else 0
+
+    def processed(self):
+        """Return the documents already in the store.
+
+        Returns:
+            set: (doc_id, doc_sha256) of results already exported to the txt file, i.e. from previous runs.
+            set: (doc_id, doc_sha256) of results not yet exported, i.e. from the current or an interrupted run.
+
+        Typical usage:
+            exported, pending = store.processed()
+        """
+
+        with self._lock:
+            exported_offset = self._exported_offset()
+            exported, pending = set(), set()
+            for doc_id, doc_sha256, offset in self._conn.execute(
+                    "SELECT doc_id, doc_sha256, jsonl_offset FROM results"):
+                (exported if offset < exported_offset else pending).add((doc_id, doc_sha256))
+        return exported, pending
+
+    def export_txt(self):
+        """Append the results not yet exported to the pipe-delimited txt file, in the order they arrived.
+
+        Reproduces the txt file the apps have always written: one row per result, with the app's columns in order,
+        'None' for missing answers, and newlines and '|' in answers replaced by spaces and '-'. Results are read
+        one at a time from the '.jsonl' file, so memory use does not grow with the size of the run.
+
+        Returns:
+            int: The number of rows written.
+
+        Typical usage:
+            store.export_txt()
+        """
+
+        path_jsonl = self.path_output + ".jsonl"
+        if not os.path.exists(path_jsonl):
+            return 0
+
+        with self._lock:
+            n_rows = 0
+            offset = self._exported_offset()
+            with open(path_jsonl, "rb") as f_jsonl, \
+                    open(self.path_output + ".txt", "a+", encoding="utf-8", newline="") as f_txt:
+
+                # The txt file may have been created by hand with a header but no final newline
+                if f_txt.tell() > 0:
+                    f_txt.seek(f_txt.tell() - 1)
+                    if f_txt.read(1) not in ("\n", "\r"):
+                        f_txt.write(os.linesep)
+
+                writer = csv.writer(f_txt, delimiter="|", lineterminator=os.linesep)
+                f_jsonl.seek(offset)
+                for line in f_jsonl:
+                    if not line.endswith(b"\n"):
+                        break
+                    row = flatten_record(json.loads(line)["record"])
+                    writer.writerow([txt_value(row.get(column)) for column in self.columns])
+                    offset += len(line)
+                    n_rows += 1
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO store_state (key, value) VALUES ('txt_exported_offset', ?)", (offset,))
+            self._conn.commit()
+        return n_rows
+
+
+def filter_processed(dict_docs: dict, dir_input: str, store: ResultStore, skip_processed=True, salt=""):
+    """Drop documents that have already been processed and are unchanged.
+
+    A document is skipped if its id and content hash were exported by a previous run (unless `skip_processed` is
+    False), or if it is already in the store from the current or an interrupted run.
+
+    Args:
+        dict_docs (dict): The filename of each document, keyed on document id.
+        dir_input (str): The directory containing the documents.
+        store (ResultStore): The app's result store.
+        skip_processed (bool): Skip documents exported by previous runs; set to False to process them again.
+        salt (str): Optional text mixed into each hash, e.g. the hash of a CV that every result depends on.
+
+    Returns:
+        dict: The filename of each document still to process, keyed on document id.
+        dict: The content hash of every document in `dict_docs`, keyed on document id.
+
+    Typical usage:
+        dict_docs_to_review, dict_doc_hashes = crs.filter_processed(dict_docs_to_review, DIR_INPUT_DOCX, store)
+    """
+
+    exported, pending = store.processed()
+    done = exported | pending if skip_processed else pending
+
+    dict_doc_hashes = {doc_id: file_sha256(dir_input + filename, salt) for doc_id, filename in dict_docs.items()}
+    dict_pending = {
+        doc_id: filename for doc_id, filename in dict_docs.items() if (doc_id, dict_doc_hashes[doc_id]) not in done}
+
+    n_skipped = len(dict_docs) - len(dict_pending)
+    if n_skipped > 0:
+        print(f"Skipping {n_skipped} of {len(dict_docs)} documents that are already processed and unchanged")
+
+    return dict_pending, dict_doc_hashes
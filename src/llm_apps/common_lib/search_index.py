@@ -0,0 +1,333 @@
+"""This module provides a full-text search index over the results of an LLM app, with typed columns for filtering.
+
+The results are loaded from the app's '.jsonl' store (see result_store.py) into an SQLite database:
+- A table, 'records', with one typed column per field, e.g. INTEGER for a score from 1 to 10, so that filters such as
+  `sentiment >= 2` compare numbers rather than text; the numeric columns are indexed.
+- An FTS5 full-text index of the text columns, which ranks keyword matches by BM25, so that a search reads a few
+  pages of the index rather than scanning every result, and stays in milliseconds for tens of thousands of results.
+
+Loading is incremental: the index remembers how far into the '.jsonl' file it has read, and each update only reads
+the lines appended since. Only the latest result for each document is kept, e.g. after a changed document has been
+processed again; a document is identified by one or more fields, e.g. a job and a CV for comparisons of several CVs
+with the same job. The index can be deleted at any time; it is rebuilt from the '.jsonl' file on the next update.
+"""
+
+import json
+import os
+import re
+import sqlite3
+
+from . import result_store as crs
+
+# SQL type of each answer type; booleans are stored as 0 or 1
+SQL_TYPES = {"string": "TEXT", "integer": "INTEGER", "number": "REAL", "boolean": "INTEGER"}
+
+# Comparison operators allowed in filters, longest first so that '>=' is not read as '>'
+FILTER_OPS = ("!=", "<=", ">=", "=", "<", ">")
+
+# Default number of results returned by a search
+SEARCH_LIMIT = 20
+
+# Numbers in a text, with an optional 'k' or 'm' multiplier, e.g. '£60,000', '60k' or '1.2m'
+_AMOUNT_PATTERN = re.compile(r"(\d[\d,]*(?:\.\d+)?)(?:\s*([kKmM])(?![a-zA-Z]))?")
+
+
+def amounts(text):
+    """Find the amounts of money, or other numbers, stated in a text.
+
+    A number without a multiplier is given that of the next one in the same range, e.g. '£60-70k' is 60000 and 70000.
+
+    Args:
+        text (str): The text, e.g. an answer about the salary range; anything else is treated as empty.
+
+    Returns:
+        list: The numbers, as floats, in the order they appear.
+
+    Typical usage:
+        salary_max = max(csi.amounts("£60,000 - £75,000 plus bonus"), default=None)
+    """
+
+    if not isinstance(text, str):
+        return []
+    list_found = [(float(number.replace(",", "")), (suffix or "").lower())
+                  for number, suffix in _AMOUNT_PATTERN.findall(text)]
+    list_amounts = []
+    for i, (number, suffix) in enumerate(list_found):
+        if not suffix and i + 1 < len(list_found) and list_found[i + 1][1] and number < 1000:
+            suffix = list_found[i + 1][1]
+        list_amounts.append(number * {"k": 1e3, "m": 1e6}.get(suffix, 1))
+    return list_amounts
+
+
+def parse_filter(text: str):
+    """Split a filter written as text, e.g. on the command line, into its column, operator and value.
+
+    Args:
+        text (str): The filter, e.g. 'salary_max>=60000' or 'remote_hybrid_onsite=Remote'.
+
+    Returns:
+        tuple: (column, operator, value); the value is a number if it looks like one.
+
+    Raises:
+        ValueError: The text has no operator from `FILTER_OPS`.
+
+    Typical usage:
+        list_filters = [csi.parse_filter(text) for text in args.where]
+    """
+
+    match = re.match(r"^\s*(\w+)\s*(" + "|".join(re.escape(op) for op in FILTER_OPS) + r")\s*(.*?)\s*$", text)
+    if match is None:
+        raise ValueError(f"Filter '{text}' should be a column, an operator ({', '.join(FILTER_OPS)}) and a value.")
+    column, op, value = match.groups()
+    try:
+        value = float(value) if "." in value else int(value)
+    except ValueError:
+        pass
+    return column, op, value
+
+
+def _sql_value(value, field_type: str):
+    """Convert an answer to its column's type; None if it cannot be, e.g. 'Unknown' for a number."""
+    if value is None:
+        return None
+    if field_type == "string":
+        return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+    if field_type == "boolean":
+        if isinstance(value, str):
+            return {"yes": 1, "true": 1, "no": 0, "false": 0}.get(value.strip().lower())
+        return int(bool(value))
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return int(number) if field_type == "integer" and number.is_integer() else number
+
+
+class SearchIndex:
+    """A full-text search index over one app's results, loaded incrementally from its '.jsonl' store.
+
+    Args:
+        path_index (str): The path of the index database.
+        path_jsonl (str): The path of the app's '.jsonl' store.
+        columns (dict): The type of each field, e.g. {"job_id": "string", "sentiment": "integer", ...}; text fields
+            are full-text indexed, the others are indexed for filtering and sorting.
+        id_fields (tuple): The fields that together identify a result, e.g. ('job_id',), or ('job_id', 'cv_filename')
+            when each job is compared with several CVs; joined with ' / ' as the result's 'doc_id'.
+        derived (dict): Optional numeric columns computed from the amounts stated in a text field, keyed on name:
+            (text field, function of the list of amounts), e.g. {"salary_max": ("salary_range", max)}.
+
+    Typical usage:
+        with csi.SearchIndex(path_index, path_jsonl, columns, id_fields=("tb_id",)) as index:
+            index.update()
+            list_results = index.search("pandas", filters=[("has_code_examples", "=", 1)])
+    """
+
+    def __init__(self, path_index: str, path_jsonl: str, columns: dict, id_fields: tuple, derived=None):
+        self.path_jsonl = path_jsonl
+        self.id_fields = tuple(id_fields)
+        self.derived = derived or {}
+        self.columns = dict(columns)
+        self.columns.update({name: "number" for name in self.derived})
+        self.text_columns = [column for column, field_type in self.columns.items() if field_type == "string"]
+
+        os.makedirs(os.path.dirname(path_index) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path_index)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS index_state (key TEXT PRIMARY KEY, value TEXT)")
+
+        # Start again if the columns have changed, e.g. an app's schema has gained a question
+        schema = json.dumps([self.columns, self.id_fields], sort_keys=True)
+        if self._state("schema") != schema:
+            self._create_tables()
+            self._set_state("schema", schema)
+            self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
+
+    def _state(self, key: str):
+        row = self._conn.execute("SELECT value FROM index_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)", (key, value))
+
+    def _create_tables(self):
+        """(Re)create the empty records table, its full-text index and the triggers that keep the two in step."""
+        for statement in ("DROP TABLE IF EXISTS records_fts", "DROP TABLE IF EXISTS records",
+                          "DELETE FROM index_state"):
+            self._conn.execute(statement)
+
+        # The numbers come before the text, so that filtering or sorting on them only reads the start of each row
+        typed_columns = "".join(
+            f', "{column}" {SQL_TYPES[field_type]}'
+            for column, field_type in sorted(self.columns.items(), key=lambda item: item[1] == "string"))
+        self._conn.execute(
+            f"CREATE TABLE records (row_id INTEGER PRIMARY KEY, doc_id TEXT UNIQUE, created_at TEXT{typed_columns})")
+        for column, field_type in self.columns.items():
+            if field_type != "string":
+                self._conn.execute(f'CREATE INDEX "idx_records_{column}" ON records ("{column}")')
+
+        # The full-text index stores only the index, reading the text itself from the records table
+        quoted = ", ".join(f'"{column}"' for column in self.text_columns)
+        old_values = ", ".join(f'old."{column}"' for column in self.text_columns)
+        new_values = ", ".join(f'new."{column}"' for column in self.text_columns)
+        self._conn.execute(
+            f"CREATE VIRTUAL TABLE records_fts USING fts5({quoted}, content='records', content_rowid='row_id', "
+            f"tokenize='porter unicode61')")
+        self._conn.execute(
+            f"CREATE TRIGGER records_ai AFTER INSERT ON records BEGIN "
+            f"INSERT INTO records_fts (rowid, {quoted}) VALUES (new.row_id, {new_values}); END")
+        self._conn.execute(
+            f"CREATE TRIGGER records_ad AFTER DELETE ON records BEGIN "
+            f"INSERT INTO records_fts (records_fts, rowid, {quoted}) VALUES ('delete', old.row_id, {old_values}); END")
+
+    def _row_values(self, record: dict):
+        """Return a stored record's id, from its id fields, and its value for each column, including derived ones."""
+        row = crs.flatten_record(record)
+        for name, (column, function) in self.derived.items():
+            list_amounts = amounts(row.get(column))
+            row[name] = function(list_amounts) if list_amounts else None
+        return " / ".join(str(row.get(field)) for field in self.id_fields), [
+            _sql_value(row.get(column), field_type) for column, field_type in self.columns.items()]
+
+    def update(self, rebuild=False):
+        """Load the results appended to the '.jsonl' store since the last update.
+
+        Args:
+            rebuild (bool): Drop the index and load every result again.
+
+        Returns:
+            int: The number of results loaded.
+
+        Typical usage:
+            n_new = index.update()
+        """
+
+        if not os.path.exists(self.path_jsonl):
+            return 0
+
+        # The store is append-only, so a shorter file means it has been replaced and must be read from the start
+        offset = int(self._state("jsonl_offset") or 0)
+        if rebuild or offset > os.path.getsize(self.path_jsonl):
+            schema = self._state("schema")
+            self._create_tables()
+            self._set_state("schema", schema)
+            offset = 0
+
+        n_loaded = 0
+        quoted = "".join(f', "{column}"' for column in self.columns)
+        placeholders = ", ".join("?" * (2 + len(self.columns)))
+        with open(self.path_jsonl, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                entry = json.loads(line)
+                doc_id, list_values = self._row_values(entry["record"])
+
+                # Keep only the latest result for each document
+                self._conn.execute("DELETE FROM records WHERE doc_id = ?", (doc_id,))
+                self._conn.execute(
+                    f"INSERT INTO records (doc_id, created_at{quoted}) VALUES ({placeholders})",
+                    [doc_id, entry["created_at"]] + list_values)
+                n_loaded += 1
+
+        self._set_state("jsonl_offset", offset)
+        self._conn.commit()
+        return n_loaded
+
+    def count(self):
+        """Return the number of results in the index."""
+        return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def _check_column(self, column: str):
+        if column not in self.columns and column not in ("row_id", "doc_id", "created_at"):
+            raise ValueError(f"Unknown column '{column}'; expected one of: {', '.join(self.columns)}.")
+
+    def _where(self, filters):
+        """Turn (column, operator, value) filters into SQL conditions and their parameters."""
+
+        # Column names cannot be parameters, so they are checked against the schema before being used
+        list_where = []
+        filter_params = []
+        for column, op, value in filters:
+            self._check_column(column)
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unknown operator '{op}'; expected one of: {', '.join(FILTER_OPS)}.")
+            collate = " COLLATE NOCASE" if isinstance(value, str) else ""
+            list_where.append(f'"{column}" {op} ?{collate}')
+            filter_params.append(value)
+        return list_where, filter_params
+
+    def search(self, query=None, filters=(), order_by=None, limit=SEARCH_LIMIT):
+        """Find the results matching keywords and filters, best matches first.
+
+        Args:
+            query (str): Optional FTS5 query over the text columns, e.g. 'mlops', '"computer vision" OR nlp', 'data*'
+                or 'primary_tool: pandas' to search one column; words are matched on their stems, e.g. 'deploy'
+                also finds 'deployment'. None to match every result.
+            filters (list): (column, operator, value) tuples that every result must meet, e.g.
+                [("sentiment", ">=", 2)]; operators are those in `FILTER_OPS`, and text is compared ignoring case.
+            order_by (str): Optional column to sort by, descending if it starts with '-', e.g. '-salary_max'; by
+                default, results are sorted by relevance to the query, or newest first without one.
+            limit (int): The maximum number of results to return.
+
+        Returns:
+            list: One dict per result, with 'row_id', 'doc_id', 'created_at', every column and 'score', the BM25
+                relevance to the query (higher is better; None without a query).
+
+        Raises:
+            ValueError: A filter or `order_by` names an unknown column or operator, or the query is not valid FTS5
+                syntax.
+
+        Typical usage:
+            list_results = index.search("mlops", filters=[("salary_max", ">", 60000)], limit=10)
+        """
+
+        list_where, filter_params = self._where(filters)
+        sql_order = ""
+        if order_by:
+            self._check_column(order_by.lstrip("-"))
+            sql_order = f'records."{order_by.lstrip("-")}" {"DESC" if order_by.startswith("-") else "ASC"}'
+
+        if query:
+            # Rank the matches in the full-text index, which holds no text, and only read the rows of the best ones.
+            # Filters are checked with the column indexes first; the '+' stops SQLite from looking up the query in
+            # the full-text index once per row that meets them
+            sql_matches = ("SELECT rowid AS row_id, -bm25(records_fts) AS score FROM records_fts "
+                           "WHERE records_fts MATCH ?")
+            params = [query]
+            if list_where:
+                sql_matches += " AND +rowid IN (SELECT row_id FROM records WHERE " + " AND ".join(list_where) + ")"
+                params += filter_params
+            if not sql_order:
+                sql_matches += " ORDER BY score DESC LIMIT ?"
+                params.append(limit)
+            sql = (f"SELECT records.*, matches.score FROM ({sql_matches}) AS matches JOIN records USING (row_id) "
+                   f"ORDER BY {sql_order or 'matches.score DESC'} LIMIT ?")
+        else:
+            sql = "SELECT records.*, NULL AS score FROM records"
+            if list_where:
+                sql += " WHERE " + " AND ".join(f"records.{where}" for where in list_where)
+            sql += f" ORDER BY {sql_order or 'records.row_id DESC'} LIMIT ?"
+            params = filter_params
+        params.append(limit)
+
+        try:
+            list_rows = self._conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query '{query}': {e}") from e
+
+        # The columns in schema order, rather than the table's
+        list_keys = ["row_id", "doc_id", "created_at"] + list(self.columns) + ["score"]
+        return [{key: row[key] for key in list_keys} for row in list_rows]
@@ -0,0 +1,391 @@
+"""This module provides common functions for getting answers from an LLM as named, typed fields.
+
+Each app defines its questions as a schema: a list of (column name, type, question) tuples, optionally followed by a
+dict of extra json schema keywords such as {"minimum": 1, "maximum": 10}. The schema becomes the input schema of a
+tool which the LLM is made to call, so the API returns the answers as a json object with one field per question
+instead of free text that has to be parsed. Each response is then checked against the schema, and only the answers
+that are missing or of the wrong type are asked for again.
+
+A long list of questions can also be split into shards, e.g. facts stated in the document and judgements about it,
+which are asked in separate calls at the same time. Each call then generates fewer tokens, so a document's answers
+arrive sooner, and each shard's `max_tokens` is sized from the answers it expects rather than fixed.
+
+Shards of simple extraction questions can be sent to a smaller, faster model. Its tool then also asks which answers
+it is unsure of, and those, with any it could not answer, are asked again of the larger model.
+"""
+
+import json
+import math
+
+from . import llms as cll
+from . import metrics as cme
+
+# The json schema types a question can have; every question may also be answered with null, i.e. unknown
+FIELD_TYPES = ("string", "integer", "number", "boolean")
+
+# The name of the tool that the LLM is made to call with its answers
+TOOL_NAME = "record_answers"
+
+# Times the answers still missing from a response are asked for again, and what is recorded if they never arrive
+MAX_REASKS = 2
+NOT_ANSWERED = "Error: not answered"
+
+# Expected tokens in an answer of each type, for sizing max_tokens; a string question can set its own limit with the
+# json schema keyword 'maxLength', in characters
+ANSWER_TOKENS = {"string": 40, "integer": 3, "number": 5, "boolean": 2}
+
+# Tokens of the tool call around the answers, and the margin allowed over the expected length of a response
+TOOL_CALL_TOKENS = 40
+MAX_TOKENS_MARGIN = 1.5
+
+# The tool input field listing the columns of any answers the LLM is unsure of, and its expected tokens
+UNSURE_FIELD = "unsure"
+UNSURE_TOKENS = 20
+
+
+def tool_definition(questions: list, name=TOOL_NAME, confidence=False):
+    """Build the definition of a tool whose input has one field per question.
+
+    Args:
+        questions (list): The app's schema: (column name, type, question[, dict of json schema keywords]) tuples.
+        name (str): The name of the tool.
+        confidence (bool): Also ask for the columns of any answers the LLM is unsure of, as a list in the field
+            `UNSURE_FIELD`, so that they can be asked again of a larger model; see `AnswerChecker`.
+
+    Returns:
+        dict: The tool definition, to pass as `tool` to `cll.llm_response()` and friends.
+
+    Raises:
+        ValueError: A question has a type that is not in `FIELD_TYPES`.
+
+    Typical usage:
+        tool = cso.tool_definition(QUESTIONS)
+    """
+
+    properties = {}
+    for column, field_type, question, *keywords in questions:
+        if field_type not in FIELD_TYPES:
+            raise ValueError(f"Question '{column}' has type '{field_type}'; expected one of {FIELD_TYPES}.")
+        properties[column] = {
+            "type": [field_type, "null"], "description": question, **(keywords[0] if keywords else {})}
+    if confidence:
+        properties[UNSURE_FIELD] = {
+            "type": "array", "items": {"type": "string", "enum": [question[0] for question in questions]},
+            "description": "The names of any answers you are not confident of, e.g. because you had to guess; an "
+                           "empty list if you are confident of them all."}
+
+    return {
+        "name": name,
+        "description": "Record your answer to every question, using null only if the answer is not given.",
+        "input_schema": {"type": "object", "properties": properties, "required": list(properties)}}
+
+
+def numbered_questions(questions: list, columns=None):
+    """List the questions, numbered in schema order, to include in a prompt.
+
+    Args:
+        questions (list): The app's schema.
+        columns (list): Only list the questions for these columns, keeping their numbers; None for all.
+
+    Returns:
+        str: One question per line, e.g. '1. What is the role title?'.
+
+    Typical usage:
+        prompt = f"Answer the following questions: {cso.numbered_questions(QUESTIONS)}"
+    """
+
+    return "\n".join(f"{n}. {question}" for n, (column, _, question, *_) in enumerate(questions, start=1)
+                     if columns is None or column in columns)
+
+
+def shard_questions(questions: list, shards=None):
+    """Split the questions into shards, to be asked in separate calls.
+
+    Args:
+        questions (list): The app's schema.
+        shards (dict): The columns in each shard, keyed on shard name, e.g. {'facts': ['role_title', ...]}; any
+            columns not listed form a last shard. None to ask every question in one call.
+
+    Returns:
+        list: The questions in each shard, keeping their schema order.
+
+    Raises:
+        ValueError: A shard lists a column that is not in the schema, or a column is in more than one shard.
+
+    Typical usage:
+        list_shards = cso.shard_questions(QUESTIONS, QUESTION_SHARDS)
+    """
+
+    if not shards:
+        return [list(questions)]
+
+    list_columns = [column for columns in shards.values() for column in columns]
+    unknown = set(list_columns).difference(question[0] for question in questions)
+    if unknown:
+        raise ValueError(f"Shards list columns that are not questions: {', '.join(sorted(unknown))}.")
+    if len(set(list_columns)) < len(list_columns):
+        raise ValueError("A column is listed in more than one shard.")
+
+    list_shards = [[question for question in questions if question[0] in columns] for columns in shards.values()]
+    list_shards.append([question for question in questions if question[0] not in list_columns])
+    return [shard for shard in list_shards if shard]
+
+
+def answer_max_tokens(questions: list, margin=MAX_TOKENS_MARGIN, confidence=False):
+    """Size max_tokens for a response answering the questions, from the expected length of each answer.
+
+    Args:
+        questions (list): The questions, e.g. one shard of the app's schema.
+        margin (float): Multiplies the expected length, so that longer answers than usual still fit; a response cut
+            off anyway is asked for again with a larger limit when streamed, see `cll.llm_response()`.
+        confidence (bool): The response also lists the answers the LLM is unsure of; see `tool_definition()`.
+
+    Returns:
+        int: The maximum number of tokens for the response.
+
+    Typical usage:
+        max_tokens = cso.answer_max_tokens(QUESTIONS)
+    """
+
+    tokens = TOOL_CALL_TOKENS
+    for column, field_type, _, *keywords in questions:
+        max_length = (keywords[0] if keywords else {}).get("maxLength")
+        tokens += cll.estimate_tokens(json.dumps(column) + ": ,")
+        tokens += cll.estimate_tokens("x" * max_length) if max_length else ANSWER_TOKENS[field_type]
+    if confidence:
+        tokens += UNSURE_TOKENS
+    return math.ceil(tokens * margin)
+
+
+def _check_value(value, field_type: str, keywords: dict):
+    """Return the answer converted to the field's type, or raise ValueError if it cannot be."""
+    if value is None:
+        return None
+    if field_type == "string":
+        if isinstance(value, (dict, list)):
+            raise ValueError("expected a string")
+        return value if isinstance(value, str) else json.dumps(value)
+    if field_type == "boolean":
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ("yes", "true", "no", "false"):
+            return value.strip().lower() in ("yes", "true")
+        raise ValueError("expected true or false")
+
+    # Numbers may come back as strings, e.g. "7"
+    if isinstance(value, bool):
+        raise ValueError(f"expected an {field_type}")
+    number = float(value)
+    if field_type == "integer":
+        if not number.is_integer():
+            raise ValueError("expected an integer")
+        number = int(number)
+    if not keywords.get("minimum", number) <= number <= keywords.get("maximum", number):
+        raise ValueError(f"expected a value from {keywords.get('minimum')} to {keywords.get('maximum')}")
+    return number
+
+
+def validate_answers(response_dict: dict, questions: list):
+    """Check a response against the schema, keeping the answers that fit it.
+
+    Answers keyed by question number, as in responses saved before the schema was introduced, are matched to their
+    column by position.
+
+    Args:
+        response_dict (dict): The answers from the LLM.
+        questions (list): The app's schema.
+
+    Returns:
+        dict: The valid answers, keyed by column name, in schema order.
+        list: The columns whose answers are missing or invalid.
+
+    Typical usage:
+        dict_answers, list_missing = cso.validate_answers(response_dict, QUESTIONS)
+    """
+
+    dict_answers = {}
+    list_missing = []
+    for n, (column, field_type, _, *keywords) in enumerate(questions, start=1):
+        value = response_dict.get(column, response_dict.get(str(n), NOT_ANSWERED))
+        try:
+            if value in (NOT_ANSWERED, cll.PARSE_ERROR):
+                raise ValueError("no answer")
+            dict_answers[column] = _check_value(value, field_type, keywords[0] if keywords else {})
+        except (TypeError, ValueError):
+            list_missing.append(column)
+    return dict_answers, list_missing
+
+
+def unsure_columns(response_dict: dict, questions: list):
+    """Return the columns of the answers that the LLM listed as unsure of, in schema order.
+
+    Args:
+        response_dict (dict): The answers from the LLM, from a tool built with `confidence=True`.
+        questions (list): The app's schema.
+
+    Returns:
+        list: The column names; empty if the response has no valid list of them.
+
+    Typical usage:
+        list_unsure = cso.unsure_columns(response_dict, QUESTIONS)
+    """
+
+    unsure = response_dict.get(UNSURE_FIELD)
+    if not isinstance(unsure, list):
+        return []
+    return [question[0] for question in questions if question[0] in unsure]
+
+
+class AnswerChecker:
+    """Check responses against their questions as they arrive, then ask again for the missing answers all together.
+
+    `check()` makes no LLM calls, so it can be called from the `on_result` of `cll.llm_response_many()` or
+    `cll.llm_response_batch()` without holding up the other responses. A response with every answer is passed straight
+    to `on_complete`; the rest are kept until `ask_again()`, which asks for their missing or invalid answers in rounds
+    of concurrent calls, up to `MAX_REASKS` rounds, with the original prompt and a tool for just those questions. Any
+    still missing are recorded as `NOT_ANSWERED`.
+
+    With `escalate_to`, the answers that a response from another model was unsure of, or could not give, are instead
+    asked again of that model, e.g. the larger model for the responses from the smaller one. An unsure answer is kept
+    if the larger model does not give a valid one, or gives null.
+
+    Args:
+        system_context (str): The system context sent with the prompts.
+        on_complete (callable): Function called as `on_complete(key, dict_answers)` in the calling thread once a
+            response's answers are complete, with one answer per question, keyed by column name, in schema order.
+        max_concurrency (int): The maximum number of re-asks in flight at any one time.
+        escalate_to (str): Optional larger model to ask again for the answers that are unsure or missing.
+
+    Typical usage:
+        checker = cso.AnswerChecker(SYSTEM_CONTEXT, on_complete=store_answers, max_concurrency=MAX_CONCURRENCY)
+        cll.llm_response_many(
+            list_prompts, SYSTEM_CONTEXT, options, max_concurrency=MAX_CONCURRENCY,
+            on_result=lambda i, response_str: checker.check(i, response_str, list_prompts[i], QUESTIONS, options))
+        checker.ask_again()
+    """
+
+    def __init__(self, system_context: str, on_complete, max_concurrency=cll.MAX_CONCURRENCY, escalate_to=None):
+        self.system_context = system_context
+        self.on_complete = on_complete
+        self.max_concurrency = max_concurrency
+        self.escalate_to = escalate_to
+
+        # The responses with answers still to ask again for, each a dict with its questions, prompt and answers so far
+        self._pending = []
+
+    def check(self, key, response_str: str, prompt: str, questions: list, options=None):
+        """Check one response against its questions, completing it if every answer is valid.
+
+        Args:
+            key (object): The response's key, passed back to `on_complete`, e.g. the index of its prompt.
+            response_str (str): The response from the LLM: the tool's input as json, or free text containing json.
+            prompt (str): The prompt that the response answers.
+            questions (list): The schema of the questions the prompt asks.
+            options (cll.CallOptions): The options the prompt was sent with, including the model that gave the
+                response; the missing questions are asked again with the same options, but their own tool.
+        """
+
+        options = cll.CallOptions() if options is None else options
+        response_dict = cll.convert_llm_response_to_dict(response_str)
+        dict_answers, list_missing = validate_answers(response_dict, questions)
+        reask_note = "Some of your answers were missing or invalid. Answer only these questions:"
+
+        # Hand the answers the model was unsure of, with any it could not give, to the larger model
+        if self.escalate_to is not None and self.escalate_to != options.model:
+            list_unsure = unsure_columns(response_dict, questions)
+            list_missing = [column for column, *_ in questions if column in list_missing or column in list_unsure]
+            if list_missing:
+                print(f"Escalating {len(list_missing)} unsure or missing answers to {self.escalate_to}: "
+                      f"{', '.join(list_missing)}")
+                cme.record("escalation", model=options.model, escalate_to=self.escalate_to, answers=len(list_missing))
+                options = options._replace(model=self.escalate_to)
+                reask_note = "Answer only these questions:"
+
+        self._settle({"key": key, "questions": questions, "prompt": prompt, "options": options, "note": reask_note,
+                      "answers": dict_answers, "missing": list_missing})
+
+    def ask_again(self):
+        """Ask again for the answers missing from every response checked so far, in rounds of concurrent calls.
+
+        Raises:
+            Exception: The first error from any of the LLM calls.
+        """
+
+        for _ in range(MAX_REASKS):
+            if len(self._pending) == 0:
+                break
+            list_pending, self._pending = self._pending, []
+            print(f"Asking again for missing or invalid answers to {len(list_pending)} responses")
+            list_prompts = []
+            list_options = []
+            for pending in list_pending:
+                print(f"Asking again for {len(pending['missing'])} missing or invalid answers: "
+                      f"{', '.join(pending['missing'])}")
+                list_prompts.append(pending["prompt"] + "\n" + pending["note"] + "\n"
+                                    + numbered_questions(pending["questions"], columns=pending["missing"]))
+                list_options.append(pending["options"]._replace(tool=tool_definition(
+                    [question for question in pending["questions"] if question[0] in pending["missing"]])))
+            cll.llm_response_many(
+                prompts=list_prompts,
+                system_context=self.system_context,
+                options=list_options,
+                max_concurrency=self.max_concurrency,
+                on_result=lambda i, reask_str, list_pending=list_pending: self._merge(list_pending[i], reask_str))
+
+        # Complete the responses whose answers never arrived
+        list_pending, self._pending = self._pending, []
+        for pending in list_pending:
+            self._complete(pending)
+
+    def _merge(self, pending: dict, reask_str: str):
+        """Add the valid answers from a re-ask to a response's answers."""
+        list_reask = [question for question in pending["questions"] if question[0] in pending["missing"]]
+        dict_reask, pending["missing"] = validate_answers(cll.convert_llm_response_to_dict(reask_str), list_reask)
+
+        # A null answer does not replace one the response already has, e.g. the smaller model's unsure answer
+        pending["answers"].update({column: value for column, value in dict_reask.items()
+                                   if value is not None or column not in pending["answers"]})
+        self._settle(pending)
+
+    def _settle(self, pending: dict):
+        """Complete a response if it has every answer, otherwise keep it to ask again."""
+        if pending["missing"]:
+            self._pending.append(pending)
+        else:
+            self._complete(pending)
+
+    def _complete(self, pending: dict):
+        """Pass a response's answers to `on_complete`, one per question in schema order."""
+        dict_answers = pending["answers"]
+        self.on_complete(
+            pending["key"], {column: dict_answers.get(column, NOT_ANSWERED) for column, *_ in pending["questions"]})
+
+
+def complete_answers(response_str: str, questions: list, prompt: str, system_context: str, options=None):
+    """Convert a response to a dict of answers, asking again for any that are missing or invalid.
+
+    Only the missing questions are asked again, with the original prompt and a tool for just those questions, up to
+    `MAX_REASKS` times; any still missing are recorded as `NOT_ANSWERED`. The calls block, so this suits one response
+    in a worker thread; for many responses, e.g. in the `on_result` of `cll.llm_response_many()`, use `AnswerChecker`
+    to ask again for all of them at once.
+
+    Args:
+        response_str (str): The response from the LLM: the tool's input as json, or free text containing json.
+        questions (list): The app's schema.
+        prompt (str): The prompt that the response answers.
+        system_context (str): The system context sent with the prompt.
+        options (cll.CallOptions): The options the prompt was sent with; the missing questions are asked again with
+            the same options, but their own tool.
+
+    Returns:
+        dict: One answer per question, keyed by column name, in schema order.
+
+    Typical usage:
+        response_dict = cso.complete_answers(response_str, QUESTIONS, prompt, SYSTEM_CONTEXT, options)
+    """
+
+    dict_complete = {}
+    checker = AnswerChecker(system_context, on_complete=dict_complete.__setitem__)
+    checker.check(0, response_str, prompt, questions, options)
+    checker.ask_again()
+    return dict_complete[0]
@@ -0,0 +1,251 @@
+"""This module provides common functions for fetching web pages concurrently and politely.
+
+- A bounded pool of worker threads, each with its own keep-alive `requests.Session`, so repeat requests to a host
+  re-use the open connection instead of paying a fresh TCP/TLS handshake.
+- A limit on concurrent requests per host, so that one site is not hit by every worker at once.
+- Retries with exponential backoff and jitter for connection errors, timeouts, 429 and 5xx responses, honouring any
+  'Retry-After' header.
+- An on-disk HTTP cache: pages with an 'ETag' or 'Last-Modified' header are saved, and re-runs send a conditional
+  GET, so unchanged pages come back as a small '304 Not Modified' instead of being downloaded again.
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from . import metrics as cme
+from . import paths as cpa
+
+# When using requests, some websites block requests that do not resemble typical browser requests.
+# To mimic a browser we add a 'User-Agent' header, which should convert some 403 status codes to 200.
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/58.0.3029.110 Safari/537.36"}
+
+# Fail fast when a host can't be reached, but allow slow pages time to arrive
+TIMEOUT = (5, 30)
+
+# Responses worth retrying, and the limits on retries
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+
+# Directory for cached pages: '[sha256 of url].json' holds the validators and '[sha256 of url].body' the content
+DIR_HTTP_CACHE = cpa.DIR_CACHE + "http/"
+
+_THREAD_LOCAL = threading.local()
+_HOST_LIMITS = {}
+_HOST_LIMITS_LOCK = threading.Lock()
+
+
+def _get_session():
+    """Return this worker thread's keep-alive session, creating it on first use."""
+    import requests  # pylint: disable=import-outside-toplevel
+    from requests.adapters import HTTPAdapter  # pylint: disable=import-outside-toplevel
+
+    session = getattr(_THREAD_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+        session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+        _THREAD_LOCAL.session = session
+    return session
+
+
+def _host_limit(url: str, max_per_host: int):
+    """Return the semaphore limiting concurrent requests to the url's host."""
+    key = (urlsplit(url).netloc.lower(), max_per_host)
+    with _HOST_LIMITS_LOCK:
+        if key not in _HOST_LIMITS:
+            _HOST_LIMITS[key] = threading.BoundedSemaphore(max_per_host)
+        return _HOST_LIMITS[key]
+
+
+def _retry_after_seconds(response):
+    """Read a 'Retry-After' header, given either in seconds or as an HTTP date; None if absent or invalid."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt: int, response=None):
+    """Seconds to wait before the next attempt: the server's 'Retry-After' if given, else exponential with jitter."""
+    retry_after = _retry_after_seconds(response)
+    if retry_after is None:
+        retry_after = BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+    return min(retry_after, MAX_BACKOFF_SECONDS)
+
+
+def _cache_paths(url: str):
+    """Return the paths of the metadata and body files for a cached url."""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(DIR_HTTP_CACHE, key + ".json"), os.path.join(DIR_HTTP_CACHE, key + ".body")
+
+
+def _load_cached(url: str):
+    """Load the cached metadata and body for a url; (None, None) if it isn't cached."""
+    path_meta, path_body = _cache_paths(url)
+    try:
+        with open(path_meta, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(path_body, "rb") as f:
+            body = f.read()
+    except (OSError, ValueError):
+        return None, None
+    return meta, body
+
+
+def _save_cached(url: str, response):
+    """Cache a successful response if it carries a validator that allows a conditional GET next time."""
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag is None and last_modified is None:
+        return
+
+    path_meta, path_body = _cache_paths(url)
+    os.makedirs(DIR_HTTP_CACHE, exist_ok=True)
+    with open(path_body + ".tmp", "wb") as f:
+        f.write(response.content)
+    os.replace(path_body + ".tmp", path_body)
+    meta = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "encoding": response.encoding or response.apparent_encoding,
+        "fetched": time.time()}
+    with open(path_meta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path_meta + ".tmp", path_meta)
+
+
+def fetch_url(url: str, max_per_host=2, max_retries=MAX_RETRIES, use_cache=True):
+    """Fetch one web page, with retries, a per-host concurrency limit and a conditional GET cache.
+
+    Args:
+        url (str): The url of the page.
+        max_per_host (int): The maximum number of concurrent requests to the url's host.
+        max_retries (int): The number of retries after the first attempt for errors worth retrying.
+        use_cache (bool): Revalidate a cached copy with a conditional GET and cache new pages with validators.
+
+    Returns:
+        dict: The result, with keys:
+            'url' (str): the url requested.
+            'status_code' (int): the final HTTP status, 200 for a page served from the cache, None if no response.
+            'text' (str): the page content, or None if unsuccessful.
+            'content' (bytes): the raw page content, or None if unsuccessful.
+            'encoding' (str): the character encoding of the content, or None if unsuccessful.
+            'from_cache' (bool): whether the server answered '304 Not Modified' and the cached copy was used.
+            'attempts' (int): the number of requests made.
+            'error' (str): the last exception if there was no response, else None.
+
+    Typical usage:
+        result = cwf.fetch_url("https://en.wikipedia.org/wiki/Large_language_model")
+    """
+
+    meta, body = _load_cached(url) if use_cache else (None, None)
+    headers = {}
+    if meta is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    # Imported here rather than with the module, so that importing an app does not pay for it until a page is fetched
+    import requests  # pylint: disable=import-outside-toplevel
+
+    start = time.perf_counter()
+    result = {"url": url, "status_code": None, "text": None, "content": None, "encoding": None, "from_cache": False,
+              "attempts": 0, "error": None}
+    host_limit = _host_limit(url, max_per_host)
+    for attempt in range(max_retries + 1):
+        response = None
+        result["attempts"] = attempt + 1
+
+        # Hold the host's slot only while the request is in flight, not while backing off
+        with host_limit:
+            try:
+                response = _get_session().get(url, headers=headers, timeout=TIMEOUT)
+                result["status_code"] = response.status_code
+                result["error"] = None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                result["error"] = str(e)
+            except requests.RequestException as e:
+                result["error"] = str(e)
+                break
+
+        if response is not None and response.status_code not in RETRY_STATUS_CODES:
+            break
+        if attempt < max_retries:
+            time.sleep(_backoff_seconds(attempt, response))
+
+    if response is None:
+        cme.record("http", url=url, wall_s=time.perf_counter() - start, status_code=None, attempts=result["attempts"],
+                   from_cache=False, bytes=0, error=result["error"])
+        return result
+
+    if response.status_code == 304 and meta is not None:
+        result.update({
+            "status_code": 200,
+            "content": body,
+            "encoding": meta.get("encoding") or "utf-8",
+            "text": body.decode(meta.get("encoding") or "utf-8", errors="replace"),
+            "from_cache": True})
+    elif response.status_code == 200:
+        result.update({
+            "content": response.content, "text": response.text,
+            "encoding": response.encoding or response.apparent_encoding})
+        if use_cache:
+            _save_cached(url, response)
+
+    cme.record("http", url=url, wall_s=time.perf_counter() - start, status_code=result["status_code"],
+               attempts=result["attempts"], from_cache=result["from_cache"], bytes=len(response.content or b""))
+    return result
+
+
+def fetch_urls(dict_urls: dict, max_workers=8, max_per_host=2, use_cache=True, on_result=None):
+    """Fetch several web pages concurrently, retrying each up to `MAX_RETRIES` times.
+
+    Args:
+        dict_urls (dict): The url of each page, keyed on id, e.g. 'tb_0001'.
+        max_workers (int): The maximum number of requests in flight at any one time, across all hosts.
+        max_per_host (int): The maximum number of concurrent requests to any one host.
+        use_cache (bool): Revalidate cached copies with a conditional GET and cache new pages with validators.
+        on_result (callable): Optional function called as `on_result(page_id, result)` in the calling thread as
+            soon as each page arrives, e.g. to extract its text while the other pages download.
+
+    Returns:
+        dict: The result of `fetch_url()` for each page, keyed on id, in the same order as `dict_urls`.
+
+    Typical usage:
+        dict_results = cwf.fetch_urls(dict_urls_to_get, max_workers=8, max_per_host=2)
+    """
+
+    dict_results = dict.fromkeys(dict_urls)
+    if len(dict_urls) == 0:
+        return dict_results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(dict_urls))) as executor:
+        futures = {
+            executor.submit(fetch_url, url, max_per_host, use_cache=use_cache): page_id
+            for page_id, url in dict_urls.items()}
+        for future in as_completed(futures):
+            page_id = futures[future]
+            dict_results[page_id] = future.result()
+            if on_result is not None:
+                on_result(page_id, dict_results[page_id])
+
+    return dict_results
@@ -0,0 +1,120 @@
+"""This module searches the accumulated results of the apps by keyword and by field, via a full-text search index.
+
+Each app's index is kept in '[root]/cache/search/' and brought up to date with the app's '.jsonl' store before every
+search, so it includes results from runs that are still going; see common_lib/search_index.py.
+
+Typical usage:
+    llm-apps search shortlist mlops --where "salary_max>60000"
+    llm-apps search toolbox "primary_tool: pandas" --show title,primary_tool
+    llm-apps search compare --where "requirements_score>=8" --order-by=-success_score
+
+    list_results = search.search("shortlist", "mlops", filters=[("salary_max", ">", 60000)])
+"""
+
+import importlib
+import time
+
+from .common_lib import paths as cpa
+from .common_lib import search_index as csi
+
+# Where the indexes are kept; they can be deleted at any time and are rebuilt on the next search
+DIR_SEARCH_INDEX = cpa.DIR_CACHE + "search/"
+
+# The apps whose results can be searched, keyed on name: the app's module, the fields that identify one result (a job
+# can be compared with several CVs), and any numeric columns computed from the amounts stated in its text answers,
+# e.g. so that jobs can be filtered on salary
+SOURCES = {
+    "shortlist": ("llm_apps.app_01.app_1_1__shortlist", ("job_id",),
+                  {"salary_min": ("salary_range", min), "salary_max": ("salary_range", max)}),
+    "compare": ("llm_apps.app_01.app_1_2__compare", ("job_id", "cv_filename"), {}),
+    "toolbox": ("llm_apps.app_02.app_2_2__toolbox_summary", ("tb_id",), {})}
+
+# Columns shown for each result on the command line, after its id, unless others are chosen with --show
+SHOW_COLUMNS = {
+    "shortlist": ["role_title", "company_name", "location", "salary_range"],
+    "compare": ["job_filename", "cv_filename", "requirements_score", "success_score"],
+    "toolbox": ["title", "primary_tool", "primary_domain"]}
+
+
+def open_index(source: str, rebuild=False):
+    """Open the search index of an app's results, loading any results added since it was last used.
+
+    Args:
+        source (str): The name of the app's results, a key of `SOURCES`.
+        rebuild (bool): Drop the index and load every result again.
+
+    Returns:
+        csi.SearchIndex: The index, up to date; close it when done.
+
+    Raises:
+        ValueError: The source is not in `SOURCES`.
+
+    Typical usage:
+        with search.open_index("toolbox") as index:
+            list_results = index.search("pandas")
+    """
+
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source '{source}'; expected one of: {', '.join(SOURCES)}.")
+    module, id_fields, derived = SOURCES[source]
+    app = importlib.import_module(module)
+
+    # Every column is text except the answers to questions of another type
+    columns = {column: "string" for column in app.OUTPUT_COLUMNS}
+    columns.update({column: field_type for column, field_type, *_ in app.QUESTIONS})
+
+    index = csi.SearchIndex(
+        DIR_SEARCH_INDEX + app.FNAME_OUTPUT + ".sqlite", app.DIR_OUTPUT + app.FNAME_OUTPUT + ".jsonl", columns,
+        id_fields=id_fields, derived=derived)
+    index.update(rebuild=rebuild)
+    return index
+
+
+def search(source: str, query=None, filters=(), order_by=None, limit=csi.SEARCH_LIMIT):
+    """Search one app's results by keyword and by field, best matches first.
+
+    Args:
+        source (str): The name of the app's results, a key of `SOURCES`.
+        query (str): Optional full-text query, e.g. 'mlops' or 'primary_tool: pandas'; see `csi.SearchIndex.search()`.
+        filters (list): (column, operator, value) tuples that every result must meet, e.g. [("sentiment", ">=", 2)].
+        order_by (str): Optional column to sort by, descending if it starts with '-'.
+        limit (int): The maximum number of results to return.
+
+    Returns:
+        list: One dict per result, with every column and the relevance 'score'.
+
+    Typical usage:
+        list_results = search.search("shortlist", "mlops", filters=[("salary_max", ">", 60000)])
+    """
+
+    with open_index(source) as index:
+        return index.search(query, filters, order_by, limit)
+
+
+def run(args):
+    """Print the results of a search from the command line, as parsed by `cli.build_parser()`.
+
+    Returns:
+        int: The exit status; 0 for success, 2 for an invalid search.
+    """
+
+    start = time.perf_counter()
+    try:
+        filters = [csi.parse_filter(text) for text in args.where]
+        with open_index(args.source, rebuild=args.rebuild) as index:
+            n_results = index.count()
+            update_s = time.perf_counter() - start
+            start = time.perf_counter()
+            list_results = index.search(args.query, filters, args.order_by, args.limit)
+    except ValueError as e:
+        print(e)
+        return 2
+    search_s = time.perf_counter() - start
+
+    list_show = args.show.split(",") if args.show else SHOW_COLUMNS[args.source]
+    for result in list_results:
+        score = f" ({result['score']:.2f})" if result["score"] is not None else ""
+        print(f"{result['doc_id']}{score}: " + " | ".join(str(result.get(column)) for column in list_show))
+    print(f"{len(list_results)} of {n_results} results in {1000 * search_s:.1f}ms "
+          f"(index updated in {1000 * update_s:.0f}ms)")
+    return 0
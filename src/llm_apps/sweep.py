@@ -0,0 +1,276 @@
+"""This module asks an app's questions of its documents across a grid of personas and temperatures, to compare them.
+
+Each cell of the grid is one of the personas from `cll.llm_contexts()`, e.g. 'Film noir', at one temperature, and
+every document is asked the app's questions once per cell, concurrently. The system context is the same for every
+call and the persona follows the document in the prompt, so the document text is a prefix that every cell shares: the
+first cell to reach a document puts it in the prompt cache, and the other cells of that document read it from there.
+The API only caches prefixes of at least 1024 tokens, so short documents are sent in full for every cell.
+
+The answers are saved next to the app's output as one wide table, with latency, tokens and cost for each cell:
+- '[FNAME_OUTPUT]__sweep.txt': one row per document and question, with one column per cell, e.g. 'Sci-Fi @ 0.5'.
+- '[FNAME_OUTPUT]__sweep_cells.txt': one row per cell.
+
+Typical usage:
+    llm-apps sweep toolbox
+    llm-apps sweep shortlist --contexts Normal "Film noir" --temperatures 0 1 --docs 3
+
+    dict_table, dict_cells = sweep.run_sweep("toolbox", contexts=["Normal", "Sci-Fi"], temperatures=[0, 1])
+"""
+
+import csv
+import importlib
+import os
+
+from .common_lib import llms as cll
+from .common_lib import metrics as cme
+from .common_lib import misc_utils as clm
+from .common_lib import parse_pool as cpp
+from .common_lib import result_store as crs
+from .common_lib import structured_output as cso
+
+# The apps whose documents and questions can be swept, keyed on name
+SOURCES = {
+    "shortlist": "llm_apps.app_01.app_1_1__shortlist",
+    "toolbox": "llm_apps.app_02.app_2_2__toolbox_summary"}
+
+# The system context of every call; it comes before the document in the prompt cache, so it must not vary by persona
+SYSTEM_CONTEXT = """
+    You are a workplace assistant. Answer in the persona described after each document."""
+
+# The temperatures of the grid, unless others are chosen
+TEMPERATURES = [0, 0.5, 1]
+
+# Documents taken from the app's input folder, in filename order; every one is asked the questions once per cell
+MAX_DOCS = 5
+
+# Maximum number of calls in flight at the same time, across every document and cell
+MAX_CONCURRENCY = 8
+
+# Some personas answer at length, so max_tokens allows for longer answers than the apps expect
+MAX_TOKENS_MARGIN = 2.5
+
+# Stream each response, so that each cell's time to first token is measured, and ask again for any that is not the
+# json object asked for
+STREAM_JSON = True
+
+# Start of the prompt for each document, the same for every cell so that it can be cached
+DOCUMENT_PROMPT = """
+    Below is a document, followed by the persona in which to answer some questions about it, and the questions.
+
+    Document:
+    {text}
+    """
+
+# Rest of the prompt for each cell
+CELL_PROMPT = """
+    Persona:
+    {persona}
+
+    In that persona, answer the following questions about the document above.
+    Use British spelling instead of American spelling.
+    Record your answers with the {tool} tool.
+    {questions}
+
+    Return "Unknown" for a particular piece of information if it is not given.
+    """
+
+
+def cell_name(context: str, temperature: float):
+    """Name a cell of the grid, e.g. 'Sci-Fi @ 0.5', as used for its column in the table."""
+    return f"{context} @ {temperature:g}"
+
+
+def grid_cells(contexts=None, temperatures=None):
+    """Check the personas and temperatures of a grid, and list its cells.
+
+    Args:
+        contexts (list): The names of the personas, keys of `cll.llm_contexts()`; None for all.
+        temperatures (list): The temperatures; None for `TEMPERATURES`.
+
+    Returns:
+        list: The cells, as (persona name, temperature) tuples, with the temperatures of each persona together.
+
+    Raises:
+        ValueError: A persona is unknown, or a temperature is not between 0 and 1.
+    """
+
+    dict_contexts = cll.llm_contexts()
+    contexts = list(dict_contexts) if contexts is None else contexts
+    unknown = [context for context in contexts if context not in dict_contexts]
+    if unknown:
+        raise ValueError(f"Unknown personas: {', '.join(unknown)}; expected any of: {', '.join(dict_contexts)}.")
+    temperatures = TEMPERATURES if temperatures is None else temperatures
+    if not all(0 <= temperature <= 1 for temperature in temperatures):
+        raise ValueError("Claude LLM requires temperature to be between 0 and 1.")
+    return [(context, temperature) for context in contexts for temperature in temperatures]
+
+
+def build_prompts(dict_texts: dict, list_cells: list, questions: list):
+    """Build one prompt per document and cell; the prompts of a document share its text as their cacheable prefix.
+
+    Args:
+        dict_texts (dict): The text of each document, keyed on document id.
+        list_cells (list): The cells, as (persona name, temperature) tuples.
+        questions (list): The app's schema.
+
+    Returns:
+        list: One (document id, persona name, temperature, prompt prefix, prompt) tuple per document and cell.
+    """
+
+    dict_contexts = cll.llm_contexts()
+    numbered = cso.numbered_questions(questions)
+    list_prompts = []
+    for doc_id, doc_text in dict_texts.items():
+        prefix = DOCUMENT_PROMPT.format(text=doc_text)
+        for context, temperature in list_cells:
+            prompt = CELL_PROMPT.format(persona=dict_contexts[context], tool=cso.TOOL_NAME, questions=numbered)
+            list_prompts.append((doc_id, context, temperature, prefix, prompt))
+    return list_prompts
+
+
+def run_sweep(source: str, contexts=None, temperatures=None, n_docs=MAX_DOCS):
+    """Ask an app's questions of its documents in every cell of a grid of personas and temperatures.
+
+    The answers are not asked for again if they are missing or invalid, as the apps do, so that every cell is one call
+    per document; a missing answer is recorded as `cso.NOT_ANSWERED`.
+
+    Args:
+        source (str): The name of the app, a key of `SOURCES`.
+        contexts (list): The names of the personas, keys of `cll.llm_contexts()`; None for all.
+        temperatures (list): The temperatures; None for `TEMPERATURES`.
+        n_docs (int): The maximum number of documents, taken from the app's input folder in filename order.
+
+    Returns:
+        dict: The table, keyed on (document id, question column): the document's filename, then the answer of each
+            cell, keyed on cell name.
+        dict: For each cell, keyed on cell name: its calls, latency, tokens and cost, from `cme.llm_summary_by()`.
+
+    Raises:
+        ValueError: The source or a persona is unknown, or a temperature is not between 0 and 1.
+
+    Typical usage:
+        dict_table, dict_cells = sweep.run_sweep("toolbox", contexts=["Normal", "Sci-Fi"], temperatures=[0, 1])
+    """
+
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source '{source}'; expected one of: {', '.join(SOURCES)}.")
+    list_cells = grid_cells(contexts, temperatures)
+    app = importlib.import_module(SOURCES[source])
+
+    # Load the first documents in the input folder, parsing them in worker processes; ids as in the app
+    list_filenames = clm.list_docx_in_directory(app.DIR_INPUT_DOCX)[:n_docs]
+    dict_loaded = cpp.parse_many(
+        clm.load_docx_to_str, {filename[:7]: (app.DIR_INPUT_DOCX + filename,) for filename in list_filenames})
+    list_prompts = build_prompts(
+        {doc_id: doc_text for doc_id, (_, doc_text) in dict_loaded.items()}, list_cells, app.QUESTIONS)
+    del dict_loaded
+
+    # The table has a row for every document and question, filled in cell by cell as the responses arrive
+    dict_table = {
+        (filename[:7], column): {"filename": filename} for filename in list_filenames for column, *_ in app.QUESTIONS}
+
+    def store_response(i: int, response_str: str):
+        """Check one response against the questions and add its answers to the table."""
+        doc_id, context, temperature, *_ = list_prompts[i]
+        dict_answers, _ = cso.validate_answers(cll.convert_llm_response_to_dict(response_str), app.QUESTIONS)
+        for column, *_ in app.QUESTIONS:
+            dict_table[(doc_id, column)][cell_name(context, temperature)] = dict_answers.get(column, cso.NOT_ANSWERED)
+
+    # Send every document and cell concurrently; each call is tagged with its cell, for the per-cell stats
+    print(f"Sweeping {len(list_filenames)} documents x {len(list_cells)} cells: {len(list_prompts)} calls")
+    options = cll.CallOptions(
+        max_tokens=cso.answer_max_tokens(app.QUESTIONS, margin=MAX_TOKENS_MARGIN),
+        tool=cso.tool_definition(app.QUESTIONS), stream_json=STREAM_JSON)
+    cll.llm_response_many(
+        prompts=[prompt for *_, prompt in list_prompts],
+        system_context=SYSTEM_CONTEXT,
+        options=[
+            options._replace(temperature=temperature, prompt_prefix=prefix,
+                             tags={"cell": cell_name(context, temperature)})
+            for _, context, temperature, prefix, _ in list_prompts],
+        max_concurrency=MAX_CONCURRENCY,
+        on_result=store_response)
+
+    dict_by_cell = cme.llm_summary_by("cell")
+    dict_cells = {cell_name(*cell): dict_by_cell.get(cell_name(*cell)) for cell in list_cells}
+    return dict_table, dict_cells
+
+
+def save_sweep(path_output: str, dict_table: dict, dict_cells: dict):
+    """Save the table of answers and the stats of each cell as pipe-delimited txt files.
+
+    Args:
+        path_output (str): The path of the output files, excluding '__sweep.txt' and '__sweep_cells.txt'.
+        dict_table (dict): The table from `run_sweep()`.
+        dict_cells (dict): The stats of each cell from `run_sweep()`.
+    """
+
+    os.makedirs(os.path.dirname(path_output), exist_ok=True)
+    with open(path_output + "__sweep.txt", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="|", lineterminator=os.linesep)
+        writer.writerow(["doc_id", "filename", "question"] + list(dict_cells))
+        for (doc_id, column), row in dict_table.items():
+            writer.writerow([doc_id, row["filename"], column] + [crs.txt_value(row.get(cell)) for cell in dict_cells])
+
+    list_stats = ["calls", "p50_s", "p95_s", "ttft_p50_s", "input_tokens", "cache_read_input_tokens", "output_tokens",
+                  "cost_usd"]
+    with open(path_output + "__sweep_cells.txt", "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, delimiter="|", lineterminator=os.linesep)
+        writer.writerow(["cell"] + list_stats)
+        for cell, dict_stats in dict_cells.items():
+            list_values = [(dict_stats or {}).get(stat) for stat in list_stats]
+            writer.writerow([cell] + [crs.txt_value(round(value, 6) if isinstance(value, float) else value)
+                                      for value in list_values])
+
+
+def format_cells(dict_cells: dict):
+    """Format the stats of each cell as a table, one line per cell, to print at the end of a sweep.
+
+    Returns:
+        str: The table, e.g.
+            >> cell                  calls   p50 s   p95 s  ttft s   input  cached  output      cost
+               Normal @ 0                5    6.12    8.40    0.91   21040     81%    2210   $0.0511
+    """
+
+    lines = [f"{'cell':<24}{'calls':>6}{'p50 s':>8}{'p95 s':>8}{'ttft s':>8}{'input':>9}{'cached':>8}{'output':>8}"
+             f"{'cost':>10}"]
+    for cell, dict_stats in dict_cells.items():
+        if dict_stats is None:
+            lines.append(f"{cell:<24}{0:>6}")
+            continue
+        pct_cached = (100 * dict_stats["cache_read_input_tokens"] / dict_stats["input_tokens"]
+                      if dict_stats["input_tokens"] else 0)
+        lines.append(
+            f"{cell:<24}{dict_stats['calls']:>6}"
+            + "".join(f"{value:>8.2f}" if value is not None else f"{'n/a':>8}"
+                      for value in (dict_stats["p50_s"], dict_stats["p95_s"], dict_stats["ttft_p50_s"]))
+            + f"{dict_stats['input_tokens']:>9}{pct_cached:>7.0f}%{dict_stats['output_tokens']:>8}"
+            + (f"{'$' + format(dict_stats['cost_usd'], '.4f'):>10}" if dict_stats["cost_usd"] is not None else ""))
+    return "\n".join(lines)
+
+
+def run(args):
+    """Run a sweep from the command line, as parsed by `cli.build_parser()`, saving and printing the results.
+
+    Returns:
+        int: The exit status; 0 for success, 2 for an invalid grid.
+    """
+
+    # Import API key as environment variable
+    clm.load_dotenv_all()
+
+    # Record the time, tokens and cost of every LLM call in the sweep
+    cme.start_run("sweep")
+
+    try:
+        dict_table, dict_cells = run_sweep(args.source, args.contexts, args.temperatures, args.docs)
+    except ValueError as e:
+        print(e)
+        return 2
+
+    app = importlib.import_module(SOURCES[args.source])
+    save_sweep(app.DIR_OUTPUT + app.FNAME_OUTPUT, dict_table, dict_cells)
+    print(f"Answers saved to '{app.DIR_OUTPUT + app.FNAME_OUTPUT}__sweep.txt'")
+    print(format_cells(dict_cells))
+    print(cme.report(n_documents=len({doc_id for doc_id, _ in dict_table})))
+    return 0